@@ -10,39 +10,41 @@ Created on Fri Mar 12 11:42:00 2024
 
 import os
 import subprocess
-from datetime import datetime
-import rasterio
-from rasterio.enums import ColorInterp
-import numpy as np
+import http.client
+import io
+import importlib.util
+import json
+import math
+import zipfile
+import warnings
+import hashlib
+import sqlite3
+import tempfile
+from functools import lru_cache
+from contextlib import contextmanager, ExitStack
+import threading
+import time
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import urlsplit, urljoin
+from datetime import datetime, timedelta
 import argparse
-from configparser import RawConfigParser
+from configparser import RawConfigParser, Error as ConfigParserError
+from typing import NamedTuple
 import sys
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Polygon
-import fiona
 import shutil
 
-
-# Import KML driver for reading the KML file
-fiona.supported_drivers["LIBKML"] = (
-    "rw"  # $ you might want to put this line near the imports above the functions
-)
+# The geospatial libraries (numpy, pandas, geopandas, shapely, fiona, rasterio)
+# take seconds to import, so they are imported inside the functions that use
+# them. --help, reading the config file and the downloads stay fast, and
+# PyInstaller still finds the imports.
 
 
-def download_txt_file(base_txt_url, auth_token, metadata_file):
+def enable_kml_driver():
     """
-    This function runs the command line request to download the txt metadata
-    file
-
-    Parameters
-    ----------
-    base_txt_url : STRING
-        base url for metadata download.
-    auth_token : STRING
-        Your MODIS authentication token.
-    metadata_file : STRING
-        The path and new name to your designated folder for the TXT file.
+    This function imports fiona and turns on its KML driver, needed to read
+    and write the KML files.
 
     Returns
     -------
@@ -50,797 +52,6022 @@ def download_txt_file(base_txt_url, auth_token, metadata_file):
 
     """
 
-    command = [
-        "wget",
-        base_txt_url,
-        "--header",
-        f"Authorization: Bearer {auth_token}",  # $ changed the quoting behaviour for shell=False
-        "-O",
-        metadata_file,  # This variable is a file not a dir so maybe rename it?
-    ]
+    import fiona
 
+    # Import KML driver for reading the KML file
+    fiona.supported_drivers["LIBKML"] = "rw"
 
-    try:
-        # Execute the wget command
-        subprocess.run(
-            command, shell=False
-        )  # $ Derek changed this to shell=False, see stack overflow above
-        print("TXT file downloaded successfully.") 
-    except subprocess.CalledProcessError as e:
-        # Handle error if the command fails
-        print("Error downloading TXT file:", e)
 
+# Native HTTP downloader with keep-alive connection pooling ---------------------
+# The LANCE NRT server supports HTTP/1.1 keep-alive, so instead of starting a
+# new wget process (and a new TLS handshake) for every file we keep the
+# connections open and reuse them for the next request to the same host.
 
-# API download from LANCE NRT with token access (Zacharie)
-def download_HDF_file(base_HDF_url, auth_token, download_HDF_folder):
-    """
-    This function runs the command line request to download the HDF file
-    from MODIS
+HTTP_CHUNK_SIZE = 1024 * 1024  # bytes read from the socket at a time
+HTTP_MAX_REDIRECTS = 5
 
-    Parameters
-    ----------
-    base_HDF_url : STRING
-        The base url for the HDF request.
-    auth_token : STRING
-        Your MODIS authentication token.
-    download_HDF_folder : STRING
-        The path to your designated folder for the HDF files.
+# Errors raised when the server has silently closed an idle keep-alive connection
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
 
-    Returns
-    -------
-    str
-        Runs the command line request then returns if the download succeded or not.
 
+class ConnectionPool:
     """
+    A small thread safe pool of idle HTTP(S) connections, keyed by host.
 
-    command = [
-        "wget",
-        base_HDF_url,
-        "--header",
-        f"Authorization: Bearer {auth_token}", 
-        "-P",
-        download_HDF_folder,
-    ]
-
-    try:
-        # Execute the wget command
-        result = subprocess.run(
-            command, shell=False
-        )  # $ Derek changed this to shell=False, see stack overflow above
-        if result.returncode == 0:
-            print("HDF file downloaded successfully.")
-            return "ok"
-        elif result.returncode == 8:
-            print("HDF file not found...  it may not be available yet...")
-            return "not found"
-        else:
-            print(
-                "HDF file download didn't work out... Try debugging the code"
-            )
-            return "error"
+    Parameters
+    ----------
+    maxsize : INT
+        Maximum number of idle connections kept open for each host.
+    timeout : FLOAT
+        Socket timeout in seconds for new connections.
 
-    except subprocess.CalledProcessError as e:
-        # Handle error if the command fails
-        print("Error downloading HDF file:", e)
+    """
 
+    def __init__(self, maxsize=4, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """
+        Return an idle connection to the host, or open a new one.
+
+        Parameters
+        ----------
+        scheme : STRING
+            "http" or "https".
+        netloc : STRING
+            Host name with optional port.
+
+        Returns
+        -------
+        conn : http.client.HTTPConnection
+            Connection to the host.
+        reused : BOOL
+            True if the connection was taken from the pool.
+
+        """
+
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        return self.new(scheme, netloc), False
+
+    def new(self, scheme, netloc):
+        """
+        Open a new connection to the host, bypassing the idle connections.
+
+        Parameters
+        ----------
+        scheme : STRING
+            "http" or "https".
+        netloc : STRING
+            Host name with optional port.
+
+        Returns
+        -------
+        http.client.HTTPConnection
+            New connection to the host.
+
+        """
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        raise ValueError(f"Unsupported url scheme: {scheme}")
+
+    def put(self, scheme, netloc, conn):
+        """
+        Give a connection back to the pool once its response was fully read.
+
+        Parameters
+        ----------
+        scheme : STRING
+            "http" or "https".
+        netloc : STRING
+            Host name with optional port.
+        conn : http.client.HTTPConnection
+            Connection to keep open for the next request.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Close every idle connection in the pool.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+# One pool shared by all downloads of this process
+HTTP_POOL = ConnectionPool()
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
 
-# Text file processing function--------- (Collin)
-def extract_granule_id(metadata_file, kml_AOI_file, testmode):
+
+def file_lock(path):
     """
-    This function extracts the granule id from the metadata file. It also extracts
-    the bounding box coordinates for the HegTool
-    It includes a test mode that will designate a specific test time.
-
+    This function returns the lock of a downloaded file, shared by all the
+    threads of the script, so pipelines running at the same time with the
+    same metadata_file or download_HDF_folder do not write the same file (or
+    its part-file) together.
 
     Parameters
     ----------
-    metadata_file : STRING
-        Metadata file path.
-    kml_file : STRING
-        KML file path.
-    testmode : STRING
-        A specific date and time to run the function in test mode.
+    path : STRING
+        File path.
 
     Returns
     -------
-    TYPE
-        DESCRIPTION.
-    granule_id: STRING
-        Granule ID.
-    upper_left : STRING
-        The upper left coordinates in the proper format for the Bounding box.
-    lower_right : STRING
-        The lower right coordinates in the proper format for the Bounding box.
+    threading.RLock
+        The lock of the file.
 
     """
 
-    # Read the text file into a DataFrame skipping the first two rows as they are info
-    df_txt = pd.read_csv(metadata_file, skiprows=2)
-
-    # Read the kml file and extract the aoi polygon
-    poly_aoi = gpd.read_file(kml_AOI_file, driver="LIBKML", crs="EPSG:4326")
+    path = os.path.normcase(os.path.abspath(path))
+    with _file_locks_lock:
+        return _file_locks.setdefault(path, threading.RLock())
 
-    # Extract geometry of the AOI
-    aoi_geometry = poly_aoi.geometry.iloc[0]
 
-    # Extract upper left and lower right coordinates and put it into the HEG readable format
-    (
-        xmin,
-        ymin,
-        xmax,
-        ymax,
-    ) = (
-        aoi_geometry.bounds
-    )  # .bounds gets the minumum bounding box (so the xmin, ymax, xmax, ymin) coordinates
+# Results of the downloads that may work a bit later: the file is not published
+# yet, or the server or the network has a problem
+DOWNLOAD_RETRYABLE = ("not found", "unavailable")
 
-    upper_left = "( " + str(ymax) + " " + str(xmin) + " )"
-    lower_right = "( " + str(ymin) + " " + str(xmax) + " )"
 
-    # Convert bounding coordinates to Polygon geometries to display where the imagery is
-    # $ just so you know, this doesn't work for images crossing -180degs.  You might filter them out
-    geometry = [
-        Polygon(
-            [
-                (row["GRingLongitude1"], row["GRingLatitude1"]),
-                (row["GRingLongitude2"], row["GRingLatitude2"]),
-                (row["GRingLongitude3"], row["GRingLatitude3"]),
-                (row["GRingLongitude4"], row["GRingLatitude4"]),
-            ]
-        )
-        for index, row in df_txt.iterrows()
-    ]
+def download_result(status):
+    """
+    This function turns the HTTP status of a download into its result.
 
-    # Create a GeoDataFrame to house the entries
-    gdf = gpd.GeoDataFrame(df_txt, geometry=geometry, crs="EPSG:4326")
-    # Filter based on AOI polygon kml
-    # $ Should trap errors here if no modis images intersect!
-    selected_granules = gdf[gdf.intersects(aoi_geometry)]
-    # $ remove night images
-    selected_granules = selected_granules[
-        selected_granules.DayNightFlag == "D"
-    ]
-    selected_granules.reset_index(drop=True, inplace=True)
-    # $ this will export the df:
-    selected_granules.to_file("test_selectedmodis.kml", driver="LIBKML")
-    # $ adding here for testmode
-    if testmode == "":
-        selected_granule = selected_granules.iloc[-1]
-    else:
-        # $ test mode always gets the closest image in time to the time specified
-        t = datetime.strptime(testmode, "%Y-%m-%d %H:%M")
-        # $ should use loc instead..  come back to fix...
-        selected_granules["StartDateTime"] = pd.to_datetime(
-            selected_granules["StartDateTime"]
-        )
-        deltat = selected_granules["StartDateTime"] - t
-        selected_granule = selected_granules.iloc[deltat.dt.seconds.idxmin()]
+    Parameters
+    ----------
+    status : INT
+        The final HTTP status code.
 
-    return str(selected_granule["# GranuleID"]), upper_left, lower_right
+    Returns
+    -------
+    str
+        "ok" (2xx), "not found" (404, 410: not published yet), "unauthorized"
+        (401, 403: the token was refused), "unavailable" (429, 5xx: the
+        server has a problem) or "error" for any other status.
 
+    """
 
-# HDF to GeoTIFF conversion (Zacharie)--------------------------------------
+    if 200 <= status < 300:
+        return "ok"
+    elif status in (404, 410):
+        return "not found"
+    elif status in (401, 403):
+        return "unauthorized"
+    elif status == 429 or status >= 500:
+        return "unavailable"
+    return "error"
 
 
-# This section of the code was given by Derek
-# hdf file for the time
-def extract_date_from_filename(hdf_filename):
+def http_get(url, headers=None, handle_body=None, pool=None):
     """
-    This function read the date time from the HDF file.
+    Sends a GET request through the connection pool and follows redirects.
+    The body is passed chunk by chunk to handle_body, so large HDF files are
+    never held in memory.
 
     Parameters
     ----------
-    hdf_filename : STRING
-        HDF file name.
+    url : STRING
+        The url to request.
+    headers : DICT, optional
+        Extra request headers, e.g. the Authorization header.
+    handle_body : FUNCTION, optional
+        Called as handle_body(response) when the response status is 2xx.
+        It must read the response until the end.
+    pool : ConnectionPool, optional
+        Pool to use, HTTP_POOL by default.
 
     Returns
     -------
-    hdf_date : datetime object
-        Formated date time of the HDF file.
+    status : INT
+        The final HTTP status code.
+    response_headers : http.client.HTTPMessage
+        Headers of the final response.
 
     """
 
-    dt = os.path.basename(hdf_filename)[
-        7:19
-    ]  # $ note that you can use position to get info too.
-    hdf_date = datetime.strptime(dt, "%Y%j.%H%M")
-    return hdf_date
-
-
-def add_datetime_to_filenames(
-    GeoTIFF_folder, base_filenames, formatted_datetime
-):
+    pool = pool or HTTP_POOL
+    headers = dict(headers or {})
+
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn, reused = pool.get(parts.scheme, parts.netloc)
+        try:
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed the idle connection, retry once on a new one
+                conn.close()
+                conn = pool.new(parts.scheme, parts.netloc)
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader("Location")
+                response.read()
+                pool.put(parts.scheme, parts.netloc, conn)
+                if not location:
+                    return response.status, response.headers
+                url = urljoin(url, location)
+                continue
+
+            if 200 <= response.status < 300 and handle_body is not None:
+                handle_body(response)
+            # Drain what is left so the connection can be reused
+            response.read()
+            if response.will_close:
+                conn.close()
+            else:
+                pool.put(parts.scheme, parts.netloc, conn)
+            return response.status, response.headers
+
+        except BaseException:
+            conn.close()
+            raise
+
+    print(f"Too many redirects while requesting {url}")
+    return 310, None
+
+
+def http_download(url, auth_token, output_file, pool=None):
     """
-    This function builds the final GeoTIFF file names to place in the HEGTool
-    parameter file based off of designated GeoTIFF folder, base name and date.
+    This function downloads a url into a file with the native pooled client.
 
     Parameters
     ----------
-    GeoTIFF_folder : STRING
-        GeoTIFF folder path.
-    base_filenames : LIST
-        List of the 3 bands file names.
-    formatted_datetime : datetime object
-        The formatted datetime taken from extract_date_from_filename function.
+    url : STRING
+        The url of the file to download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    output_file : STRING
+        The path and name of the downloaded file.
+    pool : ConnectionPool, optional
+        Pool to use, HTTP_POOL by default.
 
     Returns
     -------
-    new_filenames : LIST
-        A list containing the final 3 GeoTIFF names with dates added for the parameter file.
+    str
+        "ok" if the file was downloaded, "not found" if the server does not
+        have it (yet), "unavailable" for a network or server problem, or
+        another result of download_result.
 
     """
 
-    new_filenames = []
-    for filename in base_filenames:
-        # Split the file name and extension
-        base_name, extension = os.path.splitext(filename)
-        # Create the new filename with datetime and the original extension
-        new_filename = os.path.join(
-            GeoTIFF_folder,
-            f"{formatted_datetime}_MODIS_SWATH_TYPE_L2_{base_name}{extension}",
+    # written to a temporary file first, so a failed download keeps the
+    # previous output_file
+    tmp_file = output_file + ".tmp"
+
+    def write_body(response):
+        with open(tmp_file, "wb") as file:
+            while True:
+                chunk = response.read(HTTP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+
+    try:
+        status, _ = http_get(
+            url,
+            headers={"Authorization": f"Bearer {auth_token}"},
+            handle_body=write_body,
+            pool=pool,
         )
-        new_filenames.append(new_filename)
+        if 200 <= status < 300:
+            os.replace(tmp_file, output_file)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Error requesting {url}:", e)
+        return "unavailable"
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
-    return new_filenames
+    result = download_result(status)
+    if result not in ("ok", "not found"):
+        print(f"Server answered {status} for {url}")
+    return result
 
 
-# Only changing the output file sequentially was taken from AI,and
-# https://www.geeksforgeeks.org/python-program-to-replace-specific-line-in-file/
-# I used this site to get started on how to modify lines of text
-def modify_parameter_file(
-    parameter_file,
-    HDF_input_filename,
-    GeoTIFF_output_filenames,
-    ul_corner_coordinates,
-    lr_corner_coordinates,
+# Result of the wget exit codes: 4 network failure, 6 authentication failure,
+# 8 error response of the server
+WGET_RESULTS = {0: "ok", 4: "unavailable", 6: "unauthorized", 8: "not found"}
+
+
+def download_txt_file(
+    base_txt_url, auth_token, metadata_file, downloader="native", cache_dir=None
 ):
     """
-    This function goes in and modifies the inputted parameter file to change
-    the HDF_input_filename, GEOTIFF_output_filenames, the ul_corner_coordinates and the
-    lr_corner_coordinates. This is to adjust the HEGTool parameters to take in the
-    proper files and bounding boxes.
+    This function downloads the txt metadata file
 
     Parameters
     ----------
-    parameter_file : STRING
-        Parameter file path.
-    HDF_input_filename : STRING
-        HDF file path.
-    GeoTIFF_output_filenames : LIST
-        A list containing the 3 GeoTIFF output names.
-    ul_corner_coordinates : STRING
-        Upper left bounding box coordinates.
-    lr_corner_coordinates : TYPE
-        Lower right bounding box coordinates.
+    base_txt_url : STRING
+        base url for metadata download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    metadata_file : STRING
+        The path and new name to your designated folder for the TXT file.
+    downloader : STRING, optional
+        "native" to use the built-in pooled HTTP client or "wget" to run the
+        wget command line tool.
+    cache_dir : STRING, optional
+        Folder of the metadata cache (native downloader only). When given,
+        only changed or newly appended data is downloaded.
 
     Returns
     -------
-    None.
+    str
+        "ok", "not found", "unavailable" (network or server problem) or
+        another result of download_result.
 
     """
 
-    with open(parameter_file, "r", newline="") as file:
-        lines = file.readlines()
+    # another pipeline may be downloading the same metadata file
+    with file_lock(metadata_file):
+        if downloader == "native":
+            if cache_dir:
+                result = cached_download(
+                    base_txt_url, auth_token, metadata_file, cache_dir
+                )
+            else:
+                result = http_download(base_txt_url, auth_token, metadata_file)
+            if result == "ok":
+                print("TXT file downloaded successfully.")
+            else:
+                print("Error downloading TXT file:", result)
+            return result
+
+        # wget writes the file even when the server answers with an error, so it
+        # goes to a part-file that only replaces metadata_file once complete
+        part_file = metadata_file + ".part"
+        command = [
+            "wget",
+            base_txt_url,
+            "--header",
+            f"Authorization: Bearer {auth_token}",  # $ changed the quoting behaviour for shell=False
+            "-O",
+            part_file,
+        ]
 
-    modified_lines = []
-    for line in lines:
-        if line.strip().startswith("INPUT_FILENAME"):
-            modified_lines.append(f"INPUT_FILENAME = {HDF_input_filename}\n")
-        elif line.strip().startswith("OUTPUT_FILENAME"):
-            modified_lines.append(
-                f"OUTPUT_FILENAME = {GeoTIFF_output_filenames.pop(0)}\n"
-            )
-        elif line.strip().startswith("SPATIAL_SUBSET_UL_CORNER"):
-            modified_lines.append(
-                f"SPATIAL_SUBSET_UL_CORNER = {ul_corner_coordinates}\n"
-            )
-        elif line.strip().startswith("SPATIAL_SUBSET_LR_CORNER"):
-            modified_lines.append(
-                f"SPATIAL_SUBSET_LR_CORNER = {lr_corner_coordinates}\n"
-            )
+        try:
+            # Execute the wget command
+            returncode = run_subprocess(
+                command, shell=False
+            ).returncode  # $ Derek changed this to shell=False, see stack overflow above
+        except OSError as e:
+            # Handle error if wget cannot be run
+            print("Error downloading TXT file:", e)
+            returncode = None
+
+        result = WGET_RESULTS.get(returncode, "error")
+        if result == "ok":
+            os.replace(part_file, metadata_file)
+            print("TXT file downloaded successfully.")
         else:
-            modified_lines.append(line)
-
-    with open(parameter_file, "w", newline="") as file:
-        file.writelines(modified_lines)
-        print("The parameter file has been modified")
-
-
-# I found out that the file was in Windows CR LF not in Unix LF
-# https://stackoverflow.com/questions/36422107/how-to-convert-crlf-to-lf-on-a-windows-machine-in-python
-def convert_windows_to_unix_line_endings(parameter_file):
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            print("Error downloading TXT file:", result)
+        return result
+
+
+# What download_HDF_file prints for each result
+HDF_RESULT_MESSAGES = {
+    "ok": "HDF file downloaded successfully.",
+    "not found": "HDF file not found...  it may not be available yet...",
+    "unauthorized": "HDF file download refused... check the auth_token of the config file",
+    "unavailable": "HDF file download failed... LANCE or the network is not answering",
+    "error": "HDF file download didn't work out... Try debugging the code",
+}
+# API download from LANCE NRT with token access (Zacharie)
+def download_HDF_file(
+    base_HDF_url,
+    auth_token,
+    download_HDF_folder,
+    downloader="native",
+    attempts=3,
+    pool=None,
+):
     """
-    This function takes the entire parameter file txt and converts it into
-    the proper Unix (LF) that it need to be in for the HegTool to run
+    This function downloads the HDF file from MODIS
 
     Parameters
     ----------
-    parameter_file : STRING
-        Parameter file path.
+    base_HDF_url : STRING
+        The base url for the HDF request.
+    auth_token : STRING
+        Your MODIS authentication token.
+    download_HDF_folder : STRING
+        The path to your designated folder for the HDF files.
+    downloader : STRING, optional
+        "native" to use the built-in pooled HTTP client or "wget" to run the
+        wget command line tool.
+    attempts : INT, optional
+        Number of times an interrupted download is resumed before giving up.
+    pool : ConnectionPool, optional
+        Pool of the native downloader, HTTP_POOL by default.
 
     Returns
     -------
-    None.
+    str
+        "ok", "not found", "unauthorized", "unavailable" or "error", see
+        download_result.
 
     """
 
-    WINDOWS_LINE_ENDING = b"\r\n"
-    UNIX_LINE_ENDING = b"\n"
+    hdf_file = os.path.join(
+        download_HDF_folder, os.path.basename(urlsplit(base_HDF_url).path)
+    )
 
-    try:
-        with open(parameter_file, "rb") as open_file:
-            content = open_file.read()
+    # one download at a time appends to the part-file
+    with file_lock(hdf_file):
+        if downloader == "native":
+            result = http_download_resumable(
+                base_HDF_url, auth_token, hdf_file, attempts, pool
+            )
+            print(HDF_RESULT_MESSAGES.get(result, HDF_RESULT_MESSAGES["error"]))
+            return result
+
+        command = [
+            "wget",
+            base_HDF_url,
+            "--header",
+            f"Authorization: Bearer {auth_token}", 
+            "--continue",
+            "--tries",
+            str(attempts),
+            "-O",
+            hdf_file + ".part",
+        ]
 
-        content = content.replace(WINDOWS_LINE_ENDING, UNIX_LINE_ENDING)
+        try:
+            # Execute the wget command
+            returncode = run_subprocess(
+                command, shell=False
+            ).returncode  # $ Derek changed this to shell=False, see stack overflow above
+        except OSError as e:
+            # Handle error if wget cannot be run
+            print("Error downloading HDF file:", e)
+            return "error"
 
-        with open(parameter_file, "wb") as open_file:
-            open_file.write(content)
+        if returncode == 0:
+            # wget has checked the size, the part-file is complete
+            os.replace(hdf_file + ".part", hdf_file)
+        elif (
+            os.path.isfile(hdf_file + ".part")
+            and os.path.getsize(hdf_file + ".part") == 0
+        ):
+            # nothing to resume, e.g. after a 404
+            os.remove(hdf_file + ".part")
+        result = WGET_RESULTS.get(returncode, "error")
+        print(HDF_RESULT_MESSAGES[result])
+        return result
+
+
+def _content_range_total(content_range):
+    """
+    Returns the full file size from a "bytes start-end/total" Content-Range
+    header, or None if the server did not give it.
+    """
 
-        print(
-            f"Line endings converted from Windows (CRLF) to Unix (LF) in {parameter_file}"
-        )
-    except IOError:
-        print(f"Error: Unable to open or modify file {parameter_file}")
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
 
 
-# Place Code here for GeoTIFF merge (Philip) -------------------------------------------
-# Resources used: Code snippet provided by Derek, AI and https://rasterio.readthedocs.io/en/stable/topics/color.html
-def merge_raster(band1, band2, band3, output_name):
+def _content_range_start(content_range):
+    """
+    Returns the first byte position of a "bytes start-end/total"
+    Content-Range header, or None.
     """
-    This functions takes 3 bands and merges them together in one GeoTIFF file. It does this by changing the data from int16 to uint8 and then scalling the 3 bands by weight.
 
-    Parameters
-    ----------
-    band1 : STRING
-        Band 1 GeoTIFF file path.
-    band2 : STRING
-        Band 2 GeoTIFF file path.
-    band3 : STRING
-        Band 3 GeoTIFF file path.
-    output_name : STRING
-        Final combined GeoTIFF file path with name.
+    try:
+        return int(content_range.split()[1].split("-")[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
 
-    Returns
-    -------
-    None.
 
+class _PartFile:
+    """
+    The part-file of a resumable download, shared by http_download_resumable
+    and async_http_download: the Range header asking for the missing bytes,
+    the checks of the response and the rename of the part-file once it is
+    complete. Only the way the request is sent differs between the two.
     """
-    # Open grayscale GeoTIFF files
-    with rasterio.open(band1) as src1, rasterio.open(
-        band2
-    ) as src2, rasterio.open(band3) as src3:
-        b1 = src1.read(1)  # Read band 1
-        b2 = src2.read(1)  # Read band 2
-        b3 = src3.read(1)  # Read band 3
 
-    # Stack bands into an array
-    b123 = np.stack([b1, b2, b3], axis=-1)
+    def __init__(self, url, output_file):
+        self.url = url
+        self.output_file = output_file
+        self.part_file = output_file + ".part"
+        self.offset = 0
+        # size the complete file must have, from the response headers
+        self.expected = None
 
-    # $ rescale the image to byte
-    # $ create a masked image that ignores the no data value
-    # https://stackoverflow.com/questions/49922460/scale-a-numpy-array-with-from-0-1-0-2-to-0-255
-    b123masked = np.ma.masked_equal(
-        b123, -28672
-    )  # $ this is the no data value
-    scaled = (
-        (b123masked - np.min(b123masked))
-        * (1 / (np.max(b123masked) - np.min(b123masked)) * 255)
-    ).astype("uint8")
-    # scaled = np.interp(b123masked, (np.min(b123masked), np.max(b123masked)), (0, 255)).astype("uint8")
-    # Get metadata from one of the input files
-    with rasterio.open(band1) as src:
-        meta = src.meta.copy()
-        meta.update(count=3)  # Update the band count to 3 for RGB
-        # $ if you want to do this you need to actually change the data from int16 to uint8, otherwise it won't work... Look up scale numpy array to 0-255
-        meta.update(
-            dtype="uint8"
-        )  # Update the data type to ensure RGB interpretation
-        meta.update(nodata=0)  # Remove nodata value
-
-    # Write stacked RGB image to output file
-    with rasterio.open(output_name, "w", **meta) as dst:
-        for i in range(3):  # Loop through each band
-            dst.write(
-                scaled[:, :, i], i + 1
-            )  # Write each band with the correct index (starting from 1)
-
-    # # Update color interpretation of bands
-    with rasterio.open(output_name, "r+") as src:
-        src.colorinterp = [
-            ColorInterp.red,
-            ColorInterp.green,
-            ColorInterp.blue,
-        ]
+    def request_headers(self, auth_token):
+        """The headers of the next attempt."""
 
-    print("RGB image saved as '{}'".format(output_name))
+        self.offset = (
+            os.path.getsize(self.part_file) if os.path.isfile(self.part_file) else 0
+        )
+        self.expected = None
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        if self.offset:
+            headers["Range"] = f"bytes={self.offset}-"
+        return headers
+
+    @contextmanager
+    def receive(self, status, headers):
+        """
+        Opens the part-file for a 2xx response and yields the function
+        writing a chunk of the body into it.
+        """
+
+        if status == 206:
+            content_range = headers.get("Content-Range")
+            start = _content_range_start(content_range)
+            if start != self.offset:
+                raise http.client.HTTPException(
+                    f"server resumed at byte {start} instead of {self.offset}"
+                )
+            mode = "ab"
+            self.expected = _content_range_total(content_range)
+        else:
+            # The server sent the whole file, start the part-file again
+            mode = "wb"
+            length = headers.get("Content-Length")
+            self.expected = int(length) if length else None
+
+        with open(self.part_file, mode) as file:
+            yield file.write
+
+    def finish(self, status, headers, attempt):
+        """
+        The result of an attempt once its response was read, and True when
+        another attempt can complete the file.
+        """
+
+        if status == 416:
+            # Nothing left to send, either the part-file is already complete
+            # or it is bigger than the file on the server and must go.
+            total = _content_range_total(headers.get("Content-Range"))
+            if total is not None and total == self.offset:
+                os.replace(self.part_file, self.output_file)
+                return "ok", False
+            os.remove(self.part_file)
+            return "error", True
+        elif not 200 <= status < 300:
+            result = download_result(status)
+            if result != "not found":
+                print(f"Server answered {status} for {self.url}")
+            return result, False
+
+        size = os.path.getsize(self.part_file)
+        if self.expected is None or size == self.expected:
+            os.replace(self.part_file, self.output_file)
+            return "ok", False
+        print(
+            f"Download of {self.url} stopped at {size} of {self.expected} bytes,"
+            f" attempt {attempt + 1}"
+        )
+        return "unavailable", True
 
 
-# Place Code here for GeoTIFF to KML conversion (Shea) ------------------------------
-def convert_to_kmz(input_tiff, output_kmz, gdal_translate_path):
+def http_download_resumable(url, auth_token, output_file, attempts=3, pool=None):
     """
-    This function converts a GeoTIFF file into a superoverlay kmz file.
+    This function downloads a url into a file so that an interrupted download
+    can carry on where it stopped. The data goes into output_file + ".part",
+    the next attempt (or the next run of the script) asks the server for the
+    missing bytes only with a Range request, and the part-file is renamed to
+    output_file once its size matches the size announced by the server. This
+    way output_file only ever exists when it is complete.
 
     Parameters
     ----------
-    input_tiff : STRING
-        GeoTIFF file path.
-    output_kmz : STRING
-        KMZ file path.
-    gdal_translate_path : STRING
-        Path to the computers gdal_translate.exe.
+    url : STRING
+        The url of the file to download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    output_file : STRING
+        The path and name of the downloaded file.
+    attempts : INT, optional
+        Number of times the download is resumed before giving up.
+    pool : ConnectionPool, optional
+        Pool to use, HTTP_POOL by default.
 
     Returns
     -------
-    None.
+    str
+        "ok", "not found", "unavailable" (network or server problem) or
+        another result of download_result.
 
     """
 
-    # 'gdal_translate' is a GDAL utility used to convert raster data between different formats, '-of' 'KMLSUPEROVERLAY' specify the output format
+    part = _PartFile(url, output_file)
+    result = "error"
 
-    command = [
-        gdal_translate_path,
-        "-of",
-        "KMLSUPEROVERLAY",
-        input_tiff,
-        output_kmz,
-    ]
-    # Run the command
-    try:
-        subprocess.run(command, shell=False)
-        print("Conversion to KMZ complete.")
-    except Exception as e:
-        print(f"Error during conversion to KMZ: {e}")
+    for attempt in range(max(1, attempts)):
+        headers = part.request_headers(auth_token)
 
+        def write_body(response):
+            with part.receive(response.status, response.headers) as write:
+                for chunk in iter(lambda: response.read(HTTP_CHUNK_SIZE), b""):
+                    write(chunk)
 
-# Place Code to Read from config file (Zacharie) -------------------------------------------------
+        try:
+            status, response_headers = http_get(
+                url, headers=headers, handle_body=write_body, pool=pool
+            )
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Download of {url} interrupted ({e}), attempt {attempt + 1}")
+            result = "unavailable"
+            continue
 
+        result, again = part.finish(status, response_headers, attempt)
+        if not again:
+            return result
 
-def getargs():
-    """
-    This function retrieves the configuration file path.
+    return result
 
-    Returns
-    -------
-    cfg_path : STRING
-        Configuration file path.
 
+# Conditional-GET cache for the metadata files -----------------------------------
+# The daily MYD03 metadata file only grows during the day (new granules are
+# appended at the end), so when it is downloaded again we first ask the server
+# if it changed at all (ETag / Last-Modified) and, if it did, only for the bytes
+# after the ones we already have.
+
+METADATA_CACHE_INDEX = "index.json"
+# Bytes before the end of the cached copy that are requested again, to check
+# that the server file really starts with what we already have
+METADATA_CACHE_OVERLAP = 512
+
+_metadata_cache_lock = threading.Lock()
+
+
+def _read_cache_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, METADATA_CACHE_INDEX), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache_index(cache_dir, index):
+    index_file = os.path.join(cache_dir, METADATA_CACHE_INDEX)
+    with open(index_file + ".tmp", "w") as file:
+        json.dump(index, file, indent=1)
+    os.replace(index_file + ".tmp", index_file)
+
+
+class _CachedCopy:
+    """
+    The cached copy of a url, shared by cached_download and
+    async_cached_download: the conditional and Range headers, the check that
+    the server only appended to the file, the index update and the copy to
+    the output file. Only the way the requests are sent differs between the
+    two.
     """
 
-    parser = argparse.ArgumentParser(description="Process a file path.")
+    def __init__(self, url, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.url = url
+        self.cache_dir = cache_dir
+        self.cached_file = os.path.join(
+            cache_dir, os.path.basename(urlsplit(url).path)
+        )
+        self.entry = None
+        self.offset = None
+        self.appended = False
+        self.mismatch = False
+
+    def request_headers(self, auth_token, conditional=True):
+        """
+        The headers of the request, asking only for what changed since the
+        last download unless conditional is False.
+        """
+
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        self.offset = None
+        self.appended = self.mismatch = False
+        if not conditional:
+            return headers
+
+        with _metadata_cache_lock:
+            self.entry = _read_cache_index(self.cache_dir).get(self.url)
+        if (
+            self.entry
+            and os.path.isfile(self.cached_file)
+            and os.path.getsize(self.cached_file) == self.entry["length"]
+        ):
+            if self.entry.get("etag"):
+                headers["If-None-Match"] = self.entry["etag"]
+            if self.entry.get("last_modified"):
+                headers["If-Modified-Since"] = self.entry["last_modified"]
+            self.offset = max(0, self.entry["length"] - METADATA_CACHE_OVERLAP)
+            headers["Range"] = f"bytes={self.offset}-"
+        return headers
+
+    @contextmanager
+    def receive(self, status, headers):
+        """
+        Starts a new cached copy for a 2xx response and yields the function
+        writing a chunk of the body into it. The cached copy is only replaced
+        when the body was read to the end and mismatch stayed False.
+        """
+
+        overlap = 0
+        if status == 206:
+            content_range = headers.get("Content-Range")
+            start = _content_range_start(content_range)
+            total = _content_range_total(content_range)
+            if start != self.offset or total is None or total <= self.entry["length"]:
+                # Only a file that grew can be completed from the cached copy,
+                # one rewritten with the same (or a smaller) size is not
+                self.mismatch = True
+                yield lambda chunk: None
+                return
+            overlap = self.entry["length"] - self.offset
+            with open(self.cached_file, "rb") as file:
+                file.seek(self.offset)
+                tail = file.read(overlap)
+
+        head = bytearray()
+        tmp_file = self.cached_file + ".tmp"
+        with open(tmp_file, "wb") as tmp:
+            if overlap:
+                with open(self.cached_file, "rb") as file:
+                    shutil.copyfileobj(file, tmp)
+
+            def write(chunk):
+                if self.mismatch:
+                    return
+                if len(head) < overlap:
+                    # the first bytes must be the end of the cached copy
+                    needed = overlap - len(head)
+                    head.extend(chunk[:needed])
+                    chunk = chunk[needed:]
+                    if len(head) == overlap and head != tail:
+                        # The file was rewritten, not appended to
+                        self.mismatch = True
+                        return
+                tmp.write(chunk)
+
+            try:
+                yield write
+            except BaseException:
+                tmp.close()
+                os.remove(tmp_file)
+                raise
+
+        if len(head) < overlap:
+            self.mismatch = True  # ended before the overlap was checked
+        if self.mismatch:
+            os.remove(tmp_file)
+            return
+        self.appended = overlap > 0
+        os.replace(tmp_file, self.cached_file)
+
+    def retry_whole(self, status):
+        """True when the whole file must be requested again."""
+
+        return self.mismatch or status == 416
+
+    def finish(self, status, headers, output_file):
+        """
+        The result of the download once the response was read, with the
+        index updated and output_file replaced by the cached copy.
+        """
+
+        if status == 304:
+            print("Metadata file has not changed since the last download.")
+        elif 200 <= status < 300:
+            if self.appended:
+                print(
+                    f"Metadata file has new rows, downloaded from byte {self.offset}."
+                )
+            with _metadata_cache_lock:
+                index = _read_cache_index(self.cache_dir)
+                index[self.url] = {
+                    "etag": headers.get("ETag"),
+                    "last_modified": headers.get("Last-Modified"),
+                    "length": os.path.getsize(self.cached_file),
+                }
+                _write_cache_index(self.cache_dir, index)
+        else:
+            result = download_result(status)
+            if result != "not found":
+                print(f"Server answered {status} for {self.url}")
+            return result
 
-    # add an argument for configfile
-    parser.add_argument(
-        "configfile",
-        type=str,
-        help="enter the full path and name of your config file",
-    )
-    # now make a list of all the arguments
-    args = parser.parse_args()
-    cfg_path = args.configfile
-    return cfg_path
+        if os.path.abspath(self.cached_file) != os.path.abspath(output_file):
+            # replaced in one go, other pipelines may be reading output_file
+            shutil.copyfile(self.cached_file, output_file + ".tmp")
+            os.replace(output_file + ".tmp", output_file)
+        return "ok"
 
 
-def getconfig(cfg_path):
+def cached_download(url, auth_token, output_file, cache_dir, pool=None):
     """
-    This function retrieves the information from the config file and places it into variables
+    This function downloads a url through a local cache keyed by url. The
+    ETag and Last-Modified values of the last download are sent back as
+    If-None-Match and If-Modified-Since so an unchanged file costs a single
+    304 response. A changed file is completed with a Range request from the
+    cached length only when the server says it grew and the last bytes of the
+    cached copy match; any other change downloads the whole file again.
 
     Parameters
     ----------
-    cfg_path : STRING
-        Configuration file path.
+    url : STRING
+        The url of the file to download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    output_file : STRING
+        The path and name of the file to update with the cached copy.
+    cache_dir : STRING
+        Folder holding the cached copies and their index.
+    pool : ConnectionPool, optional
+        Pool to use, HTTP_POOL by default.
 
     Returns
     -------
-    TYPE
-        DESCRIPTION.
-    GeoTIFF_folder : STRING
-        GeoTIFF folder path.
-    TIFF_Final : STRING
-        Final merged GeoTIFF file path.
-    base_filenames : LIST
-        List of 3 base file names.
-    HEGTool_directory : STRING
-        Required HEGTool directory path.
-    MRTBINDIR : STRING
-        Required HEGTool computer environment path.
-    PGSHOME : STRING
-        Required HEGTool computer environment path.
-    MRTDATADIR : STRING
-        Required HEGTool computer environment path.
+    str
+        "ok", "not found", "unavailable" (network or server problem) or
+        another result of download_result.
+
+    """
+
+    copy = _CachedCopy(url, cache_dir)
+
+    def write_body(response):
+        with copy.receive(response.status, response.headers) as write:
+            for chunk in iter(lambda: response.read(HTTP_CHUNK_SIZE), b""):
+                write(chunk)
+
+    # the cached copy may be shared by pipelines with different output_file
+    with file_lock(copy.cached_file):
+        try:
+            status, response_headers = http_get(
+                url,
+                headers=copy.request_headers(auth_token),
+                handle_body=write_body,
+                pool=pool,
+            )
+            if copy.retry_whole(status):
+                # Fall back to downloading the whole file
+                status, response_headers = http_get(
+                    url,
+                    headers=copy.request_headers(auth_token, conditional=False),
+                    handle_body=write_body,
+                    pool=pool,
+                )
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Error requesting {url}:", e)
+            return "unavailable"
+
+        return copy.finish(status, response_headers, output_file)
+
+
+# Concurrent download of several HDF files ---------------------------------------
+def download_HDF_files(
+    hdf_urls,
+    auth_token,
+    download_HDF_folder,
+    downloader="native",
+    max_workers=4,
+    max_per_host=2,
+    attempts=3,
+):
+    """
+    This function downloads several HDF files at the same time with a pool of
+    worker threads. The number of simultaneous downloads from the same server
+    is capped by max_per_host so LANCE is not flooded with connections.
+
+    Parameters
+    ----------
+    hdf_urls : LIST
+        Full urls of the HDF files to download.
     auth_token : STRING
-        Required HEGTool NASA Authentication Token.
+        Your MODIS authentication token.
     download_HDF_folder : STRING
-        HDF download folder path.
-    metadata_file : STRING
-        Metadata file path.
-    base_txt_url : STRING
-        Base url for the txt download for MODIS.
-    base_HDF_url : STRING
-        Base url for the HDF download for MODIS.
-    test_time : STRING
-        Date and time for test mode.
-    gdal_translate_path : STRING
-        gdal translate exe path on computer.
-    kml_AOI_file : STRING
-        KML Area of Interest file path.
-    kmz_folder : STRING
-        KMZ output folder path.
+        The path to your designated folder for the HDF files.
+    downloader : STRING, optional
+        "native" or "wget", see download_HDF_file.
+    max_workers : INT, optional
+        Number of downloads running at the same time.
+    max_per_host : INT, optional
+        Maximum number of downloads running at the same time from one host.
+    attempts : INT, optional
+        Number of times an interrupted download is resumed before giving up.
+
+    Returns
+    -------
+    results : DICT
+        The result of download_HDF_file ("ok", "not found", "unauthorized",
+        "unavailable" or "error") for each url.
 
     """
 
-    cfg = os.path.expanduser(cfg_path)
-    config = RawConfigParser()  # run the parser
+    host_limits = {}
+    for url in hdf_urls:
+        host = urlsplit(url).netloc
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(max(1, max_per_host))
+
+    # a pool of its own, with an idle connection for every worker allowed on
+    # a host
+    pool = ConnectionPool(maxsize=max(HTTP_POOL.maxsize, max_per_host))
 
+    def download_one(url):
+        with host_limits[urlsplit(url).netloc]:
+            return download_HDF_file(
+                url, auth_token, download_HDF_folder, downloader, attempts, pool
+            )
+
+    results = {}
     try:
-        config.read(cfg)  # read file
-        # now get the variables stored in the config file
-        # there are 4 categories - Paths, Name, HEGTool, BoundingBox
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {url: executor.submit(download_one, url) for url in hdf_urls}
+            for url, future in futures.items():
+                try:
+                    results[url] = future.result()
+                except Exception as e:
+                    print(f"Error downloading {url}:", e)
+                    results[url] = "error"
+    finally:
+        pool.close()
+
+    return results
+
 
-        parameter_file = config.get("Paths", "parameter_file")
-        GeoTIFF_folder = config.get("Paths", "GeoTIFF_folder")
-        TIFF_Final = config.get("Paths", "TIFF_Final")
-        gdal_translate_path = config.get("Paths", "gdal_translate_path")
+# Retry policy ---------------------------------------------------------------------
+# LANCE lists a granule in the metadata file some minutes before its HDF file is
+# published, so a file that is "not found" now is often there a few minutes later.
+# Instead of giving up until the next run of the script, the downloads that may
+# work later are tried again, waiting longer each time, up to a total deadline.
 
-        base_filenames = config.get("Names", "base_filenames")
 
-        HEGTool_directory = config.get("HegTool", "HEGTool_directory")
-        MRTBINDIR = config.get("HegTool", "MRTBINDIR")
-        PGSHOME = config.get("HegTool", "PGSHOME")
-        MRTDATADIR = config.get("HegTool", "MRTDATADIR")
+class RetryPolicy(NamedTuple):
+    """
+    How long to keep trying the downloads that may work later.
+
+    deadline : FLOAT
+        Seconds after the first try past which no new try starts, 0 to try
+        only once.
+    delay : FLOAT
+        Longest wait before the first retry, doubled for every retry.
+    max_delay : FLOAT
+        Longest wait between two tries.
+    """
+
+    deadline: float = 0
+    delay: float = 30
+    max_delay: float = 300
+
+    @classmethod
+    def from_options(cls, options):
+        """The policy of the retry_* values of the [Options]."""
+
+        return cls(
+            options["retry_deadline"], options["retry_delay"], options["retry_max_delay"]
+        )
+
+    def wait(self, retry, rng=random):
+        """
+        Seconds to wait before retry number retry (0 for the first one): a
+        random time between half and all of delay * 2 ** retry, at most
+        max_delay, so the scripts of several hosts do not all ask LANCE again
+        at the same moment.
+        """
+
+        backoff = min(self.delay * 2**retry, self.max_delay)
+        return rng.uniform(backoff / 2, backoff)
 
-        auth_token = config.get("LANCE", "auth_token")
-        download_HDF_folder = config.get("LANCE", "download_HDF_folder")
-        metadata_file = config.get("LANCE", "metadata_file")
-        base_txt_url = config.get("LANCE", "base_txt_url")
-        base_HDF_url = config.get("LANCE", "base_HDF_url")
-        test_time = config.get("LANCE", "test_time")
 
-        kml_AOI_file = config.get("BoundingBox", "kml_AOI_file")
-        kmz_folder = config.get("Paths", "kmz_folder")
+def retry_downloads(download, names, policy, sleep=time.sleep, clock=time.monotonic):
+    """
+    This function downloads files with download and tries again the ones
+    whose result is in DOWNLOAD_RETRYABLE ("not found" and "unavailable"),
+    waiting policy.wait before every retry, until they are all done, the
+    token is refused ("unauthorized" will not get better) or the deadline of
+    the policy is reached.
+
+    Parameters
+    ----------
+    download : FUNCTION
+        Called as download(names) with a list of names, returns the result
+        of each name, e.g. {url: "ok"}.
+    names : LIST
+        Names of the files to download.
+    policy : RetryPolicy
+        How long to keep trying.
+    sleep, clock : FUNCTION, optional
+        time.sleep and time.monotonic by default.
+
+    Returns
+    -------
+    results : DICT
+        The last result of each name.
+    retries : INT
+        Number of retries done.
+
+    """
 
-    except:
+    start = clock()
+    names = list(names)
+    results = dict(download(names))
+    retries = 0
+    while True:
+        pending = [name for name in names if results.get(name) in DOWNLOAD_RETRYABLE]
+        if not pending or "unauthorized" in results.values():
+            break
+        wait = min(policy.wait(retries), start + policy.deadline - clock())
+        if wait <= 0:
+            break
         print(
-            "Trouble reading config file, please check the file and path are valid\n"
+            f"{len(pending)} file(s) not available yet, trying again in {wait:.1f} s"
         )
-        sys.exit(1)
+        sleep(wait)
+        retries += 1
+        results.update(download(pending))
+    return results, retries
 
-    return (  # $ maybe a dictionary would be an easier way to gather this all together?
-        parameter_file,
-        GeoTIFF_folder,
-        TIFF_Final,
-        gdal_translate_path,
-        base_filenames,
-        HEGTool_directory,
-        MRTBINDIR,
-        PGSHOME,
-        MRTDATADIR,
-        auth_token,
-        download_HDF_folder,
-        metadata_file,
-        base_txt_url,
-        base_HDF_url,
-        test_time,
-        kml_AOI_file,
-        kmz_folder,
-    )
+
+# Text file processing function--------- (Collin)
+GRING_LONGITUDES = [f"GRingLongitude{i}" for i in range(1, 5)]
+GRING_LATITUDES = [f"GRingLatitude{i}" for i in range(1, 5)]
 
 
-def main():
+def build_footprints(df_txt):
     """
-    This ks the main function that runs the script.
+    This function builds the footprint polygon of every granule of the
+    metadata from its 4 GRing corners. All the polygons are created in one
+    call from the coordinate columns instead of one Polygon per row.
+
+    Footprints crossing the antimeridian are split in two polygons on each
+    side of +-180 degrees, and footprints going around a pole are closed
+    through the pole, so neither becomes a huge polygon across the globe
+    that intersects almost every AOI.
+
+    Parameters
+    ----------
+    df_txt : DataFrame
+        Metadata file rows with the GRingLongitude1..4 and GRingLatitude1..4
+        columns.
 
     Returns
     -------
-    None.
+    footprints : numpy array of shapely Polygons and MultiPolygons
+        One footprint per row, in the same order as df_txt.
 
     """
 
-    # get the config file name
-    configfile = getargs()
-    # read in the config info
-    (
-        parameter_file,
-        GeoTIFF_folder,
-        TIFF_Final,
-        gdal_translate_path,
-        base_filenames,
-        HEGTool_directory,
-        MRTBINDIR,
-        PGSHOME,
-        MRTDATADIR,
-        auth_token,
-        download_HDF_folder,
-        metadata_file,
-        base_txt_url,
-        base_HDF_url,
-        test_time,
-        kml_AOI_file,
-        kmz_folder,
-    ) = getconfig(configfile)
+    import numpy as np
+    import shapely
+
+    lon = df_txt[GRING_LONGITUDES].to_numpy(dtype="float64")
+    lat = df_txt[GRING_LATITUDES].to_numpy(dtype="float64")
+    # (rows, 4 corners, x/y), shapely closes the rings itself
+    coords = np.stack([lon, lat], axis=-1)
+    footprints = shapely.polygons(coords)
+
+    # Longitude steps along each ring (closing edge included), wrapped to the
+    # shortest way around. An edge longer than 180 degrees crosses the
+    # antimeridian and the steps of a ring around a pole add up to +-360.
+    steps = np.diff(lon, axis=1, append=lon[:, :1])
+    wrapped_steps = (steps + 180) % 360 - 180
+    winding = np.round(wrapped_steps.sum(axis=1) / 360)
+    polar = winding != 0
+    crossing = ~polar & (np.abs(steps) > 180).any(axis=1)
+
+    if crossing.any() or polar.any():
+        # Continuous ("unwrapped") longitudes, starting at the first corner
+        unwrapped = lon[:, :1] + np.concatenate(
+            [np.zeros((len(lon), 1)), np.cumsum(wrapped_steps[:, :3], axis=1)],
+            axis=1,
+        )
 
-    # Split the string using a space delimiter (you can change this based on the actual delimiter)
-    try:
-        # $ update this comment --> there are no contestants here!
-        # need to parse out the names of the contestants
-        # first put each line in a list and remove spaces
-        base_filenames = [x.strip() for x in base_filenames.splitlines()]
-        # then remove empty rows
-        base_filenames = [
-            base_filenames
-            for base_filenames in base_filenames
-            if base_filenames
-        ]
+        if crossing.any():
+            footprints[crossing] = split_at_antimeridian(
+                shapely.polygons(
+                    np.stack([unwrapped[crossing], lat[crossing]], axis=-1)
+                )
+            )
 
-        print(base_filenames)
-    except:
-        print("There was an error in splitting the base file names")
+        if polar.any():
+            # Go round the ring once, then up to the pole and back to the start
+            u = unwrapped[polar]
+            v = lat[polar]
+            end = u[:, :1] + 360 * winding[polar, None]
+            pole = np.where(v.mean(axis=1) > 0, 90.0, -90.0)[:, None]
+            ring_lon = np.concatenate([u, end, end, u[:, :1]], axis=1)
+            ring_lat = np.concatenate([v, v[:, :1], pole, pole], axis=1)
+            footprints[polar] = split_at_antimeridian(
+                shapely.polygons(np.stack([ring_lon, ring_lat], axis=-1))
+            )
 
-    # Get the date from today in UTC time to build the correct url for txt download
-    # $ I suggest you add a variable in the config file called testmode (or similar).
-    # $ if test mode is true, then it might override the t = now and put in a timestamp that would
-    # $ result in a given image, that way when you run the script it will give exactly the same kmz as
-    # $ you have in the test output file
+    return footprints
 
-    # Get the current UTC date and time
-    if test_time == "":
-        t = datetime.utcnow()
-    else:
-        t = datetime.strptime(test_time, "%Y-%m-%d %H:%M")
 
-    # Format the date string for the text file name
-    txt_file_name = datetime.strftime(t, "MYD03_%Y-%m-%d.txt")
+def split_at_antimeridian(footprints):
+    """
+    This function cuts footprints given in continuous longitudes (that can go
+    past +-180 degrees, up to 360 degrees wide) into the parts on each side of
+    the antimeridian, with every part back in the -180 to 180 range.
 
-    # Construct the full URL for the text file download
-    txt_url_full = base_txt_url + datetime.strftime(t, "%Y/") + txt_file_name
+    Parameters
+    ----------
+    footprints : numpy array of shapely Polygons
+        Footprints in continuous longitudes.
 
-    # Download the txt file for that day
-    download_txt_file(txt_url_full, auth_token, metadata_file)
+    Returns
+    -------
+    numpy array of shapely Polygons and MultiPolygons
+        The same footprints split at +-180 degrees.
 
-    print("--------------------------")
+    """
 
-    granule_id, upper_left, lower_right = extract_granule_id(
-        metadata_file, kml_AOI_file, test_time
-    )
+    import numpy as np
+    import shapely
 
-    # $ you must modfify granule_id to match the MYD09 filename you want:
-    granule_id = granule_id[:4] + "9" + granule_id[5:19] + ".061.NRT.hdf"
+    footprints = shapely.make_valid(footprints)
+    # Move every footprint so it starts east of -180, it then lies in -180..540
+    xmin = shapely.bounds(footprints)[:, 0]
+    shift = np.where(xmin < -180, 360.0, 0.0)
+    shift = np.where(xmin >= 180, -360.0, shift)
+    footprints = _shift_longitudes(footprints, shift)
 
-    print("--------------------------")
-    print(f"Found matching MODIS image: {granule_id}")
-    print("--------------------------")
+    west = shapely.intersection(footprints, shapely.box(-180, -90, 180, 90))
+    east = shapely.intersection(footprints, shapely.box(180, -90, 540, 90))
+    east = _shift_longitudes(east, np.full(len(east), -360.0))
+    return shapely.union(west, east)
 
-    # $ you need to replace the base_HDF_url in the config file with:
-    # $ base_HDF_url = https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/61/MYD09/Recent
 
-    # $ here is the new wa
-    hdf_url_full = base_HDF_url + "/" + granule_id
-    print(f"Downloding... {hdf_url_full}....")
-    # This line downloads the hdf file with the full url with new hdf file name
-    # $ this line of code needs to be uncommented for the code to work!
-    # $ added a condition so you don't download the file more than once
-    if not os.path.isfile(os.path.join(download_HDF_folder, granule_id)):
-        msg = download_HDF_file(hdf_url_full, auth_token, download_HDF_folder)
+def _shift_longitudes(geometries, shift):
+    """Adds shift[i] degrees to every longitude of geometries[i]."""
 
-        # $ no sense going on without the image you need.
-        if msg != "ok":
-            sys.exit(1)
+    import numpy as np
+    import shapely
 
-    input_hdf_filename = os.path.join(download_HDF_folder, granule_id)
-    # Extract date from hdf file
-    hdf_date = extract_date_from_filename(input_hdf_filename)
-    # $ note only date is retrieved, not time?!
-    if hdf_date:
-        formatted_datetime = hdf_date.strftime(
-            "%Y-%m-%d_%H%M"
-        )  # $ replaced . with :
-        print("Extracted Date from HDF Filename:", formatted_datetime)
-    else:
-        print("Failed to extract date from HDF filename.")
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    coords[:, 0] += shift[index]
+    # set_coordinates replaces the geometries of the array it is given
+    return shapely.set_coordinates(np.array(geometries, dtype=object), coords)
 
-    new_date_output_filenames = add_datetime_to_filenames(
-        GeoTIFF_folder, base_filenames, formatted_datetime
-    )
 
-    # $ copy the list above to a tuple because it gets modified by the function below
-    tifbands = tuple(new_date_output_filenames)
+def read_metadata(metadata_file):
+    """
+    This function reads one or several geoMeta metadata files into a single
+    DataFrame, e.g. to search weeks of granules at once.
 
-    # This section modifies the parameter file for the HEGTool to run
-    modify_parameter_file(
-        parameter_file,
-        input_hdf_filename,
-        new_date_output_filenames,
-        upper_left,  # $ lat and lon reversed!
-        lower_right,  # $ lat and lon reversed!
-    )
-    # This makes sure that the file is still in the correct Unix LF format
-    convert_windows_to_unix_line_endings(parameter_file)
+    Parameters
+    ----------
+    metadata_file : STRING or LIST
+        Metadata file path, or a list of metadata file paths.
 
-    # Set environment variables
-    os.environ["MRTBINDIR"] = MRTBINDIR
-    os.environ["PGSHOME"] = PGSHOME
-    os.environ["MRTDATADIR"] = MRTDATADIR
+    Returns
+    -------
+    df_txt : DataFrame
+        The rows of all the metadata files.
 
-    # Set the working directory
-    os.chdir(HEGTool_directory)
+    """
 
-    # Command to run HegTool with the parameter file
-    # https://www.hdfeos.org/software/heg.php
+    import pandas as pd
 
-    command = [
-        "swtif",
-        "-p",
-        parameter_file,
-    ]
+    if isinstance(metadata_file, str):
+        metadata_file = [metadata_file]
+    # Read the text file into a DataFrame skipping the first two rows as they are info
+    frames = [pd.read_csv(f, skiprows=2) for f in metadata_file]
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
 
-    try:
-        # Execute the command
-        subprocess.run(command, shell=False)
-        print("HegTool executed successfully.")
-    except subprocess.CalledProcessError as e:
-        # Handle error if the command fails
-        print("Error running HegTool:", e)
 
-    # $ use values from config file and what you have done above!
-    output_GeoTIFF_combined = os.path.join(
-        TIFF_Final, f"{formatted_datetime}_aqua.tif"
-    )
+def match_granules_to_aois(footprints, aoi_geometries):
+    """
+    This function finds which granule footprints intersect which areas of
+    interest in one pass. The footprints are put in an STRtree so each AOI is
+    only tested exactly against the footprints whose bounding box overlaps
+    its own, instead of against every footprint.
 
-    merge_raster(
-        tifbands[0], tifbands[1], tifbands[2], output_GeoTIFF_combined
-    )
+    Parameters
+    ----------
+    footprints : numpy array of shapely Polygons
+        Granule footprints, e.g. from build_footprints.
+    aoi_geometries : LIST or numpy array of shapely geometries
+        Areas of interest.
 
-    # Go into the kmz folder directory
-    os.chdir(kmz_folder)
+    Returns
+    -------
+    aoi_index : numpy array
+        Position of the AOI in aoi_geometries for each match.
+    granule_index : numpy array
+        Position of the footprint in footprints for each match, sorted in the
+        order of the footprints for each AOI.
 
-    # Name the output kml file path
-    output_kmz = os.path.join(kmz_folder, f"{formatted_datetime}_aqua.kml")
-    # Convert the GeoTIFF into a kml
-    convert_to_kmz(output_GeoTIFF_combined, output_kmz, gdal_translate_path)
+    """
 
-    os.chdir("..")
-    # zip the kml
-    shutil.make_archive(
-        f"{formatted_datetime}_aqua.kmz", "zip", root_dir="KMZ", base_dir=None
-    )
-    # convert the zipped kml into a kmz
-    shutil.move(
-        f"{formatted_datetime}_aqua.kmz.zip", f"{formatted_datetime}_aqua.kmz"
-    )
-    # move the kmz into the KMZ folder
-    shutil.move(
-        f"{formatted_datetime}_aqua.kmz",
-        os.path.join(kmz_folder, f"{formatted_datetime}_aqua.kmz"),
+    import numpy as np
+    import shapely
+
+    tree = shapely.STRtree(footprints)
+    aoi_index, granule_index = tree.query(
+        np.asarray(aoi_geometries, dtype=object), predicate="intersects"
     )
-    # Remove the kml file
-    os.remove(output_kmz)
+    order = np.lexsort((granule_index, aoi_index))
+    return aoi_index[order], granule_index[order]
 
-    # Removing unnecessary folders that got created during the conversion to kmz
-    os.chdir(kmz_folder)
 
-    # $ after you convert to kml you could zip the files in to a kmz, then there would be no conflict between
-    # $ the subdirectories here...
-    # Uncommnet this section if you want to delete all the extra files
+def select_granules_for_aois(df_txt, aoi_geometries):
     """
-    os.chdir(GeoTIFF_folder)
-    
-    # Get a list of all files and subdirectories in the folder
-    folder_contents = os.listdir(GeoTIFF_folder)
+    This function finds the daytime granules of the metadata that intersect
+    each area of interest.
 
-    # Loop through the contents and remove files
-    for item in folder_contents:
-        item_path = os.path.join(GeoTIFF_folder, item)
-        if os.path.isfile(item_path):
-            os.remove(item_path)
-        elif os.path.isdir(item_path):
-            shutil.rmtree(item_path)
+    Parameters
+    ----------
+    df_txt : DataFrame
+        Metadata rows, e.g. from read_metadata.
+    aoi_geometries : LIST of shapely geometries
+        Areas of interest.
 
-    os.chdir("..")
-    shutil.rmtree("tmp")
-    os.chdir(TIFF_Final)
-    os.remove(output_GeoTIFF_combined)
-    os.chdir("..")
-    """
+    Returns
+    -------
+    selections : LIST of GeoDataFrames
+        The matching daytime granules of each AOI, in the order of the
+        metadata.
+
+    """
+
+    import geopandas as gpd
+
+    # Convert bounding coordinates to Polygon geometries to display where the imagery is
+    # (granules crossing -180degs or going over a pole are handled by build_footprints)
+    geometry = build_footprints(df_txt)
+
+    # Create a GeoDataFrame to house the entries
+    gdf = gpd.GeoDataFrame(df_txt, geometry=geometry, crs="EPSG:4326")
+    # $ remove night images
+    day = (gdf.DayNightFlag == "D").to_numpy()
+
+    # Filter based on the AOI polygons
+    aoi_index, granule_index = match_granules_to_aois(geometry, aoi_geometries)
+    keep = day[granule_index]
+    aoi_index, granule_index = aoi_index[keep], granule_index[keep]
+
+    selections = []
+    for i in range(len(aoi_geometries)):
+        selected = gdf.iloc[granule_index[aoi_index == i]]
+        selections.append(selected.reset_index(drop=True))
+    return selections
+
+
+def aoi_corners(aoi_geometry):
+    """
+    This function gives the bounding box of an area of interest in the
+    format of the HegTool parameter file.
+
+    Parameters
+    ----------
+    aoi_geometry : shapely geometry
+        Area of interest.
+
+    Returns
+    -------
+    upper_left : STRING
+        The upper left coordinates in the proper format for the Bounding box.
+    lower_right : STRING
+        The lower right coordinates in the proper format for the Bounding box.
+
+    """
+
+    # Extract upper left and lower right coordinates and put it into the HEG readable format
+    (
+        xmin,
+        ymin,
+        xmax,
+        ymax,
+    ) = (
+        aoi_geometry.bounds
+    )  # .bounds gets the minumum bounding box (so the xmin, ymax, xmax, ymin) coordinates
+
+    upper_left = "( " + str(ymax) + " " + str(xmin) + " )"
+    lower_right = "( " + str(ymin) + " " + str(xmax) + " )"
+    return upper_left, lower_right
+
+
+def read_aois(kml_AOI_files):
+    """
+    This function reads every placemark of every layer of one or more KML
+    files. Each placemark is an area of interest in batch mode.
+
+    Parameters
+    ----------
+    kml_AOI_files : LIST
+        KML file paths.
+
+    Returns
+    -------
+    aois : GeoDataFrame
+        One row per placemark with a "name" column usable in file names.
+
+    """
+
+    import pandas as pd
+    import geopandas as gpd
+    import fiona
+
+    enable_kml_driver()
+
+    frames = []
+    for kml_file in kml_AOI_files:
+        # layers by position, their names differ between the LIBKML driver of
+        # fiona and the KML driver pyogrio may pick
+        for layer in range(len(fiona.listlayers(kml_file))):
+            layer_aois = gpd.read_file(
+                kml_file, driver="LIBKML", layer=layer, crs="EPSG:4326"
+            )
+            layer_aois = layer_aois[~layer_aois.geometry.is_empty]
+            frames.append(layer_aois)
+    aois = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs="EPSG:4326")
+
+    # Placemark names become part of the output file names, so keep them
+    # short, without spaces and unique
+    kml_base = os.path.splitext(os.path.basename(kml_AOI_files[0]))[0]
+    names = []
+    for i, name in enumerate(aois.get("Name", pd.Series([None] * len(aois)))):
+        name = str(name) if isinstance(name, str) and name.strip() else f"{kml_base}{i}"
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name.strip())
+        while name in names:
+            name += f"_{i}"
+        names.append(name)
+    aois["name"] = names
+    return aois
+
+
+def scene_name(job_name, aoi_name):
+    """
+    This function returns the name added to the output file names and state
+    keys of a scene: the job name and the AOI name, so jobs writing to the
+    same folders never use the same file names. None when there are neither.
+
+    Parameters
+    ----------
+    job_name : STRING
+        Name of the [Job ...] section, empty without job sections.
+    aoi_name : STRING
+        Name of the area of interest, None outside of batch mode.
+
+    Returns
+    -------
+    STRING
+        The scene name, or None.
+
+    """
+
+    job_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in job_name.strip())
+    return "_".join(name for name in (job_name, aoi_name) if name) or None
+
+
+# The selected granules are saved in this file next to the metadata file
+SELECTED_KML_FILE = "test_selectedmodis.kml"
+
+
+def select_granules(metadata_file, kml_AOI_file):
+    """
+    This function finds every daytime granule of the metadata file that
+    intersects the area of interest. It also extracts the bounding box
+    coordinates for the HegTool, and saves the granules in SELECTED_KML_FILE
+    next to the metadata file.
+
+    Parameters
+    ----------
+    metadata_file : STRING or LIST
+        Metadata file path, or a list of metadata file paths.
+    kml_AOI_file : STRING
+        KML file path.
+
+    Returns
+    -------
+    selected_granules : GeoDataFrame
+        The matching granules, in the order of the metadata file.
+    upper_left : STRING
+        The upper left coordinates in the proper format for the Bounding box.
+    lower_right : STRING
+        The lower right coordinates in the proper format for the Bounding box.
+
+    """
+
+    import geopandas as gpd
+
+    enable_kml_driver()
+
+    with stage("metadata_parse"):
+        df_txt = read_metadata(metadata_file)
+
+    # Read the kml file and extract the aoi polygon
+    poly_aoi = gpd.read_file(kml_AOI_file, driver="LIBKML", crs="EPSG:4326")
+
+    # Extract geometry of the AOI
+    aoi_geometry = poly_aoi.geometry.iloc[0]
+
+    upper_left, lower_right = aoi_corners(aoi_geometry)
+
+    # $ Should trap errors here if no modis images intersect!
+    with stage("intersection", granules=len(df_txt)):
+        selected_granules = select_granules_for_aois(df_txt, [aoi_geometry])[0]
+    # $ this will export the df:
+    # next to the metadata file, written under a temporary name first so
+    # pipelines running at the same time never read a half written file
+    first_metadata_file = (
+        metadata_file if isinstance(metadata_file, str) else metadata_file[0]
+    )
+    selected_kml_folder = os.path.dirname(os.path.abspath(first_metadata_file))
+    fd, selected_kml = tempfile.mkstemp(suffix=".kml", dir=selected_kml_folder)
+    os.close(fd)
+    try:
+        selected_granules.to_file(selected_kml, driver="LIBKML")
+        os.replace(
+            selected_kml, os.path.join(selected_kml_folder, SELECTED_KML_FILE)
+        )
+    finally:
+        if os.path.exists(selected_kml):
+            os.remove(selected_kml)
+
+    return selected_granules, upper_left, lower_right
+
+
+def extract_granule_id(metadata_file, kml_AOI_file, testmode):
+    """
+    This function extracts the granule id from the metadata file. It also extracts
+    the bounding box coordinates for the HegTool
+    It includes a test mode that will designate a specific test time.
+
+
+    Parameters
+    ----------
+    metadata_file : STRING
+        Metadata file path.
+    kml_file : STRING
+        KML file path.
+    testmode : STRING
+        A specific date and time to run the function in test mode.
+
+    Returns
+    -------
+    TYPE
+        DESCRIPTION.
+    granule_id: STRING
+        Granule ID.
+    upper_left : STRING
+        The upper left coordinates in the proper format for the Bounding box.
+    lower_right : STRING
+        The lower right coordinates in the proper format for the Bounding box.
+
+    """
+
+    selected_granules, upper_left, lower_right = select_granules(
+        metadata_file, kml_AOI_file
+    )
+    granule_id = pick_granule(selected_granules, testmode)
+    return granule_id, upper_left, lower_right
+
+
+def pick_granule(selected_granules, testmode):
+    """
+    This function picks the granule to process among the matching ones: the
+    most recent one, or in test mode the one closest to the test time.
+
+    Parameters
+    ----------
+    selected_granules : GeoDataFrame
+        The matching granules, from select_granules.
+    testmode : STRING
+        A specific date and time to run the function in test mode.
+
+    Returns
+    -------
+    STRING
+        Granule ID.
+
+    """
+
+    import pandas as pd
+
+    # $ adding here for testmode
+    if testmode == "":
+        selected_granule = selected_granules.iloc[-1]
+    else:
+        # $ test mode always gets the closest image in time to the time specified
+        t = datetime.strptime(testmode, "%Y-%m-%d %H:%M")
+        # $ should use loc instead..  come back to fix...
+        selected_granules["StartDateTime"] = pd.to_datetime(
+            selected_granules["StartDateTime"]
+        )
+        deltat = selected_granules["StartDateTime"] - t
+        selected_granule = selected_granules.iloc[deltat.dt.seconds.idxmin()]
+
+    return str(selected_granule["# GranuleID"])
+
+
+def previous_granules(selected_granules, granule_id, count):
+    """
+    This function returns the matching granules just before granule_id, to
+    fall back to when the HDF file of granule_id is not published yet.
+
+    Parameters
+    ----------
+    selected_granules : GeoDataFrame
+        The matching granules, from select_granules, oldest first.
+    granule_id : STRING
+        Granule ID, e.g. from pick_granule.
+    count : INT
+        Maximum number of granules returned.
+
+    Returns
+    -------
+    LIST
+        Up to count granule IDs, newest first.
+
+    """
+
+    granule_ids = [str(g) for g in selected_granules["# GranuleID"]]
+    if count <= 0 or granule_id not in granule_ids:
+        return []
+    i = granule_ids.index(granule_id)
+    return granule_ids[max(0, i - count):i][::-1]
+
+
+def extract_granule_ids(metadata_file, kml_AOI_file):
+    """
+    This function extracts the granule ids of every daytime pass over the
+    area of interest, with the bounding box coordinates for the HegTool.
+
+    Parameters
+    ----------
+    metadata_file : STRING
+        Metadata file path.
+    kml_AOI_file : STRING
+        KML file path.
+
+    Returns
+    -------
+    granule_ids : LIST
+        Granule IDs of all the matching passes, oldest first.
+    upper_left : STRING
+        The upper left coordinates in the proper format for the Bounding box.
+    lower_right : STRING
+        The lower right coordinates in the proper format for the Bounding box.
+
+    """
+
+    selected_granules, upper_left, lower_right = select_granules(
+        metadata_file, kml_AOI_file
+    )
+    granule_ids = [str(g) for g in selected_granules["# GranuleID"]]
+    return granule_ids, upper_left, lower_right
+
+
+def granule_to_hdf_filename(granule_id):
+    """
+    This function turns a MYD03 granule id from the metadata file into the
+    name of the matching MYD09 HDF file.
+
+    Parameters
+    ----------
+    granule_id : STRING
+        Granule ID, e.g. MYD03.A2024102.1730.061.NRT.hdf
+
+    Returns
+    -------
+    STRING
+        The MYD09 HDF file name, e.g. MYD09.A2024102.1730.061.NRT.hdf
+
+    """
+
+    # $ you must modfify granule_id to match the MYD09 filename you want:
+    return granule_id[:4] + "9" + granule_id[5:19] + ".061.NRT.hdf"
+
+
+# HDF to GeoTIFF conversion (Zacharie)--------------------------------------
+
+
+# This section of the code was given by Derek
+# hdf file for the time
+def extract_date_from_filename(hdf_filename):
+    """
+    This function read the date time from the HDF file.
+
+    Parameters
+    ----------
+    hdf_filename : STRING
+        HDF file name.
+
+    Returns
+    -------
+    hdf_date : datetime object
+        Formated date time of the HDF file.
+
+    """
+
+    dt = os.path.basename(hdf_filename)[
+        7:19
+    ]  # $ note that you can use position to get info too.
+    hdf_date = datetime.strptime(dt, "%Y%j.%H%M")
+    return hdf_date
+
+
+def add_datetime_to_filenames(
+    GeoTIFF_folder, base_filenames, formatted_datetime
+):
+    """
+    This function builds the final GeoTIFF file names to place in the HEGTool
+    parameter file based off of designated GeoTIFF folder, base name and date.
+
+    Parameters
+    ----------
+    GeoTIFF_folder : STRING
+        GeoTIFF folder path.
+    base_filenames : LIST
+        List of the 3 bands file names.
+    formatted_datetime : datetime object
+        The formatted datetime taken from extract_date_from_filename function.
+
+    Returns
+    -------
+    new_filenames : LIST
+        A list containing the final 3 GeoTIFF names with dates added for the parameter file.
+
+    """
+
+    new_filenames = []
+    for filename in base_filenames:
+        # Split the file name and extension
+        base_name, extension = os.path.splitext(filename)
+        # Create the new filename with datetime and the original extension
+        new_filename = os.path.join(
+            GeoTIFF_folder,
+            f"{formatted_datetime}_MODIS_SWATH_TYPE_L2_{base_name}{extension}",
+        )
+        new_filenames.append(new_filename)
+
+    return new_filenames
+
+
+# Parameter file template ------------------------------------------------------
+# Parameters of the parameter file that are filled in for every job
+TEMPLATE_PARAMETERS = (
+    "INPUT_FILENAME",
+    "OUTPUT_FILENAME",
+    "SPATIAL_SUBSET_UL_CORNER",
+    "SPATIAL_SUBSET_LR_CORNER",
+)
+
+
+@lru_cache(maxsize=16)
+def _read_parameter_template(parameter_file, mtime_ns):
+    # mtime_ns is only part of the cache key, so an edited file is read again
+    with open(parameter_file, "r") as file:
+        lines = [line.rstrip("\r\n") for line in file]
+
+    template = []
+    for line in lines:
+        name = line.split("=", 1)[0].strip() if "=" in line else None
+        template.append((name if name in TEMPLATE_PARAMETERS else None, line))
+    return tuple(template)
+
+
+def load_parameter_template(parameter_file):
+    """
+    This function reads a HegTool parameter file once and keeps it in memory
+    as a template, until the file changes on disk.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file path.
+
+    Returns
+    -------
+    template : TUPLE
+        (parameter name, line) for each line of the file, without the line
+        endings. The parameter name is None for the lines that are copied as is.
+
+    """
+
+    parameter_file = os.path.abspath(parameter_file)
+    return _read_parameter_template(
+        parameter_file, os.stat(parameter_file).st_mtime_ns
+    )
+
+
+def render_parameter_file(
+    parameter_file,
+    HDF_input_filename,
+    GeoTIFF_output_filenames,
+    ul_corner_coordinates,
+    lr_corner_coordinates,
+    output_folder=None,
+):
+    """
+    This function fills in the parameter file template for one job and
+    writes it to a new temporary file with Unix (LF) line endings. The
+    template file itself is never modified, so several jobs can run at the
+    same time.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file (template) path.
+    HDF_input_filename : STRING
+        HDF file path.
+    GeoTIFF_output_filenames : LIST
+        The GeoTIFF output names, in the order of the BEGIN/END blocks.
+    ul_corner_coordinates : STRING
+        Upper left bounding box coordinates.
+    lr_corner_coordinates : STRING
+        Lower right bounding box coordinates.
+    output_folder : STRING, optional
+        Folder of the new parameter file, the system temporary folder by
+        default.
+
+    Returns
+    -------
+    job_parameter_file : STRING
+        Path of the new parameter file. The caller removes it when done.
+
+    """
+
+    values = {
+        "INPUT_FILENAME": HDF_input_filename,
+        "SPATIAL_SUBSET_UL_CORNER": ul_corner_coordinates,
+        "SPATIAL_SUBSET_LR_CORNER": lr_corner_coordinates,
+    }
+    outputs = iter(GeoTIFF_output_filenames)
+
+    lines = []
+    for name, line in load_parameter_template(parameter_file):
+        if name == "OUTPUT_FILENAME":
+            try:
+                lines.append(f"{name} = {next(outputs)}")
+            except StopIteration:
+                raise ValueError(
+                    f"{parameter_file} has more OUTPUT_FILENAME lines than "
+                    f"the {len(GeoTIFF_output_filenames)} output file names"
+                )
+        elif name is not None:
+            lines.append(f"{name} = {values[name]}")
+        else:
+            lines.append(line)
+
+    fd, job_parameter_file = tempfile.mkstemp(
+        prefix="heg_", suffix=".prm", dir=output_folder
+    )
+    # HegTool needs Unix (LF) line endings
+    with os.fdopen(fd, "w", newline="\n") as file:
+        file.write("\n".join(lines) + "\n")
+    return job_parameter_file
+
+
+def parse_parameter_file(parameter_file):
+    """
+    This function reads the BEGIN/END blocks of a HegTool parameter file.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file path.
+
+    Returns
+    -------
+    blocks : LIST
+        One DICT per BEGIN/END block, with the parameter names as keys and
+        their text values.
+
+    """
+
+    blocks = []
+    block = None
+    for _, line in load_parameter_template(parameter_file):
+        line = line.strip()
+        if line == "BEGIN":
+            block = {}
+        elif line == "END":
+            if block is not None:
+                blocks.append(block)
+            block = None
+        elif block is not None and "=" in line:
+            name, value = line.split("=", 1)
+            block[name.strip()] = value.strip()
+    return blocks
+
+
+# Parallel HegTool runs ------------------------------------------------------------
+def hegtool_command(HEGTool_directory, parameter_file):
+    """
+    This function builds the swtif command line, with the full path of
+    swtif when it is found in the HegTool directory.
+
+    Parameters
+    ----------
+    HEGTool_directory : STRING
+        Required HEGTool directory path.
+    parameter_file : STRING
+        Parameter file path.
+
+    Returns
+    -------
+    command : LIST
+        The swtif command.
+
+    """
+
+    swtif = "swtif"
+    for name in ("swtif.exe", "swtif"):
+        if os.path.isfile(os.path.join(HEGTool_directory, name)):
+            swtif = os.path.join(HEGTool_directory, name)
+            break
+    return [swtif, "-p", parameter_file]
+
+
+def split_parameter_file(parameter_file, scratch_root=None):
+    """
+    This function splits a parameter file with several BEGIN/END blocks into
+    one parameter file per block (NUM_RUNS = 1), each in its own new scratch
+    folder, so the blocks can be run by separate swtif processes.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file path.
+    scratch_root : STRING, optional
+        Folder in which the scratch folders are created, the system temporary
+        folder by default.
+
+    Returns
+    -------
+    jobs : LIST
+        (scratch folder, parameter file path) for each block.
+
+    """
+
+    with open(parameter_file, "r") as file:
+        lines = [line.rstrip("\r\n") for line in file]
+
+    blocks = []
+    block = None
+    for line in lines:
+        if line.strip() == "BEGIN":
+            block = [line]
+        elif block is not None:
+            block.append(line)
+            if line.strip() == "END":
+                blocks.append(block)
+                block = None
+
+    jobs = []
+    for i, block in enumerate(blocks):
+        scratch = tempfile.mkdtemp(prefix=f"heg_run{i + 1}_", dir=scratch_root)
+        block_file = os.path.join(scratch, os.path.basename(parameter_file))
+        # HegTool needs Unix (LF) line endings
+        with open(block_file, "w", newline="\n") as file:
+            file.write("\nNUM_RUNS = 1\n\n" + "\n".join(block) + "\n\n")
+        jobs.append((scratch, block_file))
+    return jobs
+
+
+def run_hegtool_parallel(
+    parameter_file, HEGTool_directory, env, max_workers=3, scratch_root=None
+):
+    """
+    This function runs every BEGIN/END block of the parameter file in its own
+    swtif process, all at the same time, each one in its own scratch folder.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file path.
+    HEGTool_directory : STRING
+        Required HEGTool directory path.
+    env : DICT
+        Environment of the swtif processes (with MRTBINDIR, PGSHOME and
+        MRTDATADIR).
+    max_workers : INT, optional
+        Number of swtif processes running at the same time.
+    scratch_root : STRING, optional
+        Folder in which the scratch folders are created.
+
+    Returns
+    -------
+    returncodes : LIST
+        The exit code of each swtif run, in the order of the blocks.
+
+    """
+
+    jobs = split_parameter_file(parameter_file, scratch_root)
+
+    def run(job):
+        scratch, block_file = job
+        try:
+            result = run_subprocess(
+                hegtool_command(HEGTool_directory, block_file),
+                shell=False,
+                cwd=scratch,
+                env=env,
+            )
+            return result.returncode
+        except OSError as e:
+            print("Error running HegTool:", e)
+            return -1
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # every swtif run counts in the stage of the caller
+            futures = [
+                executor.submit(contextvars.copy_context().run, run, job)
+                for job in jobs
+            ]
+            returncodes = [future.result() for future in futures]
+    finally:
+        for scratch, _ in jobs:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    for i, code in enumerate(returncodes):
+        if code != 0:
+            print(f"HegTool run {i + 1} of {len(jobs)} failed with exit code {code}")
+    return returncodes
+
+
+def run_hegtool(
+    parameter_file,
+    HDF_input_filename,
+    GeoTIFF_output_filenames,
+    ul_corner_coordinates,
+    lr_corner_coordinates,
+    HEGTool_directory,
+    MRTBINDIR,
+    PGSHOME,
+    MRTDATADIR,
+    hegtool_workers=1,
+    work_dir=None,
+):
+    """
+    This function fills in the parameter file for one HDF file in a new file
+    of its own (the parameter_file template is left as is) and runs the
+    HegTool swtif on it.
+
+    Parameters
+    ----------
+    parameter_file : STRING
+        Parameter file (template) path.
+    HDF_input_filename : STRING
+        HDF file path.
+    GeoTIFF_output_filenames : LIST
+        The GeoTIFF output names, in the order of the BEGIN/END blocks.
+    ul_corner_coordinates : STRING
+        Upper left bounding box coordinates.
+    lr_corner_coordinates : STRING
+        Lower right bounding box coordinates.
+    HEGTool_directory : STRING
+        Required HEGTool directory path.
+    MRTBINDIR : STRING
+        Required HEGTool computer environment path.
+    PGSHOME : STRING
+        Required HEGTool computer environment path.
+    MRTDATADIR : STRING
+        Required HEGTool computer environment path.
+    hegtool_workers : INT, optional
+        Number of swtif processes run at the same time, one per band of the
+        parameter file. 1 runs the whole parameter file in one swtif call.
+    work_dir : STRING, optional
+        Working folder of swtif and of the job parameter file, by default the
+        HegTool directory and the system temporary folder.
+
+    Returns
+    -------
+    returncodes : LIST
+        The exit code of each swtif run.
+
+    """
+
+    job_parameter_file = render_parameter_file(
+        parameter_file,
+        HDF_input_filename,
+        GeoTIFF_output_filenames,
+        ul_corner_coordinates,  # $ lat and lon reversed!
+        lr_corner_coordinates,  # $ lat and lon reversed!
+        work_dir,
+    )
+
+    # Environment variables of the HegTool, for its processes only
+    env = dict(os.environ, MRTBINDIR=MRTBINDIR, PGSHOME=PGSHOME, MRTDATADIR=MRTDATADIR)
+
+    try:
+        if hegtool_workers > 1:
+            # One swtif process per band, all at the same time
+            returncodes = run_hegtool_parallel(
+                job_parameter_file,
+                HEGTool_directory,
+                env,
+                hegtool_workers,
+                work_dir,
+            )
+        else:
+            # Command to run HegTool with the parameter file
+            # https://www.hdfeos.org/software/heg.php
+            command = hegtool_command(HEGTool_directory, job_parameter_file)
+
+            try:
+                # Execute the command
+                result = run_subprocess(
+                    command,
+                    shell=False,
+                    cwd=work_dir or HEGTool_directory,
+                    env=env,
+                )
+                returncodes = [result.returncode]
+            except OSError as e:
+                # Handle error if the command fails
+                print("Error running HegTool:", e)
+                returncodes = [-1]
+    finally:
+        os.remove(job_parameter_file)
+
+    return returncodes
+
+
+# In-process swath reprojection (alternative to HegTool swtif) ----------------
+# Reads the bands and the geolocation straight from the MYD09 HDF file and puts
+# them on the GEO lat/lon grid of the parameter file with nearest neighbour
+# resampling. Needs the pyhdf package (conda install -c conda-forge pyhdf).
+
+
+def _parse_corner(corner):
+    """Returns (lat, lon) from a "( lat lon )" bounding box corner."""
+
+    lat, lon = corner.strip().strip("()").split()
+    return float(lat), float(lon)
+
+
+def read_swath_field(hdf_file, field_name):
+    """
+    This function reads one field of the MYD09 swath.
+
+    Parameters
+    ----------
+    hdf_file : pyhdf.SD.SD
+        The open HDF file.
+    field_name : STRING
+        Name of the field, e.g. "1km Surface Reflectance Band 1".
+
+    Returns
+    -------
+    numpy array
+        The raw field values.
+
+    """
+
+    sds = hdf_file.select(field_name)
+    try:
+        return sds.get()
+    finally:
+        sds.endaccess()
+
+
+def _upsample_geolocation(values, shape):
+    """
+    Interpolates a geolocation field given every few pixels (e.g. 5km) to the
+    full band shape. The samples are taken at the centre of each block of
+    pixels, as in the MODIS swaths.
+    """
+
+    import numpy as np
+
+    if values.shape == shape:
+        return values.astype("float64")
+    rows = (np.arange(shape[0]) + 0.5) * values.shape[0] / shape[0] - 0.5
+    cols = (np.arange(shape[1]) + 0.5) * values.shape[1] / shape[1] - 0.5
+    # Separable linear interpolation, first along the rows then the columns
+    r0 = np.clip(np.floor(rows).astype(int), 0, values.shape[0] - 2)
+    c0 = np.clip(np.floor(cols).astype(int), 0, values.shape[1] - 2)
+    wr = (rows - r0)[:, None]
+    wc = (cols - c0)[None, :]
+    along = values[r0] * (1 - wr) + values[r0 + 1] * wr
+    return along[:, c0] * (1 - wc) + along[:, c0 + 1] * wc
+
+
+def _splat_nearest(
+    lat,
+    lon,
+    coslat,
+    pixels,
+    xmin,
+    ymax,
+    pixel_x,
+    pixel_y,
+    width,
+    height,
+    max_distance,
+    radius=None,
+):
+    """
+    Compares each swath pixel with the grid cells around it (all at once with
+    NumPy broadcasting) and keeps the closest swath pixel of every cell that
+    has one within max_distance degrees. Fast when the grid cells are about
+    the size of the swath pixels or bigger. With radius=0 each swath pixel
+    is only compared with the cell it falls in.
+    """
+
+    import numpy as np
+
+    if radius is None:
+        grid_coslat = np.cos(
+            np.radians(max(abs(ymax), abs(ymax - height * pixel_y)))
+        )
+        radius_c = int(np.ceil(max_distance / (pixel_x * max(grid_coslat, 0.01))))
+        radius_r = int(np.ceil(max_distance / pixel_y))
+    else:
+        radius_c = radius_r = radius
+        max_distance = np.inf
+
+    # Fractional grid position of the swath pixels
+    col = (lon[pixels] - xmin) / pixel_x - 0.5
+    row = (ymax - lat[pixels]) / pixel_y - 0.5
+    near = (
+        (col > -radius_c - 1)
+        & (col < width + radius_c)
+        & (row > -radius_r - 1)
+        & (row < height + radius_r)
+    )
+    pixels, col, row, coslat = pixels[near], col[near], row[near], coslat[pixels[near]]
+
+    # Candidate grid cells around each swath pixel: (offsets, pixels) arrays
+    dr, dc = np.meshgrid(
+        np.arange(-radius_r, radius_r + 1),
+        np.arange(-radius_c, radius_c + 1),
+        indexing="ij",
+    )
+    target_r = np.rint(row)[None, :].astype(np.int64) + dr.ravel()[:, None]
+    target_c = np.rint(col)[None, :].astype(np.int64) + dc.ravel()[:, None]
+    distance2 = ((target_c - col) * pixel_x * coslat) ** 2 + (
+        (target_r - row) * pixel_y
+    ) ** 2
+
+    keep = (
+        (target_r >= 0)
+        & (target_r < height)
+        & (target_c >= 0)
+        & (target_c < width)
+        & (distance2 <= max_distance**2)
+    )
+    cells = (target_r * width + target_c)[keep]
+    candidates = np.broadcast_to(pixels, keep.shape)[keep]
+    distance2 = distance2[keep]
+
+    # Sort by cell then distance and keep the first (closest) of each cell
+    order = np.lexsort((distance2, cells))
+    cells, candidates = cells[order], candidates[order]
+    first = np.ones(cells.size, dtype=bool)
+    first[1:] = cells[1:] != cells[:-1]
+    return cells[first], candidates[first]
+
+
+def nearest_swath_pixels(lat, lon, xmin, ymax, pixel_x, pixel_y, width, height):
+    """
+    This function finds, for every cell of a GEO lat/lon grid, the nearest
+    swath pixel, with vectorized NumPy only. The swath pixels are first put
+    on a coarse grid with cells about the size of a swath pixel. Each cell of
+    the fine grid then starts from the swath pixel found for its coarse cell
+    and moves to the closest of the 3 by 3 neighbouring swath pixels until it
+    can't get closer. Cells further than one swath pixel spacing from any
+    swath pixel stay empty.
+
+    Parameters
+    ----------
+    lat : numpy array
+        Latitude of every swath pixel.
+    lon : numpy array
+        Longitude of every swath pixel.
+    xmin : FLOAT
+        Western edge of the grid.
+    ymax : FLOAT
+        Northern edge of the grid.
+    pixel_x : FLOAT
+        Width of the grid cells in degrees.
+    pixel_y : FLOAT
+        Height of the grid cells in degrees.
+    width : INT
+        Number of columns of the grid.
+    height : INT
+        Number of rows of the grid.
+
+    Returns
+    -------
+    cells : numpy array
+        Flat index (row * width + column) of the filled grid cells.
+    pixels : numpy array
+        Flat index in the swath of the nearest pixel of each of those cells.
+
+    """
+
+    import numpy as np
+
+    rows, cols = lat.shape
+    lat = lat.ravel()
+    lon = lon.ravel()
+    valid = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    coslat = np.cos(np.radians(np.where(valid, lat, 0)))
+    pixels = np.flatnonzero(valid)
+    empty = np.empty(0, dtype=np.int64)
+    if pixels.size == 0:
+        return empty, empty
+
+    # Spacing between neighbouring swath pixels, in degrees on the ground
+    grid_lat = lat.reshape(rows, cols)
+    grid_lon = lon.reshape(rows, cols)
+    grid_valid = valid.reshape(rows, cols)
+    grid_coslat = coslat.reshape(rows, cols)
+    steps = []
+    for a, b in (
+        ((slice(1, None), slice(None)), (slice(None, -1), slice(None))),
+        ((slice(None), slice(1, None)), (slice(None), slice(None, -1))),
+    ):
+        step = np.hypot(
+            (grid_lon[a] - grid_lon[b]) * grid_coslat[b], grid_lat[a] - grid_lat[b]
+        )
+        steps.append(step[grid_valid[a] & grid_valid[b]])
+    steps = np.concatenate(steps)
+    steps = steps[steps < 1]  # ignore jumps at the antimeridian
+    if steps.size == 0:
+        return empty, empty
+    max_distance = np.percentile(steps, 95)
+
+    # Coarse grid with cells about one swath pixel wide
+    edge_coslat = np.cos(np.radians(max(abs(ymax), abs(ymax - height * pixel_y))))
+    fx = max(1, int(max_distance / (pixel_x * max(edge_coslat, 0.01))))
+    fy = max(1, int(max_distance / pixel_y))
+    if fx == 1 and fy == 1:
+        return _splat_nearest(
+            lat, lon, coslat, pixels, xmin, ymax, pixel_x, pixel_y,
+            width, height, max_distance,
+        )
+    coarse_w = -(-width // fx)
+    coarse_h = -(-height // fy)
+    coarse_cells, coarse_pixels = _splat_nearest(
+        lat, lon, coslat, pixels, xmin, ymax, pixel_x * fx, pixel_y * fy,
+        coarse_w, coarse_h, max_distance, radius=0,
+    )
+    lookup = np.full((coarse_h, coarse_w), -1, dtype=np.int64)
+    lookup.ravel()[coarse_cells] = coarse_pixels
+    # Coarse cells that no swath pixel fell in take a neighbour's pixel
+    for _ in range(2):
+        holes = lookup < 0
+        if not holes.any():
+            break
+        padded = np.pad(lookup, 1, constant_values=-1)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                neighbour = padded[
+                    1 + dr : 1 + dr + coarse_h, 1 + dc : 1 + dc + coarse_w
+                ]
+                fill = holes & (neighbour >= 0)
+                lookup[fill] = neighbour[fill]
+                holes &= ~fill
+    lookup = lookup.ravel()
+
+    # Swath neighbours tried at each step, as offsets of the flat index in a
+    # copy of the geolocation padded with one invalid pixel all around
+    padded_lat = np.pad(
+        np.where(valid, lat, np.nan).reshape(rows, cols), 1, constant_values=np.nan
+    )
+    padded_lon = np.pad(
+        np.where(valid, lon, np.nan).reshape(rows, cols), 1, constant_values=np.nan
+    )
+    padded_lat = padded_lat.astype("float32").ravel()
+    padded_lon = padded_lon.astype("float32").ravel()
+    steps = np.array(
+        [dr * (cols + 2) + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+    )
+
+    cells_out, pixels_out = [], []
+    block_rows = max(1, 2_000_000 // max(1, width))
+    for row0 in range(0, height, block_rows):
+        r = np.arange(row0, min(row0 + block_rows, height))
+        cell_r, cell_c = np.meshgrid(r, np.arange(width), indexing="ij")
+        cell_r, cell_c = cell_r.ravel(), cell_c.ravel()
+        best = lookup[(cell_r // fy) * coarse_w + cell_c // fx]
+        has = best >= 0
+        cell_r, cell_c, best = cell_r[has], cell_c[has], best[has]
+        if best.size == 0:
+            continue
+        # index in the padded geolocation
+        best = (best // cols + 1) * (cols + 2) + best % cols + 1
+        cell_lon = (xmin + (cell_c + 0.5) * pixel_x).astype("float32")
+        cell_lat = (ymax - (cell_r + 0.5) * pixel_y).astype("float32")
+        cell_coslat = np.cos(np.radians(cell_lat))
+        best_distance2 = np.full(best.size, np.inf, dtype="float32")
+
+        # Only the cells that moved at the last step are looked at again
+        active = np.arange(best.size)
+        for _ in range(6):
+            cand = best[active, None] + steps
+            distance2 = (
+                (padded_lon[cand] - cell_lon[active, None])
+                * cell_coslat[active, None]
+            ) ** 2 + (padded_lat[cand] - cell_lat[active, None]) ** 2
+            distance2[np.isnan(distance2)] = np.inf
+            pick = distance2.argmin(axis=1)
+            index = np.arange(active.size)
+            best[active] = cand[index, pick]
+            best_distance2[active] = distance2[index, pick]
+            # the centre (pick 4) is the closest: this cell is done
+            active = active[pick != 4]
+            if active.size == 0:
+                break
+
+        close = best_distance2 <= max_distance**2
+        best = best[close]
+        cells_out.append((cell_r * width + cell_c)[close])
+        # back to the index in the swath
+        pixels_out.append((best // (cols + 2) - 1) * cols + best % (cols + 2) - 1)
+
+    if not cells_out:
+        return empty, empty
+    return np.concatenate(cells_out), np.concatenate(pixels_out)
+
+
+def reproject_swath(
+    input_hdf_filename, parameter_file, upper_left, lower_right
+):
+    """
+    This function is an in-process replacement for the HegTool swtif run:
+    it reads the 3 bands named in the parameter file and the geolocation of
+    the MYD09 swath and puts them on the GEO lat/lon grid of the bounding
+    box with nearest neighbour resampling, without writing any file.
+
+    Parameters
+    ----------
+    input_hdf_filename : STRING
+        HDF file path.
+    parameter_file : STRING
+        Parameter file path, for the FIELD_NAME and OUTPUT_PIXEL_SIZE values.
+    upper_left : STRING
+        Upper left bounding box coordinates.
+    lower_right : STRING
+        Lower right bounding box coordinates.
+
+    Returns
+    -------
+    b123 : numpy array
+        The 3 int16 bands on the grid, shape (3, rows, columns).
+    meta : DICT
+        Georeferencing of the grid, for composite_rgb.
+
+    """
+
+    import numpy as np
+    import rasterio
+
+    try:
+        from pyhdf.SD import SD, SDC
+    except ImportError:
+        # raised, not sys.exit, so a backfill worker only fails its scene
+        raise ImportError(
+            "The native swath backend needs the pyhdf package:"
+            " conda install -c conda-forge pyhdf"
+        ) from None
+
+    blocks = parse_parameter_file(parameter_file)
+    field_names = [b["FIELD_NAME"].rstrip("|").strip() for b in blocks]
+    pixel_x = float(blocks[0]["OUTPUT_PIXEL_SIZE_X"])
+    pixel_y = float(blocks[0]["OUTPUT_PIXEL_SIZE_Y"])
+
+    ymax, xmin = _parse_corner(upper_left)
+    ymin, xmax = _parse_corner(lower_right)
+    width = max(1, int(np.ceil((xmax - xmin) / pixel_x)))
+    height = max(1, int(np.ceil((ymax - ymin) / pixel_y)))
+
+    hdf_file = SD(input_hdf_filename, SDC.READ)
+    try:
+        bands = [read_swath_field(hdf_file, name) for name in field_names]
+        lat = read_swath_field(hdf_file, "Latitude")
+        lon = read_swath_field(hdf_file, "Longitude")
+    finally:
+        hdf_file.end()
+
+    lat = _upsample_geolocation(lat, bands[0].shape)
+    lon = _upsample_geolocation(lon, bands[0].shape)
+
+    cells, pixels = nearest_swath_pixels(
+        lat, lon, xmin, ymax, pixel_x, pixel_y, width, height
+    )
+
+    b123 = np.full((3, height, width), NODATA_VALUE, dtype="int16")
+    for i, band in enumerate(bands):
+        b123[i].ravel()[cells] = band.ravel()[pixels]
+
+    meta = {
+        "driver": "GTiff",
+        "crs": "EPSG:4326",
+        "transform": rasterio.transform.from_origin(xmin, ymax, pixel_x, pixel_y),
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": "int16",
+        "nodata": NODATA_VALUE,
+    }
+    return b123, meta
+
+
+# The no data value of the HegTool GeoTIFF bands
+NODATA_VALUE = -28672
+
+
+# Number of pixels handled at a time by the rescaling functions below, small
+# enough for the chunk and its float32 copy to stay in the CPU cache
+RESCALE_CHUNK = 256 * 1024
+
+
+def valid_min_max(data, nodata=NODATA_VALUE):
+    """
+    This function finds the minimum and maximum of the pixels that are not
+    no data, going through the array only once, chunk by chunk, instead of
+    building a masked array and calling np.min and np.max on it.
+
+    Parameters
+    ----------
+    data : numpy array
+        Integer band values, of any shape.
+    nodata : INT, optional
+        The no data value.
+
+    Returns
+    -------
+    vmin, vmax : INT
+        Minimum and maximum of the valid pixels, or (None, None) if every
+        pixel is no data.
+
+    """
+
+    import numpy as np
+
+    flat = data.reshape(-1)
+    info = np.iinfo(flat.dtype)
+    invalid = np.empty(min(RESCALE_CHUNK, flat.size), dtype=bool)
+    vmin, vmax = info.max, info.min
+    found = False
+    for start in range(0, flat.size, RESCALE_CHUNK):
+        chunk = flat[start : start + RESCALE_CHUNK]
+        mask = invalid[: chunk.size]
+        np.equal(chunk, nodata, out=mask)
+        np.logical_not(mask, out=mask)
+        if not mask.any():
+            continue
+        found = True
+        vmin = min(vmin, chunk.min(where=mask, initial=info.max))
+        vmax = max(vmax, chunk.max(where=mask, initial=info.min))
+
+    if not found:
+        return None, None
+    return int(vmin), int(vmax)
+
+
+def rescale_to_byte(data, vmin, vmax, nodata=NODATA_VALUE, out=None):
+    """
+    This function rescales band values from vmin..vmax to 0..255 and sets the
+    no data pixels to 0. The work is done chunk by chunk in float32 buffers
+    that are allocated once, and the result goes into a preallocated uint8
+    array, so no full size float64 temporaries are created.
+
+    Parameters
+    ----------
+    data : numpy array
+        Integer band values, of any shape.
+    vmin : INT
+        Value that becomes 0.
+    vmax : INT
+        Value that becomes 255.
+    nodata : INT, optional
+        The no data value.
+    out : numpy array, optional
+        uint8 array of the same shape as data to write the result into.
+
+    Returns
+    -------
+    out : numpy array
+        The rescaled uint8 values.
+
+    """
+
+    import numpy as np
+
+    if out is None:
+        out = np.empty(data.shape, dtype="uint8")
+    flat = data.reshape(-1)
+    flat_out = out.reshape(-1)
+
+    if vmin is None or vmax == vmin:
+        flat_out[:] = 0
+        return out
+
+    offset = np.float32(vmin)
+    scale = np.float32(1 / (vmax - vmin) * 255)
+    size = min(RESCALE_CHUNK, flat.size)
+    work = np.empty(size, dtype="float32")
+    invalid = np.empty(size, dtype=bool)
+
+    for start in range(0, flat.size, RESCALE_CHUNK):
+        chunk = flat[start : start + RESCALE_CHUNK]
+        n = chunk.size
+        np.subtract(chunk, offset, out=work[:n])
+        np.multiply(work[:n], scale, out=work[:n])
+        # no data pixels are far below vmin, keep them castable to uint8
+        np.maximum(work[:n], 0, out=work[:n])
+        dest = flat_out[start : start + n]
+        np.copyto(dest, work[:n], casting="unsafe")
+        np.equal(chunk, nodata, out=invalid[:n])
+        np.copyto(dest, 0, where=invalid[:n])
+
+    return out
+
+
+# Place Code here for GeoTIFF merge (Philip) -------------------------------------------
+# Resources used: Code snippet provided by Derek, AI and https://rasterio.readthedocs.io/en/stable/topics/color.html
+def merge_raster(band1, band2, band3, output_name, block_size=0):
+    """
+    This functions takes 3 bands and merges them together in one GeoTIFF file. It does this by changing the data from int16 to uint8 and then scalling the 3 bands by weight.
+
+    Parameters
+    ----------
+    band1 : STRING
+        Band 1 GeoTIFF file path.
+    band2 : STRING
+        Band 2 GeoTIFF file path.
+    band3 : STRING
+        Band 3 GeoTIFF file path.
+    output_name : STRING
+        Final combined GeoTIFF file path with name.
+    block_size : INT, optional
+        If not 0, the bands are processed in tiles of block_size by
+        block_size pixels with merge_raster_windowed, to limit the memory use.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    import numpy as np
+    import rasterio
+
+    if block_size:
+        return merge_raster_windowed(
+            band1, band2, band3, output_name, block_size
+        )
+
+    # Open grayscale GeoTIFF files
+    with rasterio.open(band1) as src1, rasterio.open(
+        band2
+    ) as src2, rasterio.open(band3) as src3:
+        # Read the 3 bands straight into one array
+        b123 = np.empty((3, src1.height, src1.width), dtype=src1.dtypes[0])
+        for i, src in enumerate((src1, src2, src3)):
+            src.read(1, out=b123[i])
+        # Get metadata from one of the input files
+        meta = src1.meta.copy()
+
+    composite_rgb(b123, meta, output_name)
+
+
+def composite_rgb(b123, meta, output_name):
+    """
+    This function rescales 3 bands to byte and writes them as an RGB GeoTIFF.
+
+    Parameters
+    ----------
+    b123 : numpy array
+        The 3 int16 bands, shape (3, rows, columns).
+    meta : DICT
+        Georeferencing of the bands (crs, transform, width, height...).
+    output_name : STRING
+        Final combined GeoTIFF file path with name.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    import rasterio
+
+    # $ rescale the image to byte
+    # $ ignore the no data value
+    # https://stackoverflow.com/questions/49922460/scale-a-numpy-array-with-from-0-1-0-2-to-0-255
+    vmin, vmax = valid_min_max(b123, NODATA_VALUE)
+    scaled = rescale_to_byte(b123, vmin, vmax, NODATA_VALUE)
+    # scaled = np.interp(b123masked, (np.min(b123masked), np.max(b123masked)), (0, 255)).astype("uint8")
+
+    # $ if you want to do this you need to actually change the data from int16 to uint8, otherwise it won't work... Look up scale numpy array to 0-255
+    meta = rgb_profile(meta)
+
+    # Write stacked RGB image to output file, all the bands in one call
+    with rasterio.open(output_name, "w", **meta) as dst:
+        dst.write(scaled)
+        finish_rgb(dst)
+
+    print("RGB image saved as '{}'".format(output_name))
+
+
+# Creation options of the merged RGB GeoTIFF
+RGB_BLOCK_SIZE = 256
+RGB_COMPRESSION = "deflate"
+
+
+def rgb_profile(meta, block_size=RGB_BLOCK_SIZE):
+    """
+    This function turns the metadata of a band GeoTIFF into the profile of
+    the merged RGB GeoTIFF: 3 uint8 bands, photometric RGB, tiled and
+    compressed, all set when the file is created.
+
+    Parameters
+    ----------
+    meta : DICT
+        Metadata of one of the band GeoTIFFs.
+    block_size : INT, optional
+        Tile width and height in pixels, a multiple of 16.
+
+    Returns
+    -------
+    profile : DICT
+        Profile to pass to rasterio.open.
+
+    """
+
+    profile = dict(meta)
+    profile.update(
+        driver="GTiff",
+        count=3,  # Update the band count to 3 for RGB
+        dtype="uint8",  # Update the data type to ensure RGB interpretation
+        nodata=0,  # Remove nodata value
+        photometric="RGB",
+        interleave="pixel",
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        compress=RGB_COMPRESSION,
+    )
+    return profile
+
+
+def finish_rgb(dst):
+    """
+    This function sets the color interpretation and builds the overviews of
+    a merged RGB GeoTIFF that is still open for writing, so the file does
+    not need to be opened again.
+
+    Parameters
+    ----------
+    dst : rasterio dataset
+        The RGB GeoTIFF, opened in "w" mode with its bands written.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    from rasterio.enums import ColorInterp, Resampling
+
+    dst.colorinterp = [
+        ColorInterp.red,
+        ColorInterp.green,
+        ColorInterp.blue,
+    ]
+
+    # Overviews halving the size until the image fits in one tile
+    factors = []
+    factor = 2
+    while max(dst.width, dst.height) / factor >= RGB_BLOCK_SIZE / 2:
+        factors.append(factor)
+        factor *= 2
+    if factors:
+        dst.build_overviews(factors, Resampling.average)
+        dst.update_tags(ns="rio_overview", resampling="average")
+
+
+def iter_windows(width, height, block_size):
+    """
+    Yields the windows of a width by height raster in tiles of block_size
+    pixels, row by row.
+    """
+
+    from rasterio.windows import Window
+
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(
+                col_off,
+                row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off),
+            )
+
+
+def merge_raster_windowed(band1, band2, band3, output_name, block_size=512):
+    """
+    This function does the same as merge_raster but reads and writes the
+    rasters one tile at a time, so the memory used stays at about one tile
+    per band whatever the size of the AOI. The rescaling needs the minimum
+    and maximum of the 3 bands, so the tiles are read twice: a first pass
+    finds the minimum and maximum and a second pass rescales and writes.
+
+    Parameters
+    ----------
+    band1 : STRING
+        Band 1 GeoTIFF file path.
+    band2 : STRING
+        Band 2 GeoTIFF file path.
+    band3 : STRING
+        Band 3 GeoTIFF file path.
+    output_name : STRING
+        Final combined GeoTIFF file path with name.
+    block_size : INT, optional
+        Width and height of the tiles in pixels, rounded to a multiple of 16
+        as required for GeoTIFF tiles.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    import numpy as np
+    import rasterio
+
+    block_size = max(16, block_size // 16 * 16)
+
+    with rasterio.open(band1) as src1, rasterio.open(
+        band2
+    ) as src2, rasterio.open(band3) as src3:
+        sources = (src1, src2, src3)
+        width, height = src1.width, src1.height
+
+        # First pass: minimum and maximum of the valid pixels of the 3 bands
+        vmin, vmax = None, None
+        for window in iter_windows(width, height, block_size):
+            for src in sources:
+                bmin, bmax = valid_min_max(src.read(1, window=window))
+                if bmin is not None:
+                    vmin = bmin if vmin is None else min(vmin, bmin)
+                    vmax = bmax if vmax is None else max(vmax, bmax)
+
+        meta = rgb_profile(src1.meta, block_size)
+
+        # Second pass: rescale each tile to byte and write it
+        with rasterio.open(output_name, "w", **meta) as dst:
+            for window in iter_windows(width, height, block_size):
+                tile = np.empty(
+                    (3, window.height, window.width), dtype="uint8"
+                )
+                for i, src in enumerate(sources):
+                    rescale_to_byte(
+                        src.read(1, window=window), vmin, vmax, out=tile[i]
+                    )
+                dst.write(tile, window=window)
+
+            finish_rgb(dst)
+
+    print("RGB image saved as '{}'".format(output_name))
+
+
+# Place Code here for GeoTIFF to KML conversion (Shea) ------------------------------
+def convert_to_kmz(input_tiff, output_kmz, gdal_translate_path):
+    """
+    This function converts a GeoTIFF file into a superoverlay kmz file.
+
+    Parameters
+    ----------
+    input_tiff : STRING
+        GeoTIFF file path.
+    output_kmz : STRING
+        KMZ file path.
+    gdal_translate_path : STRING
+        Path to the computers gdal_translate.exe.
+
+    Returns
+    -------
+    BOOL
+        True when gdal_translate made the kml.
+
+    """
+
+    # 'gdal_translate' is a GDAL utility used to convert raster data between different formats, '-of' 'KMLSUPEROVERLAY' specify the output format
+
+    command = [
+        gdal_translate_path,
+        "-of",
+        "KMLSUPEROVERLAY",
+        input_tiff,
+        output_kmz,
+    ]
+    # Run the command
+    try:
+        returncode = run_subprocess(command, shell=False).returncode
+    except OSError as e:  # gdal_translate not found
+        print(f"Error during conversion to KMZ: {e}")
+        return False
+    if returncode != 0 or not os.path.isfile(output_kmz):
+        print(f"Error during conversion to KMZ, gdal_translate exit code {returncode}")
+        return False
+    print("Conversion to KMZ complete.")
+    return True
+
+
+# Native KMZ super-overlay writer (alternative to gdal_translate) ----------------
+KMZ_TILE_SIZE = 256
+
+
+def _kml_region(west, south, east, north, min_lod):
+    return (
+        "<Region><LatLonAltBox>"
+        f"<north>{north:.8f}</north><south>{south:.8f}</south>"
+        f"<east>{east:.8f}</east><west>{west:.8f}</west>"
+        "</LatLonAltBox>"
+        f"<Lod><minLodPixels>{min_lod}</minLodPixels>"
+        "<maxLodPixels>-1</maxLodPixels></Lod></Region>"
+    )
+
+
+def _kml_document(name, body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        f"<name>{name}</name>{body}</Document></kml>\n"
+    ).encode("utf-8")
+
+
+def write_kmz_superoverlay(input_tiff, output_kmz, tile_size=KMZ_TILE_SIZE):
+    """
+    This function converts the merged RGB GeoTIFF into a KMZ super-overlay
+    (a pyramid of image tiles with KML regions, so Google Earth only loads the
+    tiles in view) without gdal_translate. The tiles are read from the
+    GeoTIFF overviews, encoded in memory and written straight into the KMZ
+    archive, so only the files of this image are packaged.
+
+    Parameters
+    ----------
+    input_tiff : STRING
+        RGB GeoTIFF path, in lat/lon (EPSG:4326).
+    output_kmz : STRING
+        KMZ file path.
+    tile_size : INT, optional
+        Width and height of the tiles in pixels.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    import numpy as np
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.errors import NotGeoreferencedWarning
+    from rasterio.io import MemoryFile
+    from rasterio.windows import Window
+
+    name = os.path.splitext(os.path.basename(output_kmz))[0]
+    part_file = output_kmz + ".part"
+
+    with rasterio.open(input_tiff) as src:
+        if src.crs is None or not src.crs.is_geographic:
+            raise ValueError(
+                f"{input_tiff} is not in lat/lon, use kmz_writer = gdal"
+            )
+        width, height = src.width, src.height
+        # Level max_level has the full resolution, level 0 is a single tile
+        max_level = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+        def tile_window(level, x, y):
+            span = tile_size * 2 ** (max_level - level)
+            col, row = x * span, y * span
+            if col >= width or row >= height:
+                return None
+            return Window(col, row, min(span, width - col), min(span, height - row))
+
+        def tile_bounds(window):
+            west, north = src.transform * (window.col_off, window.row_off)
+            east, south = src.transform * (
+                window.col_off + window.width,
+                window.row_off + window.height,
+            )
+            return west, south, east, north
+
+        def tile_image(level, window):
+            factor = 2 ** (max_level - level)
+            shape = (
+                math.ceil(window.height / factor),
+                math.ceil(window.width / factor),
+            )
+            rgba = np.empty((4,) + shape, dtype="uint8")
+            rgba[:3] = src.read(
+                [1, 2, 3],
+                window=window,
+                out_shape=(3,) + shape,
+                resampling=Resampling.average,
+            )
+            # no data (0 in every band) is transparent
+            rgba[3] = np.where(rgba[:3].any(axis=0), 255, 0)
+            # like gdal_translate: JPEG for the tiles without no data, smaller
+            # and faster to encode, PNG with transparency for the others
+            if rgba[3].all():
+                driver, ext, image, options = "JPEG", "jpg", rgba[:3], {"quality": 90}
+            else:
+                driver, ext, image, options = "PNG", "png", rgba, {}
+            with warnings.catch_warnings():
+                # the tiles are placed by the KML, not georeferenced
+                warnings.simplefilter("ignore", NotGeoreferencedWarning)
+                with MemoryFile() as memfile:
+                    with memfile.open(
+                        driver=driver,
+                        width=shape[1],
+                        height=shape[0],
+                        count=len(image),
+                        dtype="uint8",
+                        **options,
+                    ) as dst:
+                        dst.write(image)
+                    return ext, memfile.read()
+
+        with zipfile.ZipFile(part_file, "w", zipfile.ZIP_DEFLATED) as kmz:
+            # Google Earth opens the first KML file of the archive
+            root = tile_window(0, 0, 0)
+            kmz.writestr(
+                "doc.kml",
+                _kml_document(
+                    name,
+                    "<NetworkLink><name>0/0/0</name>"
+                    + _kml_region(*tile_bounds(root), 0)
+                    + "<Link><href>0/0/0.kml</href>"
+                    "<viewRefreshMode>onRegion</viewRefreshMode></Link>"
+                    "</NetworkLink>",
+                ),
+            )
+
+            tiles = [(0, 0, 0)]
+            while tiles:
+                level, x, y = tiles.pop()
+                window = tile_window(level, x, y)
+                west, south, east, north = tile_bounds(window)
+
+                # the images are already compressed
+                ext, image = tile_image(level, window)
+                kmz.writestr(
+                    f"{level}/{x}/{y}.{ext}", image, compress_type=zipfile.ZIP_STORED
+                )
+                body = (
+                    f"<GroundOverlay><drawOrder>{level}</drawOrder>"
+                    f"<Icon><href>{y}.{ext}</href></Icon>"
+                    f"<LatLonBox><north>{north:.8f}</north><south>{south:.8f}</south>"
+                    f"<east>{east:.8f}</east><west>{west:.8f}</west></LatLonBox>"
+                    "</GroundOverlay>"
+                )
+                if level < max_level:
+                    for cx, cy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                        child = (level + 1, 2 * x + cx, 2 * y + cy)
+                        child_window = tile_window(*child)
+                        if child_window is None:
+                            continue
+                        # children load once they show at half their size and
+                        # are drawn over their parent
+                        body += (
+                            "<NetworkLink>"
+                            + _kml_region(*tile_bounds(child_window), tile_size // 2)
+                            + f"<Link><href>../../{child[0]}/{child[1]}/{child[2]}.kml</href>"
+                            "<viewRefreshMode>onRegion</viewRefreshMode></Link>"
+                            "</NetworkLink>"
+                        )
+                        tiles.append(child)
+                kmz.writestr(
+                    f"{level}/{x}/{y}.kml", _kml_document(f"{level}/{x}/{y}", body)
+                )
+
+    os.replace(part_file, output_kmz)
+    print(f"KMZ saved as '{output_kmz}'")
+
+
+# Place Code to Read from config file (Zacharie) -------------------------------------------------
+
+
+def getargs():
+    """
+    This function retrieves the configuration file path.
+
+    Returns
+    -------
+    cfg_path : STRING
+        Configuration file path.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Process a file path.")
+
+    # add an argument for configfile
+    parser.add_argument(
+        "configfile",
+        type=str,
+        help="enter the full path and name of your config file",
+    )
+    # now make a list of all the arguments
+    args = parser.parse_args()
+    cfg_path = args.configfile
+    return cfg_path
+
+
+def getconfig(cfg_path):
+    """
+    This function retrieves the information from the config file and places it into variables
+
+    Parameters
+    ----------
+    cfg_path : STRING
+        Configuration file path.
+
+    Returns
+    -------
+    PipelineConfig
+        The values below, in this order. It is a tuple, so it can be unpacked.
+    parameter_file : STRING
+        HegTool parameter file path.
+    GeoTIFF_folder : STRING
+        GeoTIFF folder path.
+    TIFF_Final : STRING
+        Final merged GeoTIFF file path.
+    base_filenames : LIST
+        List of 3 base file names.
+    HEGTool_directory : STRING
+        Required HEGTool directory path.
+    MRTBINDIR : STRING
+        Required HEGTool computer environment path.
+    PGSHOME : STRING
+        Required HEGTool computer environment path.
+    MRTDATADIR : STRING
+        Required HEGTool computer environment path.
+    auth_token : STRING
+        Required HEGTool NASA Authentication Token.
+    download_HDF_folder : STRING
+        HDF download folder path.
+    metadata_file : STRING
+        Metadata file path.
+    base_txt_url : STRING
+        Base url for the txt download for MODIS.
+    base_HDF_url : STRING
+        Base url for the HDF download for MODIS.
+    test_time : STRING
+        Date and time for test mode.
+    gdal_translate_path : STRING
+        gdal translate exe path on computer.
+    kml_AOI_file : STRING
+        KML Area of Interest file path.
+    kmz_folder : STRING
+        KMZ output folder path.
+
+    """
+
+    try:
+        # read once, then again only when the file changes
+        config, _, _ = read_config(cfg_path)
+    except ConfigError as e:
+        print(
+            "Trouble reading config file, please check the file and path are valid\n"
+        )
+        print(e)
+        sys.exit(1)
+
+    return config
+
+
+# Optional settings, read from the [Options] section of the config file.
+# Every option has a default so older config files keep working.
+DEFAULT_OPTIONS = {
+    "downloader": "native",
+    "all_granules": False,
+    "download_workers": 4,
+    "max_connections_per_host": 2,
+    "download_attempts": 3,
+    "metadata_cache": True,
+    "batch_mode": False,
+    "merge_block_size": 0,
+    "swath_backend": "hegtool",
+    "hegtool_workers": 1,
+    "watch": False,
+    "watch_interval": 900,
+    "watch_state_file": "",
+    "state_store": True,
+    "state_db": "",
+    "stage_log": True,
+    "stage_log_file": "",
+    "profile": "",
+    "profile_output": "",
+    "kmz_writer": "gdal",
+    "backfill_start": "",
+    "backfill_end": "",
+    "backfill_workers": 0,
+    "backfill_HDF_url": "",
+    "frontend": "threads",
+    "request_timeout": 60.0,
+    "retry_deadline": 900.0,
+    "retry_delay": 30.0,
+    "retry_max_delay": 300.0,
+    "fallback_granules": 1,
+}
+
+
+def getoptions(cfg_path):
+    """
+    This function retrieves the optional settings from the [Options] section
+    of the config file. Missing options get their value from DEFAULT_OPTIONS
+    and are converted to the same type as the default.
+
+    Parameters
+    ----------
+    cfg_path : STRING
+        Configuration file path.
+
+    Returns
+    -------
+    options : DICT
+        Option name and value pairs.
+
+    """
+
+    try:
+        _, options, _ = read_config(cfg_path)
+    except ConfigError as e:
+        print(f"Trouble reading the [Options] section of the config file: {e}\n")
+        sys.exit(1)
+
+    # a copy, the cached options are shared
+    return dict(options)
+
+
+def _read_options(config, section, options):
+    """
+    This function updates options with the values of a section of the config
+    file, converted to the type of their DEFAULT_OPTIONS value.
+    """
+
+    options = dict(options)
+    for name, default in DEFAULT_OPTIONS.items():
+        if not config.has_option(section, name):
+            continue
+        try:
+            if isinstance(default, bool):
+                options[name] = config.getboolean(section, name)
+            elif isinstance(default, int):
+                options[name] = config.getint(section, name)
+            elif isinstance(default, float):
+                options[name] = config.getfloat(section, name)
+            else:
+                options[name] = config.get(section, name).strip()
+        except ValueError as e:
+            raise ConfigError(f"[{section}] {name}: {e}") from None
+    return options
+
+
+# Config model ---------------------------------------------------------------------
+# Section of the config file of every PipelineConfig value
+CONFIG_SECTIONS = {
+    "parameter_file": "Paths",
+    "GeoTIFF_folder": "Paths",
+    "TIFF_Final": "Paths",
+    "gdal_translate_path": "Paths",
+    "base_filenames": "Names",
+    "HEGTool_directory": "HegTool",
+    "MRTBINDIR": "HegTool",
+    "PGSHOME": "HegTool",
+    "MRTDATADIR": "HegTool",
+    "auth_token": "LANCE",
+    "download_HDF_folder": "LANCE",
+    "metadata_file": "LANCE",
+    "base_txt_url": "LANCE",
+    "base_HDF_url": "LANCE",
+    "test_time": "LANCE",
+    "kml_AOI_file": "BoundingBox",
+    "kmz_folder": "Paths",
+}
+# Prefix of the job sections, e.g. [Job cambridge]
+JOB_SECTION = "Job "
+
+
+class ConfigError(ValueError):
+    """The config file is missing values or has values that cannot work."""
+
+
+class PipelineConfig(NamedTuple):
+    """
+    The config file values, in the order getconfig always returned them, so
+    it can still be unpacked and indexed like the old tuple.
+    """
+
+    parameter_file: str
+    GeoTIFF_folder: str
+    TIFF_Final: str
+    gdal_translate_path: str
+    base_filenames: str
+    HEGTool_directory: str
+    MRTBINDIR: str
+    PGSHOME: str
+    MRTDATADIR: str
+    auth_token: str
+    download_HDF_folder: str
+    metadata_file: str
+    base_txt_url: str
+    base_HDF_url: str
+    test_time: str
+    kml_AOI_file: str
+    kmz_folder: str
+
+
+class Job(NamedTuple):
+    """
+    One job of the config file: a name (empty without [Job ...] sections),
+    its config values and options, and the fingerprint of its settings.
+    """
+
+    name: str
+    config: PipelineConfig
+    options: dict
+    fingerprint: str
+
+
+def _read_section_config(config, section=None):
+    """
+    This function builds a PipelineConfig from the [Paths], [Names], [HegTool],
+    [LANCE] and [BoundingBox] sections, with the values of section (a job
+    section) taking their place.
+    """
+
+    values = {}
+    for name, default_section in CONFIG_SECTIONS.items():
+        if section is not None and config.has_option(section, name):
+            values[name] = config.get(section, name)
+        elif config.has_option(default_section, name):
+            values[name] = config.get(default_section, name)
+        else:
+            raise ConfigError(f"[{default_section}] {name} is missing")
+    return PipelineConfig(**values)
+
+
+@lru_cache(maxsize=8)
+def _read_config_file(cfg, mtime_ns):
+    """
+    This function parses the config file cfg, once per modification time
+    (mtime_ns is only part of the cache key).
+    """
+
+    config = RawConfigParser()
+    try:
+        if not config.read(cfg):
+            raise ConfigError(f"Cannot read {cfg}")
+    except ConfigParserError as e:
+        raise ConfigError(str(e)) from None
+
+    base = _read_section_config(config)
+    options = _read_options(config, "Options", DEFAULT_OPTIONS)
+    jobs = tuple(
+        (
+            section[len(JOB_SECTION):].strip(),
+            _read_section_config(config, section),
+            _read_options(config, section, options),
+        )
+        for section in config.sections()
+        if section.startswith(JOB_SECTION)
+    )
+    return base, options, jobs
+
+
+def read_config(cfg_path):
+    """
+    This function reads the config file, or takes it from the cache when it
+    did not change since the last time.
+
+    Parameters
+    ----------
+    cfg_path : STRING
+        Configuration file path.
+
+    Returns
+    -------
+    config : PipelineConfig
+        The values of the config file, without the job sections.
+    options : DICT
+        The [Options] values. Shared by every caller, do not change it.
+    jobs : TUPLE
+        (name, PipelineConfig, options) of every [Job name] section, the
+        values of the section taking the place of the same values in the
+        other sections. Empty without job sections.
+
+    """
+
+    cfg = os.path.abspath(os.path.expanduser(cfg_path))
+    try:
+        mtime_ns = os.stat(cfg).st_mtime_ns
+    except OSError as e:
+        raise ConfigError(f"Cannot read {cfg}: {e.strerror}") from None
+    return _read_config_file(cfg, mtime_ns)
+
+
+def validate_config(config, options):
+    """
+    This function checks the paths, tools and token of a config before any
+    download, so a typo does not show up only after the HDF files are
+    downloaded.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values.
+    options : DICT
+        The [Options] values.
+
+    Returns
+    -------
+    problems : LIST
+        One message per problem, empty when the config can work.
+
+    """
+
+    problems = []
+
+    def check(ok, message):
+        if not ok:
+            problems.append(message)
+
+    def check_file(name, path):
+        check(os.path.isfile(path), f"{name} = {path} is not a file")
+
+    def check_folder(name, path, writable=False):
+        if not os.path.isdir(path):
+            problems.append(f"{name} = {path} is not a folder")
+        elif writable and not os.access(path, os.W_OK | os.X_OK):
+            problems.append(f"{name} = {path} is not writable")
+
+    def check_date(name, value, date_format):
+        try:
+            datetime.strptime(value, date_format)
+        except ValueError:
+            problems.append(f"{name} = {value} does not match {date_format}")
+
+    check(
+        len(parse_base_filenames(config.base_filenames)) == 3,
+        "base_filenames needs 3 names, one per line",
+    )
+    check(
+        config.auth_token.strip() not in ("", "***"),
+        "auth_token is not set, create one with your Earthdata profile",
+    )
+
+    check_file("parameter_file", config.parameter_file)
+    aoi_files = [x.strip() for x in config.kml_AOI_file.splitlines() if x.strip()]
+    check(aoi_files, "kml_AOI_file is empty")
+    for aoi_file in aoi_files:
+        check_file("kml_AOI_file", aoi_file)
+
+    for name in ("GeoTIFF_folder", "TIFF_Final", "download_HDF_folder", "kmz_folder"):
+        check_folder(name, getattr(config, name), writable=True)
+    check_folder(
+        "the folder of metadata_file",
+        os.path.dirname(os.path.abspath(config.metadata_file)),
+        writable=True,
+    )
+
+    check(
+        options["downloader"] in ("native", "wget"),
+        f"downloader = {options['downloader']}, use native or wget",
+    )
+    if options["downloader"] == "wget":
+        check(shutil.which("wget"), "downloader = wget but wget is not installed")
+
+    check(
+        options["swath_backend"] in ("hegtool", "native"),
+        f"swath_backend = {options['swath_backend']}, use hegtool or native",
+    )
+    if options["swath_backend"] == "native":
+        check(
+            importlib.util.find_spec("pyhdf") is not None,
+            "swath_backend = native but the pyhdf package is not installed",
+        )
+    if options["swath_backend"] == "hegtool":
+        check_folder("HEGTool_directory", config.HEGTool_directory)
+        for name in ("MRTBINDIR", "PGSHOME", "MRTDATADIR"):
+            check_folder(name, getattr(config, name))
+
+    check(
+        options["kmz_writer"] in ("gdal", "native"),
+        f"kmz_writer = {options['kmz_writer']}, use gdal or native",
+    )
+    if options["kmz_writer"] == "gdal":
+        check(
+            os.path.isfile(config.gdal_translate_path)
+            or shutil.which(config.gdal_translate_path),
+            f"gdal_translate_path = {config.gdal_translate_path} is not found",
+        )
+
+    check(
+        options["frontend"] in ("threads", "asyncio"),
+        f"frontend = {options['frontend']}, use threads or asyncio",
+    )
+    check(
+        options["frontend"] != "asyncio" or options["downloader"] == "native",
+        "frontend = asyncio downloads with the native client, set downloader = native",
+    )
+    check(options["request_timeout"] > 0, "request_timeout must be more than 0")
+    for name in ("retry_deadline", "retry_delay", "retry_max_delay", "fallback_granules"):
+        check(options[name] >= 0, f"{name} cannot be negative")
+    check(
+        options["profile"] in ("",) + tuple(PROFILE_OUTPUT),
+        f"profile = {options['profile']}, use {' or '.join(PROFILE_OUTPUT)}",
+    )
+    if config.test_time:
+        check_date("test_time", config.test_time, "%Y-%m-%d %H:%M")
+    for name in ("backfill_start", "backfill_end"):
+        if options[name]:
+            check_date(name, options[name], "%Y-%m-%d")
+
+    return problems
+
+
+def _settings_files(config):
+    """The files whose content is part of the settings of a job."""
+
+    return [config.parameter_file] + [
+        x.strip() for x in config.kml_AOI_file.splitlines() if x.strip()
+    ]
+
+
+def _files_mtime_ns(files):
+    """The modification time of each file, None for a missing file."""
+
+    mtimes = []
+    for path in files:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def config_fingerprint(config, options):
+    """
+    This function returns a SHA-256 checksum of the settings of a job: the
+    config values (but the token), the options and the content of the
+    parameter file and AOI files. Caches of the outputs can compare it to
+    tell when the settings changed.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values.
+    options : DICT
+        The [Options] values.
+
+    Returns
+    -------
+    STRING
+        The hexadecimal checksum.
+
+    """
+
+    files = _settings_files(config)
+    settings = {
+        "config": config._replace(auth_token="")._asdict(),
+        "options": options,
+        "files": {
+            path: file_checksum(path) if os.path.isfile(path) else None
+            for path in files
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+@lru_cache(maxsize=8)
+def _load_jobs(cfg, mtime_ns, files_mtime_ns):
+    # files_mtime_ns (the times of the parameter and AOI files of the jobs) is
+    # only part of the cache key, the checks and fingerprints depend on them
+    base, options, jobs = _read_config_file(cfg, mtime_ns)
+    if not jobs:
+        jobs = (("", base, options),)
+
+    problems = []
+    for name, config, job_options in jobs:
+        prefix = f"[{JOB_SECTION}{name}] " if name else ""
+        problems += [prefix + problem for problem in validate_config(config, job_options)]
+
+    # jobs watched at the same time would write the same metadata file
+    metadata_files = [os.path.abspath(config.metadata_file) for _, config, _ in jobs]
+    watched = any(job_options["watch"] for _, _, job_options in jobs)
+    if watched and len(set(metadata_files)) < len(metadata_files):
+        problems.append("every watched job needs its own metadata_file")
+
+    if problems:
+        raise ConfigError("\n".join(problems))
+
+    return tuple(
+        Job(name, config, job_options, config_fingerprint(config, job_options))
+        for name, config, job_options in jobs
+    )
+
+
+def load_jobs(cfg_path):
+    """
+    This function reads and checks the jobs of the config file. Every
+    [Job name] section is a job, taking the values of the other sections
+    that it does not set itself; without job sections the whole file is one
+    job. The result is cached until the config file, or a parameter or AOI
+    file of a job, changes.
+
+    Parameters
+    ----------
+    cfg_path : STRING
+        Configuration file path.
+
+    Raises
+    ------
+    ConfigError
+        With one line per problem found by validate_config.
+
+    Returns
+    -------
+    LIST
+        One Job per job of the config file.
+
+    """
+
+    cfg = os.path.abspath(os.path.expanduser(cfg_path))
+    base, _, jobs = read_config(cfg)  # reports a missing file as a ConfigError
+    files = _settings_files(base) + [
+        path for _, config, _ in jobs for path in _settings_files(config)
+    ]
+    jobs = _load_jobs(cfg, os.stat(cfg).st_mtime_ns, _files_mtime_ns(files))
+    # copies of the options, the cached ones are shared
+    return [job._replace(options=dict(job.options)) for job in jobs]
+
+
+def process_granule(
+    input_hdf_filename,
+    upper_left,
+    lower_right,
+    parameter_file,
+    GeoTIFF_folder,
+    base_filenames,
+    TIFF_Final,
+    HEGTool_directory,
+    MRTBINDIR,
+    PGSHOME,
+    MRTDATADIR,
+    gdal_translate_path,
+    kmz_folder,
+    aoi_name=None,
+    merge_block_size=0,
+    swath_backend="hegtool",
+    hegtool_workers=1,
+    state=None,
+    kmz_writer="gdal",
+    work_dir=None,
+):
+    """
+    This function runs the processing of one downloaded HDF file: HegTool
+    conversion of the 3 bands, merge into an RGB GeoTIFF and conversion to KMZ.
+
+    Parameters
+    ----------
+    input_hdf_filename : STRING
+        HDF file path.
+    upper_left : STRING
+        Upper left bounding box coordinates.
+    lower_right : STRING
+        Lower right bounding box coordinates.
+    parameter_file : STRING
+        Parameter file path.
+    GeoTIFF_folder : STRING
+        GeoTIFF folder path.
+    base_filenames : LIST
+        List of 3 base file names.
+    TIFF_Final : STRING
+        Final merged GeoTIFF folder path.
+    HEGTool_directory : STRING
+        Required HEGTool directory path.
+    MRTBINDIR : STRING
+        Required HEGTool computer environment path.
+    PGSHOME : STRING
+        Required HEGTool computer environment path.
+    MRTDATADIR : STRING
+        Required HEGTool computer environment path.
+    gdal_translate_path : STRING
+        gdal translate exe path on computer.
+    kmz_folder : STRING
+        KMZ output folder path.
+    aoi_name : STRING, optional
+        Name of the area of interest, added to the output file names in
+        batch mode.
+    merge_block_size : INT, optional
+        Tile size for merge_raster, 0 to merge the bands in one go.
+    swath_backend : STRING, optional
+        "hegtool" to run the HegTool swtif or "native" to reproject the
+        swath in process with reproject_swath.
+    hegtool_workers : INT, optional
+        Number of swtif processes run at the same time, one per band of the
+        parameter file. 1 runs the whole parameter file in one swtif call.
+    state : StateStore, optional
+        Records the finished stages, which are skipped when the granule is
+        processed again.
+    kmz_writer : STRING, optional
+        "gdal" to make the KMZ with gdal_translate and zip its files, or
+        "native" to write it with write_kmz_superoverlay.
+    work_dir : STRING, optional
+        Folder for the temporary files (parameter file, swtif working folder,
+        KMZ tiles), by default the system temporary folder.
+
+    Returns
+    -------
+    BOOL
+        True when the KMZ was made.
+
+    """
+
+    # Extract date from hdf file
+    hdf_date = extract_date_from_filename(input_hdf_filename)
+    # $ note only date is retrieved, not time?!
+    if hdf_date:
+        formatted_datetime = hdf_date.strftime(
+            "%Y-%m-%d_%H%M"
+        )  # $ replaced . with :
+        print("Extracted Date from HDF Filename:", formatted_datetime)
+    else:
+        print("Failed to extract date from HDF filename.")
+
+    # In batch mode every AOI gets its own set of output files
+    if aoi_name:
+        formatted_datetime = f"{formatted_datetime}_{aoi_name}"
+
+    # $ use values from config file and what you have done above!
+    output_GeoTIFF_combined = os.path.join(
+        os.path.abspath(TIFF_Final), f"{formatted_datetime}_aqua.tif"
+    )
+    final_kmz = os.path.join(
+        os.path.abspath(kmz_folder), f"{formatted_datetime}_aqua.kmz"
+    )
+    granule = os.path.basename(input_hdf_filename)
+    # What the outputs depend on besides the HDF file, a finished stage is
+    # only skipped when these did not change
+    swath_inputs = stage_inputs(
+        upper_left,
+        lower_right,
+        file_checksum(parameter_file),
+        list(base_filenames),
+        swath_backend,
+    )
+    kmz_inputs = stage_inputs(swath_inputs, kmz_writer)
+
+    if state is not None and state.done(
+        granule, aoi_name, "kmz", [final_kmz], kmz_inputs
+    ):
+        print(f"{final_kmz} is already done")
+        return True
+
+    if state is not None and state.done(
+        granule, aoi_name, "merge", [output_GeoTIFF_combined], swath_inputs
+    ):
+        print(f"{output_GeoTIFF_combined} is already done")
+    elif swath_backend == "native":
+        # Reproject the swath in memory and merge the bands straight away,
+        # without the HegTool and its 3 intermediate GeoTIFFs
+        with stage("native_swath", granule=granule, aoi=aoi_name):
+            b123, meta = reproject_swath(
+                input_hdf_filename, parameter_file, upper_left, lower_right
+            )
+        with stage("merge", granule=granule, aoi=aoi_name) as record:
+            composite_rgb(b123, meta, output_GeoTIFF_combined)
+            record["bytes"] = os.path.getsize(output_GeoTIFF_combined)
+        if state is not None:
+            state.record(
+                granule, aoi_name, "merge", [output_GeoTIFF_combined], swath_inputs
+            )
+    else:
+        new_date_output_filenames = add_datetime_to_filenames(
+            os.path.abspath(GeoTIFF_folder), base_filenames, formatted_datetime
+        )
+
+        tifbands = tuple(new_date_output_filenames)
+        if state is not None and state.done(
+            granule, aoi_name, "swath", tifbands, swath_inputs
+        ):
+            print("The HegTool bands are already done")
+            returncodes = []
+        else:
+            with stage("hegtool", granule=granule, aoi=aoi_name) as record:
+                returncodes = run_hegtool(
+                    parameter_file,
+                    input_hdf_filename,
+                    new_date_output_filenames,
+                    upper_left,
+                    lower_right,
+                    HEGTool_directory,
+                    MRTBINDIR,
+                    PGSHOME,
+                    MRTDATADIR,
+                    hegtool_workers,
+                    work_dir,
+                )
+                record["returncodes"] = returncodes
+            if any(returncodes):
+                print(f"Error running HegTool, exit codes {returncodes}")
+                return False
+            print("HegTool executed successfully.")
+            if state is not None:
+                state.record(granule, aoi_name, "swath", tifbands, swath_inputs)
+
+        with stage("merge", granule=granule, aoi=aoi_name) as record:
+            merge_raster(
+                tifbands[0],
+                tifbands[1],
+                tifbands[2],
+                output_GeoTIFF_combined,
+                merge_block_size,
+            )
+            record["bytes"] = os.path.getsize(output_GeoTIFF_combined)
+        if state is not None:
+            state.record(
+                granule, aoi_name, "merge", [output_GeoTIFF_combined], swath_inputs
+            )
+
+    if kmz_writer == "native":
+        # Tiles written straight into the KMZ, nothing else in kmz_folder is
+        # touched
+        with stage("kmz", granule=granule, aoi=aoi_name) as record:
+            write_kmz_superoverlay(output_GeoTIFF_combined, final_kmz)
+            record["bytes"] = os.path.getsize(final_kmz)
+    else:
+        # gdal_translate writes the kml and its tile folders in a new folder,
+        # which is zipped on its own so only this image ends up in the KMZ
+        kmz_build = tempfile.mkdtemp(prefix="kmz_", dir=work_dir)
+        try:
+            # Name the output kml file path
+            output_kmz = os.path.join(kmz_build, f"{formatted_datetime}_aqua.kml")
+            # Convert the GeoTIFF into a kml
+            with stage("kml", granule=granule, aoi=aoi_name):
+                converted = convert_to_kmz(
+                    output_GeoTIFF_combined, output_kmz, gdal_translate_path
+                )
+            if not converted:
+                # no KMZ, and the stage is not recorded so it is tried again
+                return False
+            with stage("zip", granule=granule, aoi=aoi_name) as record:
+                # zip the kml and its tiles, then move the zip into the KMZ folder
+                archive = shutil.make_archive(kmz_build, "zip", root_dir=kmz_build)
+                shutil.move(archive, final_kmz)
+                record["bytes"] = os.path.getsize(final_kmz)
+        finally:
+            shutil.rmtree(kmz_build, ignore_errors=True)
+
+    if state is not None:
+        state.record(granule, aoi_name, "kmz", [final_kmz], kmz_inputs)
+
+    # $ after you convert to kml you could zip the files in to a kmz, then there would be no conflict between
+    # $ the subdirectories here...
+    # Uncommnet this section if you want to delete all the extra files
+    """
+    os.chdir(GeoTIFF_folder)
+    
+    # Get a list of all files and subdirectories in the folder
+    folder_contents = os.listdir(GeoTIFF_folder)
+
+    # Loop through the contents and remove files
+    for item in folder_contents:
+        item_path = os.path.join(GeoTIFF_folder, item)
+        if os.path.isfile(item_path):
+            os.remove(item_path)
+        elif os.path.isdir(item_path):
+            shutil.rmtree(item_path)
+
+    os.chdir("..")
+    shutil.rmtree("tmp")
+    os.chdir(TIFF_Final)
+    os.remove(output_GeoTIFF_combined)
+    os.chdir("..")
+    """
+
+    return True
     # $ can clean up old hdf files too...
 
 
+# Pipeline state -------------------------------------------------------------------
+STATE_DB_FILE = "state.sqlite"
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    This function returns the SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    path : STRING
+        File path.
+    chunk_size : INT, optional
+        Bytes read at a time.
+
+    Returns
+    -------
+    STRING
+        The hexadecimal checksum.
+
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_inputs(*values):
+    """
+    This function returns a digest of the inputs of a pipeline stage (bounding
+    box, parameter file checksum, backends...), stored with the stage in the
+    StateStore.
+
+    Parameters
+    ----------
+    *values
+        JSON serialisable values.
+
+    Returns
+    -------
+    STRING
+        The hexadecimal digest.
+
+    """
+
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class StateStore:
+    """
+    A small SQLite database recording which stages of the pipeline are
+    finished for each granule and AOI, with the size, modification time and
+    SHA-256 checksum of their output files and a digest of their inputs (see
+    stage_inputs). A stage counts as finished only while its output files are
+    still there unchanged and it would be run with the same inputs, so a run
+    after a crash or a change of the bounding box only redoes the stages that
+    need it.
+
+    Parameters
+    ----------
+    db_file : STRING
+        SQLite database file path, created if needed.
+
+    """
+
+    def __init__(self, db_file):
+        self.db_file = os.path.abspath(db_file)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_file, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                "granule TEXT, aoi TEXT, stage TEXT, outputs TEXT, "
+                "finished REAL, inputs TEXT DEFAULT '', "
+                "PRIMARY KEY (granule, aoi, stage))"
+            )
+            columns = [c[1] for c in self._db.execute("PRAGMA table_info(stages)")]
+            if "inputs" not in columns:  # database of an older version
+                self._db.execute(
+                    "ALTER TABLE stages ADD COLUMN inputs TEXT DEFAULT ''"
+                )
+
+    def done(self, granule, aoi, stage, outputs, inputs=None):
+        """
+        Check that a stage is recorded as finished with these output files and
+        inputs, and that the files did not change since: same size, and same
+        time or, when the time changed (e.g. a copied file), same checksum.
+
+        Parameters
+        ----------
+        granule : STRING
+            HDF file name.
+        aoi : STRING
+            Name of the area of interest, None outside of batch mode.
+        stage : STRING
+            Stage name.
+        outputs : LIST
+            Output file paths of the stage.
+        inputs : STRING, optional
+            Digest of the inputs of the stage, from stage_inputs.
+
+        Returns
+        -------
+        BOOL
+            True if the stage can be skipped.
+
+        """
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT outputs, inputs FROM stages "
+                "WHERE granule=? AND aoi=? AND stage=?",
+                (granule, aoi or "", stage),
+            ).fetchone()
+        if row is None or row[1] != (inputs or ""):
+            return False
+        recorded = json.loads(row[0])
+        if sorted(recorded) != sorted(os.path.abspath(o) for o in outputs):
+            return False
+        for path, (size, mtime_ns, *checksum) in recorded.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_size != size:
+                return False
+            if st.st_mtime_ns != mtime_ns and checksum != [file_checksum(path)]:
+                return False
+        return True
+
+    def record(self, granule, aoi, stage, outputs, inputs=None):
+        """
+        Record a stage as finished, with the size, time and SHA-256 checksum
+        of its output files and the digest of its inputs.
+
+        Parameters
+        ----------
+        granule : STRING
+            HDF file name.
+        aoi : STRING
+            Name of the area of interest, None outside of batch mode.
+        stage : STRING
+            Stage name.
+        outputs : LIST
+            Output file paths of the stage.
+        inputs : STRING, optional
+            Digest of the inputs of the stage, from stage_inputs.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        recorded = {}
+        for path in outputs:
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            recorded[path] = (st.st_size, st.st_mtime_ns, file_checksum(path))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stages "
+                "(granule, aoi, stage, outputs, finished, inputs) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    granule,
+                    aoi or "",
+                    stage,
+                    json.dumps(recorded),
+                    datetime.utcnow().timestamp(),
+                    inputs or "",
+                ),
+            )
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        with self._lock:
+            self._db.close()
+
+
+# Instrumentation ------------------------------------------------------------------
+STAGE_LOG_FILE = "stages.jsonl"
+PROFILE_OUTPUT = {
+    "cprofile": "ImageDownloaderProject.prof",
+    "pyinstrument": "ImageDownloaderProject.html",
+}
+_stage_log = None
+_stage_log_lock = threading.Lock()
+# Record of the stage running in this thread (or task), for run_subprocess
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+def set_stage_log(log_file):
+    """
+    This function sets the JSON lines file the stage records are appended
+    to, None to stop recording.
+
+    Parameters
+    ----------
+    log_file : STRING
+        Stage log file path, or None.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    global _stage_log
+    _stage_log = os.path.abspath(log_file) if log_file else None
+
+
+def peak_rss_mb():
+    """
+    This function returns the peak memory use (resident set size) of the
+    script so far, in MB, or None when it cannot be measured.
+
+    Returns
+    -------
+    FLOAT
+        Peak memory use in MB.
+
+    """
+
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / 2**20, 1)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    This context manager times one stage of the pipeline and appends a JSON
+    line to the stage log: wall time, wall and CPU time of the subprocesses
+    the stage ran with run_subprocess (HegTool, gdal_translate, wget), peak
+    memory and the given fields. The "bytes" field can be set on the yielded
+    record.
+
+    process_cpu_s and process_child_cpu_s come from os.times and cover the
+    whole script, so they include the other stages running at the same time
+    in other threads. process_child_cpu_s is None on Windows, which does not
+    report it.
+
+    Parameters
+    ----------
+    name : STRING
+        Stage name.
+    **fields
+        Extra values to log, e.g. the granule.
+
+    Yields
+    ------
+    record : DICT
+        The log record, to add values to.
+
+    """
+
+    record = {
+        "stage": name,
+        **fields,
+        "subprocess_wall_s": 0.0,
+        "subprocess_cpu_s": 0.0,
+    }
+    started = datetime.utcnow()
+    wall = time.perf_counter()
+    times = os.times()
+    status = "ok"
+    token = _current_stage.set(record)
+    try:
+        yield record
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_stage.reset(token)
+        if _stage_log is not None:
+            end = os.times()
+            record.update(
+                start=started.isoformat(timespec="seconds"),
+                status=status,
+                wall_s=round(time.perf_counter() - wall, 3),
+                process_cpu_s=round(
+                    end.user + end.system - times.user - times.system, 3
+                ),
+                process_child_cpu_s=None
+                if os.name == "nt"
+                else round(
+                    end.children_user
+                    + end.children_system
+                    - times.children_user
+                    - times.children_system,
+                    3,
+                ),
+                peak_rss_mb=peak_rss_mb(),
+            )
+            for key in ("subprocess_wall_s", "subprocess_cpu_s"):
+                if record[key] is not None:
+                    record[key] = round(record[key], 3)
+            with _stage_log_lock:
+                with open(_stage_log, "a") as file:
+                    file.write(json.dumps(record, default=str) + "\n")
+
+
+def _wait_measured(process):
+    # Waits for the process and returns its CPU time in seconds, None when it
+    # cannot be measured
+    if hasattr(os, "wait4"):
+        # the resource usage of this one child, whatever else the script runs
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage.ru_utime + usage.ru_stime
+
+    try:
+        import psutil
+    except ImportError:
+        process.wait()
+        return None
+    # Windows: the last CPU time read before the process ended
+    cpu = None
+    try:
+        handle = psutil.Process(process.pid)
+        while process.poll() is None:
+            times = handle.cpu_times()
+            cpu = times.user + times.system
+            time.sleep(0.05)
+    except psutil.Error:
+        pass
+    process.wait()
+    return cpu
+
+
+def run_subprocess(command, **kwargs):
+    """
+    This function runs a command like subprocess.run and adds its wall time
+    and CPU time to the stage running in this thread, if any. The CPU time is
+    that of this process only (from wait4, or psutil on Windows), so stages
+    running at the same time do not count each other's subprocesses.
+
+    Parameters
+    ----------
+    command : LIST
+        The command and its arguments.
+    **kwargs
+        Arguments of subprocess.Popen (cwd, env...).
+
+    Raises
+    ------
+    OSError
+        If the command cannot be run.
+
+    Returns
+    -------
+    subprocess.CompletedProcess
+        With the exit code of the command.
+
+    """
+
+    wall = time.perf_counter()
+    with subprocess.Popen(command, **kwargs) as process:
+        try:
+            cpu = _wait_measured(process)
+        except BaseException:
+            process.kill()
+            raise
+    wall = time.perf_counter() - wall
+
+    record = _current_stage.get()
+    if record is not None:
+        with _stage_log_lock:
+            record["subprocess_wall_s"] += wall
+            if cpu is None or record["subprocess_cpu_s"] is None:
+                record["subprocess_cpu_s"] = None
+            else:
+                record["subprocess_cpu_s"] += cpu
+    return subprocess.CompletedProcess(command, process.returncode)
+
+
+def run_profiled(func, profiler, output_file=None):
+    """
+    This function runs func under a profiler and saves the profile, with a
+    summary printed at the end (also after Ctrl+C in watch mode).
+
+    Parameters
+    ----------
+    func : FUNCTION
+        Function to run, without arguments.
+    profiler : STRING
+        "cprofile", or "pyinstrument" (needs the pyinstrument package).
+    output_file : STRING, optional
+        Profile file, a .prof file for cProfile (for snakeviz or pstats) or an
+        HTML page for pyinstrument. By default PROFILE_OUTPUT.
+
+    Returns
+    -------
+    The value returned by func.
+
+    """
+
+    output_file = output_file or PROFILE_OUTPUT[profiler]
+    if profiler == "cprofile":
+        import cProfile
+        import pstats
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func)
+        finally:
+            profile.dump_stats(output_file)
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+            print(f"Profile saved as {output_file}")
+    elif profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError(
+                "profile = pyinstrument needs the pyinstrument package:"
+                " pip install pyinstrument"
+            )
+
+        profile = Profiler()
+        profile.start()
+        try:
+            return func()
+        finally:
+            profile.stop()
+            print(profile.output_text(unicode=False, color=False))
+            with open(output_file, "w") as file:
+                file.write(profile.output_html())
+            print(f"Profile saved as {output_file}")
+    else:
+        raise ValueError(f"Unknown profiler {profiler}, use cprofile or pyinstrument")
+
+
+# Watch mode -----------------------------------------------------------------------
+WATCH_STATE_FILE = "watermark.json"
+# Longest wait before a granule that was not found on LANCE is tried again
+WATCH_MAX_BACKOFF = 4 * 3600
+# Processed granules older than this are dropped from the watermark
+WATCH_KEEP_DAYS = 8
+
+
+def read_watermark(state_file):
+    """
+    This function reads the watch mode watermark: the jobs already processed
+    and the HDF files waiting to be tried again.
+
+    Parameters
+    ----------
+    state_file : STRING
+        Watermark JSON file path.
+
+    Returns
+    -------
+    watermark : DICT
+        "processed" maps a job key to the time it was processed, "pending"
+        maps an HDF file name to its number of attempts and next try time,
+        and "fingerprint" is the one of the settings they were processed
+        with.
+
+    """
+
+    try:
+        with open(state_file, "r") as file:
+            watermark = json.load(file)
+    except (OSError, ValueError):
+        watermark = {}
+    watermark.setdefault("processed", {})
+    watermark.setdefault("pending", {})
+    return watermark
+
+
+def write_watermark(state_file, watermark):
+    """
+    This function saves the watch mode watermark, dropping the entries older
+    than WATCH_KEEP_DAYS.
+
+    Parameters
+    ----------
+    state_file : STRING
+        Watermark JSON file path.
+    watermark : DICT
+        The watermark from read_watermark.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    oldest = datetime.utcnow().timestamp() - WATCH_KEEP_DAYS * 86400
+    watermark["processed"] = {
+        key: t for key, t in watermark["processed"].items() if t >= oldest
+    }
+    watermark["pending"] = {
+        key: p
+        for key, p in watermark["pending"].items()
+        if p.get("next_try", 0) >= oldest
+    }
+    with open(state_file + ".tmp", "w") as file:
+        json.dump(watermark, file, indent=1)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def watch_key(hdf_filename, aoi_name):
+    """
+    This function returns the watermark key of one job.
+
+    Parameters
+    ----------
+    hdf_filename : STRING
+        HDF file name.
+    aoi_name : STRING
+        Name of the area of interest, None outside of batch mode.
+
+    Returns
+    -------
+    STRING
+        The job key.
+
+    """
+
+    return f"{hdf_filename}|{aoi_name or ''}"
+
+
+def run_cycle(
+    config,
+    options,
+    base_filenames,
+    watermark=None,
+    interval=0,
+    job_name="",
+    async_downloads=None,
+):
+    """
+    This function runs the script once: downloads the metadata file, picks
+    the granules over the AOI(s), downloads their HDF files and makes the
+    KMZ files. With a watermark, the jobs already processed are skipped and
+    the HDF files not found on LANCE are tried again later with a growing
+    wait, starting at interval.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values, from getconfig or load_jobs.
+    options : DICT
+        The [Options] values, from getoptions.
+    base_filenames : LIST
+        List of the 3 bands file names.
+    watermark : DICT, optional
+        The watch mode watermark, from read_watermark. It is updated in place.
+    interval : INT, optional
+        Seconds between two watch mode cycles.
+    job_name : STRING, optional
+        Name of the job, added to the output file names (see scene_name).
+    async_downloads : AsyncDownloads, optional
+        Runs the downloads on the event loop of the asyncio frontend, for a
+        cycle running in a worker thread of that loop. By default they run
+        in this thread.
+
+    Returns
+    -------
+    BOOL
+        False when none of the HDF files could be downloaded.
+
+    """
+
+    (
+        parameter_file,
+        GeoTIFF_folder,
+        TIFF_Final,
+        gdal_translate_path,
+        _,
+        HEGTool_directory,
+        MRTBINDIR,
+        PGSHOME,
+        MRTDATADIR,
+        auth_token,
+        download_HDF_folder,
+        metadata_file,
+        base_txt_url,
+        base_HDF_url,
+        test_time,
+        kml_AOI_file,
+        kmz_folder,
+    ) = config
+
+    # Get the date from today in UTC time to build the correct url for txt download
+    # $ I suggest you add a variable in the config file called testmode (or similar).
+    # $ if test mode is true, then it might override the t = now and put in a timestamp that would
+    # $ result in a given image, that way when you run the script it will give exactly the same kmz as
+    # $ you have in the test output file
+
+    # Get the current UTC date and time
+    if test_time == "":
+        t = datetime.utcnow()
+    else:
+        t = datetime.strptime(test_time, "%Y-%m-%d %H:%M")
+
+    # Format the date string for the text file name
+    txt_file_name = datetime.strftime(t, "MYD03_%Y-%m-%d.txt")
+
+    # Construct the full URL for the text file download
+    txt_url_full = base_txt_url + datetime.strftime(t, "%Y/") + txt_file_name
+
+    # Download the txt file for that day
+    if options["metadata_cache"]:
+        metadata_cache_dir = os.path.join(
+            os.path.dirname(os.path.abspath(metadata_file)), "metadata_cache"
+        )
+    else:
+        metadata_cache_dir = None
+    # In watch mode the next cycle tries again, so every download is tried once
+    policy = RetryPolicy.from_options(options) if watermark is None else RetryPolicy()
+
+    def download_metadata(url):
+        if async_downloads is not None:
+            return async_downloads.download_txt_file_threadsafe(
+                url, auth_token, metadata_file, metadata_cache_dir
+            )
+        return download_txt_file(
+            url, auth_token, metadata_file, options["downloader"], metadata_cache_dir
+        )
+
+    with stage("metadata_download", url=txt_url_full) as record:
+        results, record["retries"] = retry_downloads(
+            lambda urls: {url: download_metadata(url) for url in urls},
+            [txt_url_full],
+            policy,
+        )
+        if os.path.isfile(metadata_file):
+            record["bytes"] = os.path.getsize(metadata_file)
+    if results[txt_url_full] == "unauthorized":
+        print("LANCE refused the token, check the auth_token of the config file")
+        return False
+
+    print("--------------------------")
+
+    if options["batch_mode"]:
+        # Every placemark of every KML file listed in kml_AOI_file is an AOI
+        kml_AOI_files = [x.strip() for x in kml_AOI_file.splitlines() if x.strip()]
+        aois = read_aois(kml_AOI_files)
+        with stage("metadata_parse"):
+            df_txt = read_metadata(metadata_file)
+        with stage("intersection", granules=len(df_txt), aois=len(aois)):
+            selections = select_granules_for_aois(df_txt, list(aois.geometry))
+        aoi_selections = [
+            (scene_name(job_name, aoi_name), aoi_corners(aoi_geometry), selected)
+            for aoi_name, aoi_geometry, selected in zip(
+                aois["name"], aois.geometry, selections
+            )
+        ]
+    else:
+        selected, upper_left, lower_right = select_granules(
+            metadata_file, kml_AOI_file
+        )
+        aoi_selections = [
+            (scene_name(job_name, None), (upper_left, lower_right), selected)
+        ]
+
+    jobs = []
+    # Older granules of each job, newest first, used when its HDF file is
+    # not published yet
+    fallbacks = {}
+    for aoi_name, (upper_left, lower_right), selected in aoi_selections:
+        if len(selected) == 0:
+            print(f"No matching MODIS image for {aoi_name or kml_AOI_file}")
+            continue
+        if options["all_granules"]:
+            # Every daytime pass over the AOI
+            granule_ids = [str(g) for g in selected["# GranuleID"]]
+        else:
+            granule_ids = [pick_granule(selected, test_time)]
+            if watermark is None:
+                fallbacks[(granule_to_hdf_filename(granule_ids[0]), aoi_name)] = [
+                    granule_to_hdf_filename(g)
+                    for g in previous_granules(
+                        selected, granule_ids[0], options["fallback_granules"]
+                    )
+                ]
+        jobs += [(g, upper_left, lower_right, aoi_name) for g in granule_ids]
+
+    jobs = [
+        (granule_to_hdf_filename(g), upper_left, lower_right, aoi_name)
+        for g, upper_left, lower_right, aoi_name in jobs
+    ]
+
+    now = datetime.utcnow().timestamp()
+    if watermark is not None:
+        # Only the granules not processed yet, and not waiting for a retry
+        jobs = [
+            job
+            for job in jobs
+            if watch_key(job[0], job[3]) not in watermark["processed"]
+            and watermark["pending"].get(job[0], {}).get("next_try", 0) <= now
+        ]
+        if not jobs:
+            print("No new MODIS image")
+            return True
+
+    # Each HDF file is downloaded once, even if several AOIs need it
+    hdf_filenames = list(dict.fromkeys(job[0] for job in jobs))
+
+    print("--------------------------")
+    for granule_id in hdf_filenames:
+        print(f"Found matching MODIS image: {granule_id}")
+    print("--------------------------")
+
+    # $ you need to replace the base_HDF_url in the config file with:
+    # $ base_HDF_url = https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/61/MYD09/Recent
+
+    # $ added a condition so you don't download the file more than once
+    # (a download in progress stays in a .part file, so the HDF file only
+    # exists once it is complete)
+    downloaded = []
+
+    def download(granule_ids):
+        missing_urls = {
+            base_HDF_url + "/" + granule_id: granule_id
+            for granule_id in granule_ids
+            if not os.path.isfile(os.path.join(download_HDF_folder, granule_id))
+        }
+        results = {g: "ok" for g in granule_ids if g not in missing_urls.values()}
+        for hdf_url_full in missing_urls:
+            print(f"Downloding... {hdf_url_full}....")
+        # This line downloads all the missing hdf files at the same time
+        if async_downloads is not None:
+            hdf_results = async_downloads.download_HDF_files_threadsafe(
+                list(missing_urls), auth_token, download_HDF_folder
+            )
+        else:
+            hdf_results = download_HDF_files(
+                list(missing_urls),
+                auth_token,
+                download_HDF_folder,
+                options["downloader"],
+                options["download_workers"],
+                options["max_connections_per_host"],
+                options["download_attempts"],
+            )
+        for url, msg in hdf_results.items():
+            results[missing_urls[url]] = msg
+            if msg == "ok":
+                downloaded.append(missing_urls[url])
+        return results
+
+    with stage("download", files=len(hdf_filenames)) as record:
+        results, record["retries"] = retry_downloads(download, hdf_filenames, policy)
+
+        # Fall back to the previous matching granule, level by level, for the
+        # jobs whose HDF file is still not published
+        for level in range(options["fallback_granules"]):
+            if "unauthorized" in results.values():
+                break
+            replaced = {}
+            for i, (granule_id, upper_left, lower_right, aoi_name) in enumerate(jobs):
+                older = fallbacks.get((granule_id, aoi_name), [])
+                if results.get(granule_id) == "not found" and older:
+                    replaced[i] = older[0]
+                    fallbacks[(older[0], aoi_name)] = older[1:]
+            if not replaced:
+                break
+            for i, granule_id in replaced.items():
+                print(f"{jobs[i][0]} is not published yet, falling back to {granule_id}")
+                jobs[i] = (granule_id,) + jobs[i][1:]
+            results.update(download(list(dict.fromkeys(replaced.values()))))
+            record["fallbacks"] = level + 1
+
+        record["bytes"] = sum(
+            os.path.getsize(os.path.join(download_HDF_folder, granule_id))
+            for granule_id in downloaded
+        )
+
+    if "unauthorized" in results.values():
+        print("LANCE refused the token, check the auth_token of the config file")
+        return False
+
+    # The HDF files of the jobs, with the fallbacks
+    hdf_filenames = list(dict.fromkeys(job[0] for job in jobs))
+    failed = [
+        base_HDF_url + "/" + granule_id
+        for granule_id in hdf_filenames
+        if results[granule_id] != "ok"
+    ]
+    if watermark is not None:
+        for granule_id in hdf_filenames:
+            msg = results[granule_id]
+            if msg == "ok":
+                watermark["pending"].pop(granule_id, None)
+                continue
+            # Not on LANCE yet (or a failed download): wait longer every time
+            pending = watermark["pending"].setdefault(granule_id, {"attempts": 0})
+            pending["attempts"] += 1
+            backoff = min(
+                max(interval, 60) * 2 ** (pending["attempts"] - 1),
+                WATCH_MAX_BACKOFF,
+            )
+            pending["next_try"] = now + backoff
+            print(f"{granule_id} {msg}, trying again in {backoff / 60:.0f} min")
+
+    # $ no sense going on without the image you need.
+    if failed and len(failed) == len(hdf_filenames):
+        return False
+
+    if options["state_store"]:
+        state = StateStore(
+            options["state_db"]
+            or os.path.join(
+                os.path.dirname(os.path.abspath(metadata_file)), STATE_DB_FILE
+            )
+        )
+    else:
+        state = None
+
+    try:
+        for granule_id in hdf_filenames:
+            hdf_file = os.path.join(download_HDF_folder, granule_id)
+            if (
+                state is not None
+                and base_HDF_url + "/" + granule_id not in failed
+                and not state.done(granule_id, None, "download", [hdf_file])
+            ):
+                state.record(granule_id, None, "download", [hdf_file])
+
+        for granule_id, upper_left, lower_right, aoi_name in jobs:
+            if base_HDF_url + "/" + granule_id in failed:
+                print(f"Skipping {granule_id}, it could not be downloaded")
+                continue
+            done = process_granule(
+                os.path.join(download_HDF_folder, granule_id),
+                upper_left,
+                lower_right,
+                parameter_file,
+                GeoTIFF_folder,
+                base_filenames,
+                TIFF_Final,
+                HEGTool_directory,
+                MRTBINDIR,
+                PGSHOME,
+                MRTDATADIR,
+                gdal_translate_path,
+                kmz_folder,
+                aoi_name,
+                options["merge_block_size"],
+                options["swath_backend"],
+                options["hegtool_workers"],
+                state,
+                options["kmz_writer"],
+            )
+            if done and watermark is not None:
+                watermark["processed"][watch_key(granule_id, aoi_name)] = now
+    finally:
+        if state is not None:
+            state.close()
+    return True
+
+
+def _watch_watermark(config, options, fingerprint):
+    """
+    The watermark file of a watched job and its watermark, with the
+    processed granules dropped when the settings of the job changed.
+    """
+
+    state_file = options["watch_state_file"] or os.path.join(
+        os.path.dirname(os.path.abspath(config.metadata_file)), WATCH_STATE_FILE
+    )
+    state_file = os.path.abspath(state_file)
+    watermark = read_watermark(state_file)
+    if fingerprint and watermark.get("fingerprint") != fingerprint:
+        if watermark["processed"]:
+            print("The settings changed, the granules are processed again")
+        watermark["processed"] = {}
+        watermark["fingerprint"] = fingerprint
+    return state_file, watermark
+
+
+def watch(config, options, base_filenames, job_name="", fingerprint=None):
+    """
+    This function keeps running the script every watch_interval seconds,
+    processing only the granules that were not processed before. The
+    watermark is saved after every cycle, so a restart carries on where the
+    last run stopped, unless the settings of the job changed since.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values, from getconfig or load_jobs.
+    options : DICT
+        The [Options] values, from getoptions.
+    base_filenames : LIST
+        List of the 3 bands file names.
+    job_name : STRING, optional
+        Name of the job, added to the output file names (see scene_name).
+    fingerprint : STRING, optional
+        The fingerprint of the job settings, from config_fingerprint. The
+        granules processed with other settings are processed again (the
+        StateStore still skips the stages whose inputs did not change).
+
+    Returns
+    -------
+    None.
+
+    """
+
+    state_file, watermark = _watch_watermark(config, options, fingerprint)
+    interval = options["watch_interval"]
+
+    while True:
+        started = time.monotonic()
+        print(f"Watch cycle at {datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC")
+        try:
+            run_cycle(config, options, base_filenames, watermark, interval, job_name)
+        except Exception as e:
+            # Keep watching, the next cycle may work
+            print(f"Error in watch cycle: {e}")
+        write_watermark(state_file, watermark)
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+# Backfill -------------------------------------------------------------------------
+# Set in every process of the backfill pool by _init_scene_worker
+_worker_dir = None
+_worker_state = None
+_scene_options = {}
+
+
+def _init_scene_worker(scratch_root, state_db, stage_log, scene_options):
+    global _worker_dir, _worker_state, _scene_options
+    # Each process gets a working folder of its own
+    _worker_dir = tempfile.mkdtemp(prefix=f"worker_{os.getpid()}_", dir=scratch_root)
+    _worker_state = StateStore(state_db) if state_db else None
+    _scene_options = scene_options
+    set_stage_log(stage_log)
+
+
+def _process_scene(args):
+    try:
+        return process_granule(
+            *args, state=_worker_state, work_dir=_worker_dir, **_scene_options
+        )
+    except Exception as e:
+        print(f"Error processing {os.path.basename(args[0])}: {e}")
+        return False
+
+
+def _absolute_config(config):
+    """
+    config with its paths made absolute, to send them to other processes.
+    Values that are not existing paths (e.g. gdal_translate found on the
+    PATH) are kept as they are.
+    """
+
+    def absolute(path):
+        return os.path.abspath(path) if os.path.exists(path) else path
+
+    config = PipelineConfig(*config)
+    return config._replace(
+        **{
+            name: absolute(getattr(config, name))
+            for name in (
+                "parameter_file",
+                "GeoTIFF_folder",
+                "TIFF_Final",
+                "gdal_translate_path",
+                "HEGTool_directory",
+                "download_HDF_folder",
+                "kmz_folder",
+            )
+        }
+    )
+
+
+def _backfill_metadata(config, start_date, end_date):
+    """
+    The url and file of the metadata file of every day from start_date to
+    end_date, in a backfill folder next to metadata_file. Raises ValueError
+    when a date is not YYYY-MM-DD.
+    """
+
+    first = datetime.strptime(start_date, "%Y-%m-%d")
+    last = datetime.strptime(end_date or start_date, "%Y-%m-%d")
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+    metadata_dir = os.path.join(
+        os.path.dirname(os.path.abspath(config.metadata_file)), "backfill"
+    )
+    os.makedirs(metadata_dir, exist_ok=True)
+    metadata = []
+    for day in days:
+        name = day.strftime("MYD03_%Y-%m-%d.txt")
+        metadata.append(
+            (
+                config.base_txt_url + day.strftime("%Y/") + name,
+                os.path.join(metadata_dir, name),
+            )
+        )
+    return metadata_dir, metadata
+
+
+def _backfill_scenes(config, metadata_files, job_name=""):
+    """
+    The scenes of the metadata files: {HDF file name: [(upper_left,
+    lower_right, scene name), ...]} for every daytime pass over every AOI.
+    """
+
+    kml_AOI_files = [x.strip() for x in config.kml_AOI_file.splitlines() if x.strip()]
+    aois = read_aois(kml_AOI_files)
+    selections = select_granules_for_aois(
+        read_metadata(metadata_files), list(aois.geometry)
+    )
+    jobs = {}
+    for aoi_name, aoi_geometry, selected in zip(aois["name"], aois.geometry, selections):
+        upper_left, lower_right = aoi_corners(aoi_geometry)
+        for granule_id in selected["# GranuleID"]:
+            hdf_filename = granule_to_hdf_filename(str(granule_id))
+            jobs.setdefault(hdf_filename, []).append(
+                (upper_left, lower_right, scene_name(job_name, aoi_name))
+            )
+    print(f"{sum(map(len, jobs.values()))} scenes from {len(jobs)} HDF files")
+    return jobs
+
+
+def _backfill_hdf_url(config, options, hdf_filename):
+    # e.g. backfill_HDF_url = .../allData/61/MYD09/%Y/%j for the archive
+    url = options["backfill_HDF_url"] or config.base_HDF_url
+    return extract_date_from_filename(hdf_filename).strftime(url) + "/" + hdf_filename
+
+
+def _scene_args(config, base_filenames, hdf_filename, upper_left, lower_right, aoi_name):
+    """The arguments of _process_scene for one scene."""
+
+    return (
+        os.path.join(config.download_HDF_folder, hdf_filename),
+        upper_left,
+        lower_right,
+        config.parameter_file,
+        config.GeoTIFF_folder,
+        base_filenames,
+        config.TIFF_Final,
+        config.HEGTool_directory,
+        config.MRTBINDIR,
+        config.PGSHOME,
+        config.MRTDATADIR,
+        config.gdal_translate_path,
+        config.kmz_folder,
+        aoi_name,
+    )
+
+
+@contextmanager
+def _scene_pool(config, options):
+    """
+    The process pool of the backfill scenes, each process in a working
+    folder of its own that is removed at the end.
+    """
+
+    if options["state_store"]:
+        state_db = options["state_db"] or os.path.join(
+            os.path.dirname(os.path.abspath(config.metadata_file)), STATE_DB_FILE
+        )
+        StateStore(state_db).close()  # create the table before the workers start
+    else:
+        state_db = None
+
+    scratch_root = tempfile.mkdtemp(prefix="backfill_")
+    scene_options = {
+        "merge_block_size": options["merge_block_size"],
+        "swath_backend": options["swath_backend"],
+        "hegtool_workers": options["hegtool_workers"],
+        "kmz_writer": options["kmz_writer"],
+    }
+    try:
+        with ProcessPoolExecutor(
+            max_workers=options["backfill_workers"] or None,
+            initializer=_init_scene_worker,
+            initargs=(scratch_root, state_db, _stage_log, scene_options),
+        ) as scene_pool:
+            yield scene_pool
+    finally:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+def backfill(config, options, base_filenames, start_date, end_date, job_name=""):
+    """
+    This function processes every daytime pass over every AOI of the KML
+    file(s) in kml_AOI_file for a range of days. The metadata and HDF files
+    are downloaded by a pool of threads, and each scene (HegTool, merge and
+    KMZ) is processed by a pool of processes as soon as its HDF file is
+    there, each process in its own working folder.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values, from getconfig or load_jobs.
+    options : DICT
+        The [Options] values, from getoptions.
+    base_filenames : LIST
+        List of the 3 bands file names.
+    start_date : STRING
+        First day, YYYY-MM-DD.
+    end_date : STRING
+        Last day, YYYY-MM-DD, included.
+    job_name : STRING, optional
+        Name of the job, added to the output file names (see scene_name).
+
+    Returns
+    -------
+    BOOL
+        False when none of the scenes could be processed.
+
+    """
+
+    # The paths are sent to other processes, so make them absolute
+    config = _absolute_config(config)
+
+    try:
+        metadata_dir, metadata = _backfill_metadata(config, start_date, end_date)
+    except ValueError as e:
+        print(f"Trouble reading backfill_start / backfill_end: {e}")
+        return False
+
+    # One metadata file per day, downloaded at the same time
+    def download_metadata(url, output_file):
+        return download_txt_file(
+            url,
+            config.auth_token,
+            output_file,
+            options["downloader"],
+            os.path.join(metadata_dir, "metadata_cache"),
+        )
+
+    with ThreadPoolExecutor(max_workers=options["download_workers"]) as io_pool:
+        results = list(io_pool.map(download_metadata, *zip(*metadata)))
+    metadata_files = [f for (_, f), result in zip(metadata, results) if result == "ok"]
+    if not metadata_files:
+        print("No metadata file could be downloaded")
+        return False
+
+    jobs = _backfill_scenes(config, metadata_files, job_name)
+    if not jobs:
+        return True
+
+    host_limit = threading.BoundedSemaphore(max(1, options["max_connections_per_host"]))
+
+    def download(hdf_filename):
+        with host_limit:
+            return download_HDF_file(
+                _backfill_hdf_url(config, options, hdf_filename),
+                config.auth_token,
+                config.download_HDF_folder,
+                options["downloader"],
+                options["download_attempts"],
+            )
+
+    done = failed = 0
+    with ThreadPoolExecutor(
+        max_workers=options["download_workers"]
+    ) as io_pool, _scene_pool(config, options) as scene_pool:
+        downloads = {}
+        for hdf_filename in jobs:
+            if os.path.isfile(os.path.join(config.download_HDF_folder, hdf_filename)):
+                future = io_pool.submit(lambda: "ok")
+            else:
+                future = io_pool.submit(download, hdf_filename)
+            downloads[future] = hdf_filename
+
+        scenes = []
+        # Each scene starts as soon as its HDF file is downloaded
+        for future in as_completed(downloads):
+            hdf_filename = downloads[future]
+            if future.result() != "ok":
+                print(f"Skipping {hdf_filename}, it could not be downloaded")
+                failed += len(jobs[hdf_filename])
+                continue
+            for upper_left, lower_right, aoi_name in jobs[hdf_filename]:
+                scenes.append(
+                    scene_pool.submit(
+                        _process_scene,
+                        _scene_args(
+                            config,
+                            base_filenames,
+                            hdf_filename,
+                            upper_left,
+                            lower_right,
+                            aoi_name,
+                        ),
+                    )
+                )
+
+        for future in as_completed(scenes):
+            if future.result():
+                done += 1
+            else:
+                failed += 1
+
+    print(f"Backfill finished: {done} scenes done, {failed} failed")
+    return done > 0 or failed == 0
+
+
+# Asyncio frontend -----------------------------------------------------------------
+# Instead of one thread per download, the asyncio frontend runs all the metadata
+# and HDF downloads on one event loop, with a timeout on every network operation.
+# In a backfill the scenes go to the process pool through a bounded queue, so no
+# more downloads start while the processes are busy. In watch mode the jobs wait
+# for their next cycle on the loop, and their downloads run on it. asyncio is
+# imported in the functions that use it, like the geospatial libraries.
+
+ASYNC_REQUEST_TIMEOUT = 60  # seconds without data before a request is given up
+
+
+class AsyncConnectionPool:
+    """
+    The idle HTTP(S) keep-alive connections of the asyncio frontend, keyed by
+    host, like ConnectionPool. It must only be used by one event loop.
+
+    Parameters
+    ----------
+    maxsize : INT
+        Maximum number of idle connections kept open for each host.
+    timeout : FLOAT
+        Default seconds a request waits for the server, see async_http_get.
+
+    """
+
+    def __init__(self, maxsize=4, timeout=ASYNC_REQUEST_TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+
+    async def get(self, scheme, netloc):
+        """
+        Return an idle (reader, writer) connection to the host, or open a new
+        one, and True if the connection was taken from the pool.
+        """
+
+        idle = self._idle.get((scheme, netloc))
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await self.new(scheme, netloc)
+        return reader, writer, False
+
+    async def new(self, scheme, netloc):
+        """Open a new (reader, writer) connection to the host."""
+
+        import asyncio
+
+        if scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported url scheme: {scheme}")
+        parts = urlsplit(f"//{netloc}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        return await asyncio.open_connection(
+            parts.hostname, port, ssl=True if scheme == "https" else None
+        )
+
+    def put(self, scheme, netloc, reader, writer):
+        """Give a connection back once its response was fully read."""
+
+        idle = self._idle.setdefault((scheme, netloc), [])
+        if len(idle) < self.maxsize:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        """Close every idle connection in the pool."""
+
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for _, writer in conns:
+                writer.close()
+
+
+class _IdleTimer:
+    """
+    Cancels the current task when reset was not called for timeout seconds,
+    and turns that cancellation into asyncio.TimeoutError when leaving the
+    with block. Unlike asyncio.wait_for around every read, it costs nothing
+    per chunk and, before Python 3.12, does not lose a cancellation of the
+    task that comes while a read completes.
+    """
+
+    def __init__(self, timeout):
+        import asyncio
+
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._handle = None
+        self.timeout = timeout
+        self.expired = False
+
+    def reset(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = self._loop.call_later(self.timeout, self._expire)
+
+    def _expire(self):
+        self.expired = True
+        self._task.cancel()
+
+    def __enter__(self):
+        self.reset()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import asyncio
+
+        self._handle.cancel()
+        if self.expired and exc_type is asyncio.CancelledError:
+            if hasattr(self._task, "uncancel"):  # Python 3.11+
+                self._task.uncancel()
+            raise asyncio.TimeoutError(
+                f"no answer from the server for {self.timeout} s"
+            ) from None
+        return False
+
+
+async def _read_response_head(reader):
+    """The status, headers and HTTP version of the next response."""
+
+    while True:
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, _, header_lines = head.partition(b"\r\n")
+        try:
+            version, status = status_line.decode("latin-1").split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line.decode("latin-1")) from None
+        headers = http.client.parse_headers(io.BytesIO(header_lines))
+        # skip the 100 Continue and other informational responses
+        if status >= 200:
+            return status, headers, version
+
+
+async def _iter_body(reader, status, headers, timer):
+    """
+    Async iterator over the body chunks of a response, by Content-Length,
+    chunked transfer encoding or up to the end of the connection. The idle
+    timer is reset after every chunk.
+    """
+
+    import asyncio
+
+    async def read(n):
+        chunk = await reader.read(n)
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", n)
+        timer.reset()
+        return chunk
+
+    if status in (204, 304):
+        return
+    if "chunked" in (headers.get("Transfer-Encoding") or "").lower():
+        while True:
+            size_line = await reader.readline()
+            try:
+                remaining = int(size_line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise http.client.HTTPException("bad chunk size") from None
+            if remaining == 0:
+                # skip the trailer up to the empty line
+                while (await reader.readline()).strip():
+                    pass
+                return
+            while remaining:
+                chunk = await read(min(remaining, HTTP_CHUNK_SIZE))
+                remaining -= len(chunk)
+                yield chunk
+            await reader.readexactly(2)
+    elif headers.get("Content-Length") is not None:
+        remaining = int(headers["Content-Length"])
+        while remaining:
+            chunk = await read(min(remaining, HTTP_CHUNK_SIZE))
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await reader.read(HTTP_CHUNK_SIZE)
+            if not chunk:
+                return
+            timer.reset()
+            yield chunk
+
+
+async def async_http_get(url, headers=None, handle_body=None, pool=None, timeout=None):
+    """
+    Sends a GET request on the event loop and follows redirects, like
+    http_get. The body is passed to handle_body as an async iterator of
+    chunks, so large HDF files are never held in memory.
+
+    Parameters
+    ----------
+    url : STRING
+        The url to request.
+    headers : DICT, optional
+        Extra request headers, e.g. the Authorization header.
+    handle_body : FUNCTION, optional
+        Coroutine function called as handle_body(status, headers, body) when
+        the response status is 2xx.
+    pool : AsyncConnectionPool, optional
+        Pool to use, it must belong to the running event loop. By default a
+        new one, closed at the end.
+    timeout : FLOAT, optional
+        Seconds the request may wait for the server (to connect, to answer,
+        between two chunks), the timeout of the pool by default.
+        asyncio.TimeoutError is raised when it runs out.
+
+    Returns
+    -------
+    status : INT
+        The final HTTP status code.
+    response_headers : http.client.HTTPMessage
+        Headers of the final response.
+
+    """
+
+    import asyncio
+
+    if pool is None:
+        pool = AsyncConnectionPool()
+        try:
+            return await async_http_get(url, headers, handle_body, pool, timeout)
+        finally:
+            pool.close()
+
+    timeout = timeout or pool.timeout
+    headers = dict(headers or {})
+
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request = f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+        request += "Accept-Encoding: identity\r\n"
+        request += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        request = (request + "\r\n").encode("latin-1")
+
+        with _IdleTimer(timeout) as timer:
+            reader, writer, reused = await pool.get(parts.scheme, parts.netloc)
+            try:
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, response_headers, version = await _read_response_head(
+                        reader
+                    )
+                except (
+                    asyncio.IncompleteReadError,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    if not reused:
+                        raise
+                    # The server closed the idle connection, retry once on a
+                    # new one
+                    writer.close()
+                    reader, writer = await pool.new(parts.scheme, parts.netloc)
+                    writer.write(request)
+                    await writer.drain()
+                    status, response_headers, version = await _read_response_head(
+                        reader
+                    )
+                timer.reset()
+
+                body = _iter_body(reader, status, response_headers, timer)
+                if 200 <= status < 300 and handle_body is not None:
+                    await handle_body(status, response_headers, body)
+                # Drain what is left so the connection can be reused
+                async for _ in body:
+                    pass
+
+                will_close = (
+                    version == "HTTP/1.0"
+                    or "close" in (response_headers.get("Connection") or "").lower()
+                    or (
+                        response_headers.get("Content-Length") is None
+                        and "chunked"
+                        not in (response_headers.get("Transfer-Encoding") or "").lower()
+                        and status not in (204, 304)
+                    )
+                )
+                if will_close:
+                    writer.close()
+                else:
+                    pool.put(parts.scheme, parts.netloc, reader, writer)
+
+            except BaseException:
+                # errors, timeouts and cancellation leave the connection in an
+                # unknown state
+                writer.close()
+                raise
+
+        location = response_headers.get("Location")
+        if status in (301, 302, 303, 307, 308) and location:
+            url = urljoin(url, location)
+            continue
+        return status, response_headers
+
+    print(f"Too many redirects while requesting {url}")
+    return 310, None
+
+
+async def async_http_download(
+    url, auth_token, output_file, attempts=3, pool=None, timeout=None
+):
+    """
+    This function downloads a url into a file on the event loop, with the
+    same part-file and Range resume as http_download_resumable.
+
+    Parameters
+    ----------
+    url : STRING
+        The url of the file to download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    output_file : STRING
+        The path and name of the downloaded file.
+    attempts : INT, optional
+        Number of times the download is resumed before giving up.
+    pool : AsyncConnectionPool, optional
+        Pool to use, it must belong to the running event loop. By default a
+        new one, closed at the end.
+    timeout : FLOAT, optional
+        Seconds to wait for each read or write, see async_http_get.
+
+    Returns
+    -------
+    str
+        "ok", "not found", "unavailable" (network or server problem) or
+        another result of download_result.
+
+    """
+
+    import asyncio
+
+    part = _PartFile(url, output_file)
+    result = "error"
+
+    for attempt in range(max(1, attempts)):
+        headers = part.request_headers(auth_token)
+
+        async def write_body(status, response_headers, body):
+            # the local disk is fast enough to write on the event loop
+            with part.receive(status, response_headers) as write:
+                async for chunk in body:
+                    write(chunk)
+
+        try:
+            status, response_headers = await async_http_get(
+                url, headers, write_body, pool, timeout
+            )
+        except (
+            OSError,
+            EOFError,
+            http.client.HTTPException,
+            asyncio.TimeoutError,
+        ) as e:
+            print(f"Download of {url} interrupted ({e!r}), attempt {attempt + 1}")
+            result = "unavailable"
+            continue
+
+        result, again = part.finish(status, response_headers, attempt)
+        if not again:
+            return result
+
+    return result
+
+
+async def async_cached_download(
+    url, auth_token, output_file, cache_dir, pool=None, timeout=None
+):
+    """
+    This function downloads a url through the metadata cache on the event
+    loop, with the same conditional and Range requests as cached_download.
+
+    Parameters
+    ----------
+    url : STRING
+        The url of the file to download.
+    auth_token : STRING
+        Your MODIS authentication token.
+    output_file : STRING
+        The path and name of the file to update with the cached copy.
+    cache_dir : STRING
+        Folder holding the cached copies and their index.
+    pool : AsyncConnectionPool, optional
+        Pool to use, it must belong to the running event loop. By default a
+        new one, closed at the end.
+    timeout : FLOAT, optional
+        Seconds to wait for each read or write, see async_http_get.
+
+    Returns
+    -------
+    str
+        "ok", "not found", "unavailable" (network or server problem) or
+        another result of download_result.
+
+    """
+
+    import asyncio
+
+    copy = _CachedCopy(url, cache_dir)
+
+    async def write_body(status, response_headers, body):
+        with copy.receive(status, response_headers) as write:
+            async for chunk in body:
+                write(chunk)
+
+    try:
+        status, response_headers = await async_http_get(
+            url, copy.request_headers(auth_token), write_body, pool, timeout
+        )
+        if copy.retry_whole(status):
+            # Fall back to downloading the whole file
+            status, response_headers = await async_http_get(
+                url,
+                copy.request_headers(auth_token, conditional=False),
+                write_body,
+                pool,
+                timeout,
+            )
+    except (
+        OSError,
+        EOFError,
+        http.client.HTTPException,
+        asyncio.TimeoutError,
+    ) as e:
+        print(f"Error requesting {url}: {e!r}")
+        return "unavailable"
+
+    return copy.finish(status, response_headers, output_file)
+
+
+class AsyncDownloads:
+    """
+    The downloads of one job on the event loop of the asyncio frontend, with
+    one AsyncConnectionPool and the download_workers and
+    max_connections_per_host limits of its options. It must be created on
+    the running event loop. The coroutines run on that loop; the
+    *_threadsafe methods are for a pipeline running in another thread (a
+    watch cycle), which waits for its downloads to be done on the loop.
+
+    Parameters
+    ----------
+    options : DICT
+        The [Options] values of the job.
+
+    """
+
+    def __init__(self, options):
+        import asyncio
+
+        self.loop = asyncio.get_running_loop()
+        self.timeout = options["request_timeout"]
+        self.attempts = options["download_attempts"]
+        self.max_per_host = max(1, options["max_connections_per_host"])
+        self.pool = AsyncConnectionPool(self.max_per_host, self.timeout)
+        self._workers = asyncio.Semaphore(max(1, options["download_workers"]))
+        self._hosts = {}
+
+    async def _limited(self, url, download, *args):
+        # waits for a free download and a free connection to the host
+        import asyncio
+
+        host = self._hosts.setdefault(
+            urlsplit(url).netloc, asyncio.Semaphore(self.max_per_host)
+        )
+        async with self._workers, host:
+            return await download(*args, self.pool, self.timeout)
+
+    async def download_txt_file(self, url, auth_token, metadata_file, cache_dir=None):
+        """
+        Downloads a metadata file like download_txt_file, through the
+        metadata cache when cache_dir is given.
+        """
+
+        if cache_dir:
+            result = await self._limited(
+                url, async_cached_download, url, auth_token, metadata_file, cache_dir
+            )
+        else:
+            # a new copy every time, like http_download, never resumed
+            part_file = metadata_file + ".part"
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            result = await self._limited(
+                url, async_http_download, url, auth_token, metadata_file, 1
+            )
+            if os.path.exists(part_file):
+                os.remove(part_file)
+        if result == "ok":
+            print("TXT file downloaded successfully.")
+        else:
+            print("Error downloading TXT file:", result)
+        return result
+
+    async def download_HDF_file(self, url, auth_token, download_HDF_folder):
+        """Downloads an HDF file like download_HDF_file."""
+
+        hdf_file = os.path.join(
+            download_HDF_folder, os.path.basename(urlsplit(url).path)
+        )
+        result = await self._limited(
+            url, async_http_download, url, auth_token, hdf_file, self.attempts
+        )
+        print(HDF_RESULT_MESSAGES.get(result, HDF_RESULT_MESSAGES["error"]))
+        return result
+
+    async def download_HDF_files(self, urls, auth_token, download_HDF_folder):
+        """Downloads several HDF files at the same time like download_HDF_files."""
+
+        import asyncio
+
+        results = await asyncio.gather(
+            *(
+                self.download_HDF_file(url, auth_token, download_HDF_folder)
+                for url in urls
+            ),
+            return_exceptions=True,
+        )
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                print(f"Error downloading {url}:", result)
+            elif isinstance(result, BaseException):
+                raise result
+        return {
+            url: "error" if isinstance(result, Exception) else result
+            for url, result in zip(urls, results)
+        }
+
+    def _run_threadsafe(self, coro, files):
+        import asyncio
+
+        # the file locks are held by the waiting thread, like the downloads of
+        # the threads frontend
+        with ExitStack() as locks:
+            for path in files:
+                locks.enter_context(file_lock(path))
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def download_txt_file_threadsafe(
+        self, url, auth_token, metadata_file, cache_dir=None
+    ):
+        """download_txt_file from another thread, see AsyncDownloads."""
+
+        files = [metadata_file]
+        if cache_dir:
+            files.append(
+                os.path.join(cache_dir, os.path.basename(urlsplit(url).path))
+            )
+        return self._run_threadsafe(
+            self.download_txt_file(url, auth_token, metadata_file, cache_dir), files
+        )
+
+    def download_HDF_files_threadsafe(self, urls, auth_token, download_HDF_folder):
+        """download_HDF_files from another thread, see AsyncDownloads."""
+
+        # locked in one order, so two threads never wait for each other
+        files = sorted(
+            os.path.join(download_HDF_folder, os.path.basename(urlsplit(url).path))
+            for url in urls
+        )
+        return self._run_threadsafe(
+            self.download_HDF_files(urls, auth_token, download_HDF_folder), files
+        )
+
+    def close(self):
+        """Close the idle connections."""
+
+        self.pool.close()
+
+
+async def backfill_async(
+    config, options, base_filenames, start_date, end_date, job_name=""
+):
+    """
+    This function does the same as backfill, with the downloads on one
+    asyncio event loop instead of a pool of threads. Every network read and
+    write times out after request_timeout seconds, and the scenes wait in a
+    queue as long as the process pool, so the downloads stop while the
+    processes are busy instead of filling the disk. Cancelling the task (or
+    Ctrl+C under asyncio.run) stops the downloads, keeping their part-files
+    for the next run, and waits for the scenes being processed.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        The config file values, from getconfig or load_jobs.
+    options : DICT
+        The [Options] values, from getoptions.
+    base_filenames : LIST
+        List of the 3 bands file names.
+    start_date : STRING
+        First day, YYYY-MM-DD.
+    end_date : STRING
+        Last day, YYYY-MM-DD, included.
+    job_name : STRING, optional
+        Name of the job, added to the output file names (see scene_name).
+
+    Returns
+    -------
+    BOOL
+        False when none of the scenes could be processed.
+
+    """
+
+    import asyncio
+
+    # The paths are sent to other processes, so make them absolute
+    config = _absolute_config(config)
+
+    try:
+        metadata_dir, metadata = _backfill_metadata(config, start_date, end_date)
+    except ValueError as e:
+        print(f"Trouble reading backfill_start / backfill_end: {e}")
+        return False
+
+    downloads = AsyncDownloads(options)
+    try:
+        # One metadata file per day, downloaded at the same time
+        results = await asyncio.gather(
+            *(
+                downloads.download_txt_file(
+                    url,
+                    config.auth_token,
+                    output_file,
+                    os.path.join(metadata_dir, "metadata_cache"),
+                )
+                for url, output_file in metadata
+            )
+        )
+        metadata_files = [
+            f for (_, f), result in zip(metadata, results) if result == "ok"
+        ]
+        if not metadata_files:
+            print("No metadata file could be downloaded")
+            return False
+
+        loop = asyncio.get_running_loop()
+        jobs = await loop.run_in_executor(
+            None, _backfill_scenes, config, metadata_files, job_name
+        )
+        if not jobs:
+            return True
+
+        workers = options["backfill_workers"] or os.cpu_count() or 1
+        scenes = asyncio.Queue(maxsize=workers)
+        counts = {"done": 0, "failed": 0}
+
+        async def fetch(hdf_filename):
+            try:
+                hdf_file = os.path.join(config.download_HDF_folder, hdf_filename)
+                if not os.path.isfile(hdf_file):
+                    result = await downloads.download_HDF_file(
+                        _backfill_hdf_url(config, options, hdf_filename),
+                        config.auth_token,
+                        config.download_HDF_folder,
+                    )
+                    if result != "ok":
+                        print(f"Skipping {hdf_filename}, it could not be downloaded")
+                        counts["failed"] += len(jobs[hdf_filename])
+                        return
+            except Exception as e:
+                print(f"Error downloading {hdf_filename}: {e}")
+                counts["failed"] += len(jobs[hdf_filename])
+                return
+            for upper_left, lower_right, aoi_name in jobs[hdf_filename]:
+                # waits while every process is busy
+                await scenes.put(
+                    _scene_args(
+                        config,
+                        base_filenames,
+                        hdf_filename,
+                        upper_left,
+                        lower_right,
+                        aoi_name,
+                    )
+                )
+
+        async def process(scene_pool):
+            while True:
+                args = await scenes.get()
+                try:
+                    ok = await loop.run_in_executor(scene_pool, _process_scene, args)
+                    counts["done" if ok else "failed"] += 1
+                finally:
+                    scenes.task_done()
+
+        with _scene_pool(config, options) as scene_pool:
+            processors = [
+                asyncio.ensure_future(process(scene_pool)) for _ in range(workers)
+            ]
+            try:
+                await asyncio.gather(*(fetch(h) for h in jobs))
+                await scenes.join()
+            finally:
+                for task in processors:
+                    task.cancel()
+                await asyncio.gather(*processors, return_exceptions=True)
+    finally:
+        downloads.close()
+
+    print(
+        f"Backfill finished: {counts['done']} scenes done, {counts['failed']} failed"
+    )
+    return counts["done"] > 0 or counts["failed"] == 0
+
+
+async def watch_async(jobs):
+    """
+    This function does the same as watch for several jobs at once, on one
+    asyncio event loop: the waits between the cycles and every download of
+    every job run on the loop, and only the rest of a cycle (granule
+    selection, HegTool, merge and KMZ) runs in a worker thread while the
+    loop waits for it.
+
+    Parameters
+    ----------
+    jobs : LIST
+        Jobs from load_jobs, with watch = true.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+
+    async def watch_job(job):
+        config, options = job.config, job.options
+        base_filenames = parse_base_filenames(config.base_filenames)
+        state_file, watermark = _watch_watermark(config, options, job.fingerprint)
+        interval = options["watch_interval"]
+        downloads = AsyncDownloads(options)
+        try:
+            while True:
+                started = loop.time()
+                print(
+                    f"Watch cycle{' of ' + job.name if job.name else ''} at "
+                    f"{datetime.utcnow():%Y-%m-%d %H:%M:%S} UTC"
+                )
+                try:
+                    await loop.run_in_executor(
+                        None,
+                        lambda: run_cycle(
+                            config,
+                            options,
+                            base_filenames,
+                            watermark,
+                            interval,
+                            job.name,
+                            downloads,
+                        ),
+                    )
+                except Exception as e:
+                    # Keep watching, the next cycle may work
+                    print(f"Error in watch cycle: {e}")
+                write_watermark(state_file, watermark)
+                await asyncio.sleep(max(0, interval - (loop.time() - started)))
+        finally:
+            downloads.close()
+
+    await asyncio.gather(*(watch_job(job) for job in jobs))
+
+
+def parse_base_filenames(base_filenames):
+    """
+    This function splits the base_filenames value of the config file into a
+    list of names, one per line.
+
+    Parameters
+    ----------
+    base_filenames : STRING
+        The base_filenames value of the config file.
+
+    Returns
+    -------
+    LIST
+        List of the 3 bands file names.
+
+    """
+
+    # first put each line in a list and remove spaces, then remove empty rows
+    return [x.strip() for x in base_filenames.splitlines() if x.strip()]
+
+
+def run_job(job):
+    """
+    This function runs one job of the config file in the mode of its
+    options: backfill, watch, or once.
+
+    Parameters
+    ----------
+    job : Job
+        A job from load_jobs.
+
+    Returns
+    -------
+    BOOL
+        False when the job failed, None for a watch that was stopped.
+
+    """
+
+    config, options = job.config, job.options
+    base_filenames = parse_base_filenames(config.base_filenames)
+    if job.name:
+        print(f"Job {job.name} -------------------------")
+    if options["backfill_start"] and options["frontend"] == "asyncio":
+        import asyncio
+
+        return asyncio.run(
+            backfill_async(
+                config,
+                options,
+                base_filenames,
+                options["backfill_start"],
+                options["backfill_end"],
+                job.name,
+            )
+        )
+    if options["backfill_start"]:
+        return backfill(
+            config,
+            options,
+            base_filenames,
+            options["backfill_start"],
+            options["backfill_end"],
+            job.name,
+        )
+    if options["watch"] and options["frontend"] == "asyncio":
+        import asyncio
+
+        return asyncio.run(watch_async([job]))
+    if options["watch"]:
+        return watch(config, options, base_filenames, job.name, job.fingerprint)
+    return run_cycle(config, options, base_filenames, job_name=job.name)
+
+
+def run_pipeline(config, options=None):
+    """
+    This function runs the script once, like the command line without the
+    watch and backfill modes. It never changes the working directory or the
+    environment variables of the process, so several pipelines (e.g. one per
+    AOI) can run at the same time in threads.
+
+    Parameters
+    ----------
+    config : STRING, Job or PipelineConfig
+        Path of the config file (every job of the file is run, one after the
+        other), a job from load_jobs, or the config file values.
+    options : DICT, optional
+        The [Options] values, for a PipelineConfig only. DEFAULT_OPTIONS by
+        default.
+
+    Returns
+    -------
+    BOOL
+        False when none of the HDF files of a job could be downloaded.
+
+    """
+
+    if isinstance(config, str):
+        results = [run_pipeline(job) for job in load_jobs(config)]
+        return False not in results
+    job_name = ""
+    if isinstance(config, Job):
+        config, options, job_name = config.config, config.options, config.name
+    else:
+        config = PipelineConfig(*config)
+        if options is None:
+            options = dict(DEFAULT_OPTIONS)
+
+    return run_cycle(
+        config,
+        options,
+        parse_base_filenames(config.base_filenames),
+        job_name=job_name,
+    )
+
+
+def main():
+    """
+    This ks the main function that runs the script.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    # get the config file name
+    configfile = getargs()
+    # read in the config info and check it before downloading anything
+    try:
+        jobs = load_jobs(configfile)
+    except ConfigError as e:
+        print(f"Trouble with the config file, nothing was done:\n{e}\n")
+        sys.exit(1)
+    config = getconfig(configfile)
+    options = getoptions(configfile)
+
+    for job in jobs:
+        base_filenames = parse_base_filenames(job.config.base_filenames)
+        print(f"{job.name}: {base_filenames}" if job.name else base_filenames)
+
+    if options["stage_log"]:
+        set_stage_log(
+            options["stage_log_file"]
+            or os.path.join(
+                os.path.dirname(os.path.abspath(config.metadata_file)), STAGE_LOG_FILE
+            )
+        )
+
+    def run():
+        if len(jobs) > 1 and any(job.options["watch"] for job in jobs):
+            import asyncio
+
+            # watches never end, so they all run at the same time, the ones of
+            # the asyncio frontend on one event loop
+            looped = [
+                job
+                for job in jobs
+                if job.options["watch"]
+                and job.options["frontend"] == "asyncio"
+                and not job.options["backfill_start"]
+            ]
+            others = [job for job in jobs if job not in looped]
+            with ThreadPoolExecutor(max_workers=len(others) + 1) as executor:
+                futures = [executor.submit(run_job, job) for job in others]
+                if looped:
+                    futures.append(
+                        executor.submit(asyncio.run, watch_async(looped))
+                    )
+                results = [future.result() for future in futures]
+        else:
+            results = [run_job(job) for job in jobs]
+        return False not in results
+
+    if options["profile"]:
+        ok = run_profiled(run, options["profile"], options["profile_output"] or None)
+    else:
+        ok = run()
+    if ok is False:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
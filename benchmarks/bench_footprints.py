@@ -0,0 +1,58 @@
+"""
+Benchmark of the footprint construction used by extract_granule_id.
+
+Compares the original one Polygon per row loop over df_txt.iterrows() with
+the vectorized build_footprints on synthetic geoMeta MYD03 rows (288 granules
+per day) for several numbers of days.
+
+Run from the repository folder:
+    python benchmarks/bench_footprints.py
+"""
+
+import os
+import sys
+import timeit
+
+from shapely.geometry import Polygon
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import idp, synthetic_metadata  # noqa: E402
+
+
+def footprints_iterrows(df_txt):
+    """The original row by row implementation."""
+
+    return [
+        Polygon(
+            [
+                (row["GRingLongitude1"], row["GRingLatitude1"]),
+                (row["GRingLongitude2"], row["GRingLatitude2"]),
+                (row["GRingLongitude3"], row["GRingLatitude3"]),
+                (row["GRingLongitude4"], row["GRingLatitude4"]),
+            ]
+        )
+        for index, row in df_txt.iterrows()
+    ]
+
+
+def main():
+    print(f"{'days':>5} {'rows':>7} {'iterrows (ms)':>14} {'vectorized (ms)':>16} {'speedup':>8}")
+    for days in (1, 7, 30, 90):
+        df = synthetic_metadata(days)
+
+        # both methods must give the same polygons
+        expected = footprints_iterrows(df)
+        result = idp.build_footprints(df)
+        assert all(a.equals_exact(b, 0) for a, b in zip(expected, result))
+
+        repeat = 3
+        t_loop = min(timeit.repeat(lambda: footprints_iterrows(df), number=1, repeat=repeat))
+        t_vec = min(timeit.repeat(lambda: idp.build_footprints(df), number=1, repeat=repeat))
+        print(
+            f"{days:>5} {len(df):>7} {t_loop * 1000:>14.1f} {t_vec * 1000:>16.2f}"
+            f" {t_loop / t_vec:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
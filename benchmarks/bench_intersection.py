@@ -0,0 +1,69 @@
+"""
+Benchmark of the granule vs AOI intersection.
+
+Compares a brute force gdf[gdf.intersects(aoi)] for every AOI with the
+STRtree query of select_granules_for_aois, for dozens of AOIs against weeks
+of synthetic geoMeta rows.
+
+Run from the repository folder:
+    python benchmarks/bench_intersection.py
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import idp, synthetic_metadata  # noqa: E402
+
+
+def synthetic_aois(count, seed=1):
+    """Random small field camp boxes, about 1 by 0.5 degrees."""
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-140, 140, count)
+    y = rng.uniform(55, 80, count)
+    return list(shapely.box(x, y, x + 1, y + 0.5))
+
+
+def brute_force(df_txt, aois):
+    """Every footprint tested against every AOI."""
+
+    gdf = gpd.GeoDataFrame(
+        df_txt, geometry=idp.build_footprints(df_txt), crs="EPSG:4326"
+    )
+    selections = []
+    for aoi in aois:
+        selected = gdf[gdf.intersects(aoi)]
+        selected = selected[selected.DayNightFlag == "D"]
+        selections.append(selected.reset_index(drop=True))
+    return selections
+
+
+def main():
+    print(f"{'days':>5} {'AOIs':>5} {'brute force (ms)':>17} {'STRtree (ms)':>13} {'speedup':>8}")
+    for days, n_aois in ((1, 1), (7, 12), (30, 36), (90, 48)):
+        df = synthetic_metadata(days)
+        aois = synthetic_aois(n_aois)
+
+        expected = brute_force(df, aois)
+        result = idp.select_granules_for_aois(df, aois)
+        for a, b in zip(expected, result):
+            assert list(a["# GranuleID"]) == list(b["# GranuleID"])
+
+        t_brute = min(timeit.repeat(lambda: brute_force(df, aois), number=1, repeat=3))
+        t_tree = min(
+            timeit.repeat(lambda: idp.select_granules_for_aois(df, aois), number=1, repeat=3)
+        )
+        print(
+            f"{days:>5} {n_aois:>5} {t_brute * 1000:>17.1f} {t_tree * 1000:>13.1f}"
+            f" {t_brute / t_tree:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+End to end benchmark of the pipeline stages on synthetic data, offline.
+
+Times at several scales, with the fixtures of benchmarks/fixtures.py:
+    - extract_granule_id on 1 to 30 days of geoMeta rows,
+    - merge_raster (in one go and tiled) on int16 bands with no data,
+    - write_kmz_superoverlay, and convert_to_kmz when gdal_translate is found,
+    - http_download, download_HDF_files (threads and asyncio) and
+      download_txt_file (full and cached) against a local LANCE stand-in
+      server, which also checks the token and 404 handling.
+
+Run from the repository folder:
+    python benchmarks/bench_pipeline.py [--quick] [--delay SECONDS]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(__file__))
+import fixtures  # noqa: E402
+from fixtures import idp  # noqa: E402
+
+
+def quiet(func):
+    """func with its progress messages hidden."""
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+
+    return run
+
+
+def best(func, repeat=3):
+    """Best wall time of func in ms, without its progress messages."""
+
+    return min(timeit.repeat(quiet(func), number=1, repeat=repeat)) * 1000
+
+
+def bench_selection(tmp, scales):
+    print(f"{'days':>5} {'rows':>7} {'extract_granule_id (ms)':>24}  granule")
+    kml = fixtures.write_aoi_kml(os.path.join(tmp, "aoi.kml"))
+    for days in scales:
+        df = fixtures.synthetic_metadata(days)
+        metadata = fixtures.write_metadata_file(
+            os.path.join(tmp, f"MYD03_{days}d.txt"), df
+        )
+        granule_id, _, _ = quiet(lambda: idp.extract_granule_id(metadata, kml, ""))()
+        t = best(lambda: idp.extract_granule_id(metadata, kml, ""))
+        print(f"{days:>5} {len(df):>7} {t:>24.1f}  {granule_id}")
+
+
+def bench_merge(tmp, scales):
+    print(f"{'size':>11} {'merge_raster (ms)':>18} {'tiled 512 (ms)':>15}")
+    for height, width in scales:
+        bands = fixtures.write_band_geotiffs(tmp, height, width)
+        output = os.path.join(tmp, f"rgb_{height}x{width}.tif")
+        t_full = best(lambda: idp.merge_raster(*bands, output), repeat=2)
+        t_tiled = best(lambda: idp.merge_raster(*bands, output, 512), repeat=2)
+        print(f"{height:>5}x{width:<5} {t_full:>18.1f} {t_tiled:>15.1f}")
+    return output
+
+
+def bench_kmz(tmp, rgb):
+    kmz = os.path.join(tmp, "rgb.kmz")
+    t = best(lambda: idp.write_kmz_superoverlay(rgb, kmz), repeat=2)
+    print(f"write_kmz_superoverlay: {t:.1f} ms, {os.path.getsize(kmz) / 2**20:.1f} MB")
+
+    gdal_translate = shutil.which("gdal_translate")
+    if gdal_translate is None:
+        print("convert_to_kmz: skipped, gdal_translate not found")
+        return
+    kml = os.path.join(tmp, "KMZ", "rgb.kml")
+    os.makedirs(os.path.dirname(kml), exist_ok=True)
+    t = best(lambda: idp.convert_to_kmz(rgb, kml, gdal_translate), repeat=2)
+    print(f"convert_to_kmz: {t:.1f} ms")
+
+
+def bench_downloads(tmp, sizes_mb, files, delay):
+    token = fixtures.TOKEN
+    with fixtures.LanceStandIn(delay=delay) as lance:
+        # token, missing file and redirect handling
+        url = lance.add("/archives/check.hdf", b"x" * 100)
+        missing = lance.url + "/archives/missing.hdf"
+        redirect = lance.url + "/redirect/archives/check.hdf"
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert idp.http_download(url, "wrong", os.path.join(tmp, "a")) == "unauthorized"
+            assert idp.http_download(missing, token, os.path.join(tmp, "b")) == "not found"
+            assert idp.http_download(redirect, token, os.path.join(tmp, "c")) == "ok"
+
+        print(f"{'size (MB)':>9} {'http_download (ms)':>19} {'MB/s':>7}")
+        for size in sizes_mb:
+            body = fixtures.synthetic_hdf_bytes(size << 20)
+            url = lance.add(f"/archives/file_{size}MB.hdf", body)
+            output = os.path.join(tmp, f"file_{size}MB.hdf")
+            t = best(lambda: idp.http_download(url, token, output))
+            assert os.path.getsize(output) == len(body)
+            print(f"{size:>9} {t:>19.1f} {size / t * 1000:>7.0f}")
+
+        hdf_dir = os.path.join(tmp, "HDF")
+        urls = [
+            lance.add(
+                f"/archives/MYD09.A2024100.{1900 + i:04d}.061.NRT.hdf",
+                fixtures.synthetic_hdf_bytes(4 << 20, seed=i),
+            )
+            for i in range(files)
+        ]
+        print(f"\n{files} HDF files of 4 MB, {delay * 1000:.0f} ms per request")
+        print(f"{'workers':>7} {'download_HDF_files (ms)':>24}")
+        for workers in (1, 4):
+
+            def run():
+                shutil.rmtree(hdf_dir, ignore_errors=True)
+                os.makedirs(hdf_dir)
+                results = idp.download_HDF_files(
+                    urls + [missing], token, hdf_dir, "native", workers, workers
+                )
+                assert results[missing] == "not found"
+                assert sum(r == "ok" for r in results.values()) == files
+
+            print(f"{workers:>7} {best(run, repeat=2):>24.1f}")
+
+        print(f"{'workers':>7} {'async_http_download (ms)':>24}")
+        for workers in sorted({1, 4, files}):
+
+            async def fetch_all():
+                pool = idp.AsyncConnectionPool(workers)
+                limit = asyncio.Semaphore(workers)
+
+                async def fetch(url):
+                    output = os.path.join(hdf_dir, os.path.basename(url))
+                    async with limit:
+                        return await idp.async_http_download(url, token, output, 3, pool)
+
+                try:
+                    return await asyncio.gather(*(fetch(url) for url in urls + [missing]))
+                finally:
+                    pool.close()
+
+            def run_async():
+                shutil.rmtree(hdf_dir, ignore_errors=True)
+                os.makedirs(hdf_dir)
+                results = asyncio.run(fetch_all())
+                assert results == ["ok"] * files + ["not found"]
+
+            print(f"{workers:>7} {best(run_async, repeat=2):>24.1f}")
+
+        df = fixtures.synthetic_metadata(7)
+        metadata = fixtures.write_metadata_file(os.path.join(tmp, "geoMeta.txt"), df)
+        with open(metadata, "rb") as file:
+            txt_url = lance.add("/geoMeta/MYD03_2024-04-09.txt", file.read())
+        output = os.path.join(tmp, "MYD03.txt")
+        cache = os.path.join(tmp, "metadata_cache")
+        t_full = best(lambda: idp.download_txt_file(txt_url, token, output))
+        quiet(lambda: idp.download_txt_file(txt_url, token, output, "native", cache))()
+        t_cached = best(lambda: idp.download_txt_file(txt_url, token, output, "native", cache))
+        size = os.path.getsize(output) / 2**20
+        print(f"\ndownload_txt_file ({size:.1f} MB): {t_full:.1f} ms, cached {t_cached:.1f} ms")
+        print(f"{lance.requests} requests served")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true", help="small scales only")
+    parser.add_argument(
+        "--delay", type=float, default=0.02, help="seconds added to every request"
+    )
+    args = parser.parse_args()
+
+    if args.quick:
+        days, sizes, mbs, files = (1, 7), ((500, 500), (1500, 1500)), (1, 8), 4
+    else:
+        days = (1, 7, 30)
+        sizes = ((500, 500), (2000, 2000), (4000, 4000))
+        mbs, files = (1, 16, 64), 8
+
+    tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        bench_selection(tmp, days)
+        print()
+        rgb = bench_merge(tmp, sizes)
+        print()
+        bench_kmz(tmp, rgb)
+        print()
+        bench_downloads(tmp, mbs, files, args.delay)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
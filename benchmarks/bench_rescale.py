@@ -0,0 +1,58 @@
+"""
+Microbenchmark of the rescaling to byte done by merge_raster.
+
+Compares the original masked array version (np.stack, np.ma.masked_equal,
+np.min / np.max called twice, float64 temporaries) with valid_min_max and
+rescale_to_byte on synthetic int16 bands with the -28672 no data value.
+
+Run from the repository folder:
+    python benchmarks/bench_rescale.py
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import idp, synthetic_bands  # noqa: E402
+
+
+def rescale_legacy(b1, b2, b3):
+    """The original merge_raster rescaling."""
+
+    b123 = np.stack([b1, b2, b3], axis=-1)
+    b123masked = np.ma.masked_equal(b123, idp.NODATA_VALUE)
+    scaled = (
+        (b123masked - np.min(b123masked))
+        * (1 / (np.max(b123masked) - np.min(b123masked)) * 255)
+    ).astype("uint8")
+    return scaled.filled(0)
+
+
+def rescale_new(b123, out):
+    vmin, vmax = idp.valid_min_max(b123)
+    return idp.rescale_to_byte(b123, vmin, vmax, out=out)
+
+
+def main():
+    print(f"{'size':>11} {'legacy (ms)':>12} {'new (ms)':>9} {'speedup':>8} {'max diff':>9}")
+    for height, width in ((500, 500), (1500, 2300), (4000, 4000)):
+        b123 = synthetic_bands(height, width)
+        out = np.empty(b123.shape, dtype="uint8")
+
+        legacy = np.moveaxis(rescale_legacy(*b123), -1, 0)
+        new = rescale_new(b123, out)
+        diff = np.abs(legacy.astype(int) - new.astype(int)).max()
+
+        t_legacy = min(timeit.repeat(lambda: rescale_legacy(*b123), number=1, repeat=3))
+        t_new = min(timeit.repeat(lambda: rescale_new(b123, out), number=1, repeat=3))
+        print(
+            f"{height:>5}x{width:<5} {t_legacy * 1000:>12.1f} {t_new * 1000:>9.1f}"
+            f" {t_legacy / t_new:>7.1f}x {diff:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
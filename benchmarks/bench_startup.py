@@ -0,0 +1,82 @@
+"""
+Startup time benchmark of ImageDownloaderProject.
+
+Measures, in fresh python processes:
+    - the import of the module with python -X importtime, and the slowest
+      packages it imports,
+    - the import with the geospatial libraries loaded up front, as the module
+      used to do at the top of the file,
+    - the full `ImageDownloaderProject.py --help` command.
+
+Run from the repository folder:
+    python benchmarks/bench_startup.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = "import numpy, pandas, geopandas, shapely, fiona, rasterio"
+
+
+def import_times(code):
+    """
+    Runs code in a new python with -X importtime and returns the total
+    import time and the cumulative time of each top level package, in ms.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue  # header line
+        name = fields[2].rstrip()
+        # top level imports are the ones without indentation
+        if not name.startswith("  "):
+            packages[name.strip()] = cumulative / 1000
+    return sum(packages.values()), packages
+
+
+def wall_time(args, repeat=3):
+    """Best wall time in ms of a command run in the repository folder."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=ROOT, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    lazy, packages = import_times("import ImageDownloaderProject")
+    eager, _ = import_times(f"{HEAVY}; import ImageDownloaderProject")
+
+    print("Slowest top level imports (cumulative ms):")
+    for name, ms in sorted(packages.items(), key=lambda x: -x[1])[:8]:
+        print(f"  {name:<30} {ms:>8.1f}")
+    print()
+    print(f"{'import, lazy (ms)':<32} {lazy:>8.1f}")
+    print(f"{'import, libraries up front (ms)':<32} {eager:>8.1f}")
+    print(f"{'speedup':<32} {eager / lazy:>7.1f}x")
+    print()
+    help_ms = wall_time([sys.executable, "ImageDownloaderProject.py", "--help"])
+    print(f"{'--help wall time (ms)':<32} {help_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
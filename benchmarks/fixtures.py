@@ -0,0 +1,246 @@
+"""
+Synthetic MODIS fixtures shared by the benchmarks.
+
+    - geoMeta MYD03 metadata rows and text files,
+    - KML area of interest files,
+    - int16 band GeoTIFFs with the -28672 no data value, as written by the
+      HegTool,
+    - LanceStandIn, a local HTTP server imitating the LANCE NRT API: bearer
+      token check, 404 for missing files, redirects, ETag / If-None-Match and
+      Range requests, with an optional delay per request to imitate the
+      network.
+
+Nothing here needs a network connection, an Earthdata token or the HegTool.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import ImageDownloaderProject as idp  # noqa: E402
+
+GRANULES_PER_DAY = 288
+# Cambridge Bay, the AOI of cambridge.kml
+AOI_BOUNDS = (-115.5, 66.2, -93.5, 73.0)
+TOKEN = "benchmark-token"
+
+
+def synthetic_metadata(days, seed=0, start=datetime(2024, 4, 9)):
+    """
+    Builds a DataFrame shaped like a geoMeta MYD03 file, one granule every
+    5 minutes, with random footprints that do not cross the antimeridian.
+    Every 24th granule is a daytime pass over AOI_BOUNDS, so the AOI always
+    has matches.
+    """
+
+    rng = np.random.default_rng(seed)
+    n = days * GRANULES_PER_DAY
+    times = [start + timedelta(minutes=5 * i) for i in range(n)]
+    lon0 = rng.uniform(-165, 145, n)
+    lat0 = rng.uniform(-80, 62, n)
+    skew = rng.uniform(-3, 3, n)
+    flag = rng.choice(["D", "N"], n)
+    over_aoi = np.arange(n) % 24 == 12
+    lon0[over_aoi] = AOI_BOUNDS[0] - 2
+    lat0[over_aoi] = AOI_BOUNDS[1] - 1
+    flag[over_aoi] = "D"
+    df = pd.DataFrame(
+        {
+            "# GranuleID": [
+                t.strftime("MYD03.A%Y%j.%H%M.061.NRT.hdf") for t in times
+            ],
+            "StartDateTime": [t.strftime("%Y-%m-%d %H:%M") for t in times],
+            "DayNightFlag": flag,
+            "GRingLongitude1": lon0 + skew,
+            "GRingLongitude2": lon0 + 20 + skew,
+            "GRingLongitude3": lon0 + 20 - skew,
+            "GRingLongitude4": lon0 - skew,
+            "GRingLatitude1": lat0 + 18,
+            "GRingLatitude2": lat0 + 18,
+            "GRingLatitude3": lat0,
+            "GRingLatitude4": lat0,
+        }
+    )
+    return df
+
+
+def write_metadata_file(path, df):
+    """Writes df as a geoMeta text file, with its 2 comment lines."""
+
+    with open(path, "w", newline="") as file:
+        file.write("# Synthetic geoMeta MYD03 file\n")
+        file.write("# generated by benchmarks/fixtures.py\n")
+        df.to_csv(file, index=False)
+    return path
+
+
+def write_aoi_kml(path, bounds=AOI_BOUNDS, name="benchmark_aoi"):
+    """Writes a KML file with one polygon placemark covering bounds."""
+
+    xmin, ymin, xmax, ymax = bounds
+    ring = " ".join(
+        f"{x},{y},0"
+        for x, y in ((xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin))
+    )
+    with open(path, "w") as file:
+        file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+            f"<Placemark><name>{name}</name><Polygon><outerBoundaryIs>"
+            f"<LinearRing><coordinates>{ring}</coordinates></LinearRing>"
+            "</outerBoundaryIs></Polygon></Placemark></Document></kml>\n"
+        )
+    return path
+
+
+def synthetic_bands(height, width, seed=0):
+    """3 int16 bands with surface reflectance like values and no data areas."""
+
+    rng = np.random.default_rng(seed)
+    bands = rng.integers(-100, 9000, (3, height, width)).astype("int16")
+    bands[:, : height // 8, : width // 8] = idp.NODATA_VALUE
+    bands[rng.random((3, height, width)) < 0.01] = idp.NODATA_VALUE
+    return bands
+
+
+def write_band_geotiffs(folder, height, width, seed=0):
+    """
+    Writes 3 single band int16 GeoTIFFs (lat/lon, no data -28672) like the
+    HegTool outputs and returns their paths.
+    """
+
+    import rasterio
+    from rasterio.transform import from_origin
+
+    bands = synthetic_bands(height, width, seed)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "int16",
+        "count": 1,
+        "width": width,
+        "height": height,
+        "crs": "EPSG:4326",
+        "transform": from_origin(AOI_BOUNDS[0], AOI_BOUNDS[3], 0.005, 0.005),
+        "nodata": idp.NODATA_VALUE,
+    }
+    paths = []
+    for name, band in zip(("Band1", "Band4", "Band3"), bands):
+        path = os.path.join(folder, f"synthetic_{name}_{height}x{width}.tif")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(band, 1)
+        paths.append(path)
+    return paths
+
+
+def synthetic_hdf_bytes(size, seed=0):
+    """Random bytes standing in for an HDF file."""
+
+    return np.random.default_rng(seed).bytes(size)
+
+
+class _LanceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _empty(self, status, **headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name.replace("_", "-"), value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.delay:
+            time.sleep(server.delay)
+        if self.headers.get("Authorization") != f"Bearer {server.token}":
+            return self._empty(401)
+        path = self.path
+        if path.startswith("/redirect"):
+            return self._empty(302, Location=path[len("/redirect"):])
+        body = server.files.get(path)
+        if body is None:
+            return self._empty(404)
+        etag = f'"{len(body)}-{hash(body) & 0xFFFFFFFF:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._empty(304, ETag=etag)
+
+        start = 0
+        status = 200
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            start = int(byte_range.split("=", 1)[1].split("-", 1)[0])
+            if start >= len(body):
+                return self._empty(416, Content_Range=f"bytes */{len(body)}")
+            status = 206
+        self.send_response(status)
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        view = memoryview(body)[start:]
+        for i in range(0, len(view), 1 << 16):
+            self.wfile.write(view[i:i + (1 << 16)])
+
+
+class LanceStandIn:
+    """
+    A local HTTP server imitating the LANCE NRT API.
+
+    Parameters
+    ----------
+    token : STRING
+        Bearer token the server accepts, other tokens get a 401.
+    delay : FLOAT
+        Seconds added to every request, to imitate the network latency.
+
+    Use as a context manager; files are served from the files dict, keyed by
+    url path (e.g. "/archives/MYD09/MYD09.A2024100.1900.061.NRT.hdf").
+    """
+
+    def __init__(self, token=TOKEN, delay=0.0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _LanceHandler)
+        self.server.daemon_threads = True
+        self.server.token = token
+        self.server.delay = delay
+        self.server.files = {}
+        self.server.requests = 0
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def files(self):
+        return self.server.files
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def add(self, path, body):
+        """Serves body at path and returns its full url."""
+
+        self.server.files[path] = body
+        return self.url + path
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        # connections to the closed server are stale now
+        idp.HTTP_POOL.close()
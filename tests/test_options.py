@@ -0,0 +1,58 @@
+"""
+Tests of the [Options] values read from the config file.
+
+Run from the repository folder:
+    python -m pytest tests
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ImageDownloaderProject as idp  # noqa: E402
+
+CONFIG_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.cfg"
+)
+
+
+def write_config(tmp_path, **values):
+    """The config.cfg of the repository with some [Options] values changed."""
+
+    with open(CONFIG_FILE, "r") as file:
+        text = file.read()
+    for name, value in values.items():
+        text, count = re.subn(
+            rf"^{name} =.*$", f"{name} = {value}", text, flags=re.MULTILINE
+        )
+        assert count == 1, name
+    cfg = tmp_path / "config.cfg"
+    cfg.write_text(text)
+    return str(cfg)
+
+
+def test_fractional_retry_options(tmp_path):
+    cfg = write_config(
+        tmp_path, retry_deadline="90.5", retry_delay="0.5", retry_max_delay="2.5"
+    )
+    _, options, _ = idp.read_config(cfg)
+
+    assert options["retry_deadline"] == 90.5
+    assert options["retry_delay"] == 0.5
+    assert options["retry_max_delay"] == 2.5
+    assert idp.RetryPolicy.from_options(options) == idp.RetryPolicy(90.5, 0.5, 2.5)
+
+
+def test_whole_retry_options_are_floats(tmp_path):
+    _, options, _ = idp.read_config(write_config(tmp_path, retry_delay="30"))
+
+    assert options["retry_delay"] == 30.0
+    assert isinstance(options["retry_delay"], float)
+
+
+def test_fractional_request_timeout(tmp_path):
+    _, options, _ = idp.read_config(write_config(tmp_path, request_timeout="2.5"))
+
+    assert options["request_timeout"] == 2.5